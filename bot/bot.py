@@ -1,32 +1,93 @@
 from datetime import datetime
+import functools
 import os
 from pathlib import Path
 from dateutil import tz
 from appdirs import user_data_dir
 import discord
+from components.api_fetcher.api_fetcher import BUNGIE_API_ENDPOINT
+from components.api_fetcher.api_fetcher import DESTINY_2_CLANS_WATCHLIST
 from components.api_fetcher.api_fetcher import Fetcher
+from components.api_fetcher.api_fetcher import FetcherOptions
+from components.api_fetcher.response_cache import ResponseCache
 from components.img_generator.img_generator import Generator
 from components.intent_parser.intent_parser import Parser
+from components.intent_parser.intent_parser import UnknownGamerTagError
 from components.intent_executor.intent_executor import Executor
-from components.storage.storage import Storage
-from protos.schedule_pb2 import Schedule
+from components.storage.clan_cache import ClanCache
+from components.storage.guild_cache import GuildCache
+from components.storage.guild_cache import StorageBackend
+from components.storage.sqlite_storage import migrate_guilds
+from components.sync_scheduler.sync_scheduler import SchedulerOptions
+from components.sync_scheduler.sync_scheduler import SyncScheduler
 
 CORTANA_BUNGIE_API_KEY = os.environ.get('CORTANA_BUNGIE_API_KEY', '')
+# Can point the bot at a local FakeBungieServer.
+CORTANA_BUNGIE_API_ENDPOINT = os.environ.get('CORTANA_BUNGIE_API_ENDPOINT', BUNGIE_API_ENDPOINT)
 CORTANA_DISCORD_TOKEN = os.environ.get('CORTANA_DISCORD_TOKEN', '')
 ROOT_DIRECTORY = Path(user_data_dir('cortana-destiny-discord', 'WalOby')) \
     .joinpath(CORTANA_DISCORD_TOKEN) \
     .joinpath(CORTANA_BUNGIE_API_KEY)
+HTTP_CACHE_DIRECTORY = ROOT_DIRECTORY.joinpath('http_cache')
+CLAN_CACHE_DIRECTORY = ROOT_DIRECTORY.joinpath('clans')
+ACTIVITY_INDEX_FILE = ROOT_DIRECTORY.joinpath('activity_index.dat')
+# 'files' stores each guild in its own directory, 'journal' does too but appends schedule changes
+# to a journal instead of rewriting the schedule, 'sqlite' stores every guild in a single
+# database. Guilds stored in files are migrated to the database at startup.
+CORTANA_STORAGE_BACKEND = os.environ.get('CORTANA_STORAGE_BACKEND', 'files')
+STORAGE_DATABASE_FILE = ROOT_DIRECTORY.joinpath('storage.sqlite')
+# Syncs requested by any guild within that many seconds of the previous one get its result.
+SYNC_FRESHNESS_SECONDS = 60
+SYNC_DEADLINE_SECONDS = 120
+# Players missing from the bundle that a single message may look up on Bungie.
+MAX_PLAYER_LOOKUPS_PER_MESSAGE = 3
+# Every cached clan is refreshed in the background about once per that many seconds. 0 disables
+# background syncs.
+CORTANA_SYNC_PERIOD_SECONDS = int(os.environ.get('CORTANA_SYNC_PERIOD_SECONDS', 6 * 3600))
 TIMEZONE = tz.gettz('Europe/Paris')
 LOCALE = 'fr'
 
 
 class Bot(discord.Client):
-    """Discord client that handles events. Single threaded."""
+    """
+    Discord client that handles events. Single threaded, except for the storage calls that run in
+    a thread pool. Commands overlap, even within a guild: syncs and player lookups await Bungie
+    without holding up the other commands, and each read-modify-write of the storage of a guild
+    runs alone, see AsyncStorage.mutate.
+    """
 
     def __init__(self):
         super().__init__()
         self.__generator = Generator(TIMEZONE, LOCALE)
-        self.__fetcher = Fetcher(CORTANA_BUNGIE_API_KEY)
+        self.__fetcher = Fetcher(CORTANA_BUNGIE_API_KEY, FetcherOptions(
+            response_cache=ResponseCache(HTTP_CACHE_DIRECTORY),
+            sync_freshness_seconds=SYNC_FRESHNESS_SECONDS,
+            sync_deadline_seconds=SYNC_DEADLINE_SECONDS,
+            activity_index_path=ACTIVITY_INDEX_FILE,
+            endpoint=CORTANA_BUNGIE_API_ENDPOINT
+        ))
+        self.__clan_cache = ClanCache(CLAN_CACHE_DIRECTORY)
+        if CORTANA_STORAGE_BACKEND == 'sqlite':
+            migrated_guild_ids = migrate_guilds(
+                ROOT_DIRECTORY, STORAGE_DATABASE_FILE, Executor.apply_activity_intent
+            )
+            print(f"Serveurs migrés vers SQLite: {len(migrated_guild_ids)}.")
+            backend = StorageBackend(ROOT_DIRECTORY, database_path=STORAGE_DATABASE_FILE)
+        elif CORTANA_STORAGE_BACKEND == 'journal':
+            backend = StorageBackend(ROOT_DIRECTORY, apply_intent=Executor.apply_activity_intent)
+        else:
+            # Journals left by the 'journal' backend are folded into the schedule files.
+            backend = StorageBackend(
+                ROOT_DIRECTORY, apply_intent=Executor.apply_activity_intent, journaled=False
+            )
+        self.__guild_cache = GuildCache(backend)
+        self.__sync_scheduler = SyncScheduler(
+            self.__fetcher, self.__clan_cache,
+            SchedulerOptions(period_seconds=CORTANA_SYNC_PERIOD_SECONDS, timezone=TIMEZONE),
+            watched_clans=functools.partial(
+                self.__guild_cache.watched_clan_ids, DESTINY_2_CLANS_WATCHLIST
+            )
+        ) if CORTANA_SYNC_PERIOD_SECONDS > 0 else None
         self.__parser = Parser(LOCALE)
         self.has_been_ready_once = False
 
@@ -36,9 +97,21 @@ class Bot(discord.Client):
             self.has_been_ready_once = True
             print("Le bot est désormais connecté.")
             print(f"Nom d'utilisateur: {self.user.name}.")
+            if self.__sync_scheduler is not None:
+                self.__sync_scheduler.start()
         else:
             print("Le bot vient de se reconnecter.")
 
+    async def close(self):
+        """
+        Called when the bot shuts down. Stops the background syncs and releases the pooled Bungie
+        connections.
+        """
+        if self.__sync_scheduler is not None:
+            self.__sync_scheduler.stop()
+        await self.__fetcher.close_async()
+        await super().close()
+
     async def on_message(self, message):
         """Called when a message is received. Wraps around |handle_message|."""
         try:
@@ -56,37 +129,43 @@ class Bot(discord.Client):
         print(message.author)
         print(message.content)
 
-        # Init storage for current guild.
+        # Init storage for current guild. Each update of the guild's protos is a single mutate
+        # call: commands of the guild overlap without losing each other's updates.
+        async_storage = self.__guild_cache.async_storage(message.guild.id)
         now = datetime.now(TIMEZONE)
-        storage = Storage(ROOT_DIRECTORY.joinpath(str(message.guild.id)))
-
-        # Make sure a basic bundle is available.
-        bundle = None
-        try:
-            bundle = storage.read_api_bundle()
-        except:
+        executor = Executor(
+            async_storage.storage(), self.__fetcher, self.__generator, self.__clan_cache
+        )
+
+        # Make sure a basic bundle is available. Clans already synced for other guilds are
+        # reused.
+        missing_clan_ids = await async_storage.run(executor.missing_clan_ids)
+        if missing_clan_ids:
             await self.answer_message(
                 "Une synchronisation des joueurs doit être effectuée.\nVeuillez patienter...",
                 message
             )
-            bundle = self.__fetcher.fetch(now)
-            storage.write_api_bundle(bundle)
+            await executor.sync_async(now, missing_clan_ids, async_storage.mutate)
+            self.print_fetcher_stats()
             await self.answer_message("Synchronisation terminée", message)
 
         # Make sure a basic schedule is available.
         try:
-            storage.read_schedule()
+            await async_storage.read_schedule()
         except:
-            storage.write_schedule(Schedule())
+            await async_storage.mutate(executor.create_schedule)
 
         # Parse intent.
-        intent = self.__parser.parse(message.content, bundle, now)
+        intent = await self.parse_message(message, executor, async_storage, now)
 
         # Execute intent.
         if intent.HasField('global_intent') and intent.global_intent.sync_bundle:
-            await self.answer_message("Synchronisation en cours.\nVeuillez patienter...", message)
-        executor = Executor(storage, self.__fetcher, self.__generator)
-        (feedback, images) = executor.execute(intent, now)
+            await self.answer_message(
+                "Synchronisation en cours.\nVeuillez patienter...", message
+            )
+        (feedback, images) = await executor.execute_async(intent, now, async_storage.mutate)
+        if intent.HasField('global_intent') and intent.global_intent.sync_bundle:
+            self.print_fetcher_stats()
 
         # Post message.
         await self.answer_message(feedback, message)
@@ -98,6 +177,34 @@ class Bot(discord.Client):
             file = discord.File(fp=image, filename="Affiche"+str(index)+".gif")
             await message.channel.send(file=file)
 
+    async def parse_message(self, message, executor, async_storage, now):
+        """
+        Parses |message| against the API Bundle of the guild. Players missing from the bundle are
+        looked up on Bungie, then the message is parsed again.
+        :return: The parsed intent.
+        :raises: If the message cannot be parsed.
+        """
+        looked_up_words = []
+        while True:
+            bundle = await async_storage.run(executor.read_api_bundle)
+            try:
+                return self.__parser.parse(message.content, bundle, now)
+            except UnknownGamerTagError as error:
+                if error.words in looked_up_words or \
+                        len(looked_up_words) >= MAX_PLAYER_LOOKUPS_PER_MESSAGE:
+                    raise
+                looked_up_words.append(error.words)
+                if await executor.lookup_player_async(error.words, async_storage.mutate) is None:
+                    raise
+
+    def print_fetcher_stats(self):
+        """Prints the cumulated network stats of the Bungie fetcher."""
+        print(f"Connexions: {self.__fetcher.pool_stats()}")
+        print(f"Requêtes: {self.__fetcher.request_stats()}")
+        print(f"Cache HTTP: {self.__fetcher.cache_stats()}")
+        print(f"Synchros: {self.__fetcher.sync_stats()}")
+        print(f"Cache des serveurs: {self.__guild_cache.stats()}")
+
     async def answer_message(self, answer, message):
         """print() + message.channel.send()"""
         print(answer)
@@ -118,6 +225,8 @@ if __name__ == "__main__":
         raise ValueError("CORTANA_DISCORD_TOKEN non configuré.")
     if not CORTANA_BUNGIE_API_KEY:
         raise ValueError("CORTANA_BUNGIE_API_KEY non configurée.")
+    if CORTANA_STORAGE_BACKEND not in ('files', 'journal', 'sqlite'):
+        raise ValueError("CORTANA_STORAGE_BACKEND invalide (files, journal ou sqlite).")
     print("Démarrage du bot...")
     print(f"Dossier de stoackge racine: {ROOT_DIRECTORY}")
     bot = Bot()
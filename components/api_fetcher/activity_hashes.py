@@ -0,0 +1,37 @@
+from protos.activity_id_pb2 import ActivityID
+
+DESTINY_2_ACTIVITIES_BY_HASH = {
+    1875726950: ActivityID.Type.LEVIATHAN,
+    2693136600: ActivityID.Type.LEVIATHAN,
+    2693136601: ActivityID.Type.LEVIATHAN,
+    2693136602: ActivityID.Type.LEVIATHAN,
+    2693136603: ActivityID.Type.LEVIATHAN,
+    2693136604: ActivityID.Type.LEVIATHAN,
+    2693136605: ActivityID.Type.LEVIATHAN,
+    417231112: ActivityID.Type.LEVIATHAN_PRESTIGE,
+    757116822: ActivityID.Type.LEVIATHAN_PRESTIGE,
+    1685065161: ActivityID.Type.LEVIATHAN_PRESTIGE,
+    3446541099: ActivityID.Type.LEVIATHAN_PRESTIGE,
+    3879860661: ActivityID.Type.LEVIATHAN_PRESTIGE,
+    2449714930: ActivityID.Type.LEVIATHAN_PRESTIGE,
+    2164432138: ActivityID.Type.EATER_OF_WORLDS,
+    3089205900: ActivityID.Type.EATER_OF_WORLDS,
+    809170886: ActivityID.Type.EATER_OF_WORLDS_PRESTIGE,
+    119944200: ActivityID.Type.SPIRE_OF_STARS,
+    3213556450: ActivityID.Type.SPIRE_OF_STARS_PRESTIGE,
+    3333172150: ActivityID.Type.CROWN_OF_SORROW,
+    2122313384: ActivityID.Type.LAST_WISH,
+    548750096: ActivityID.Type.SCOURGE_OF_THE_PAST,
+    2812525063: ActivityID.Type.SCOURGE_OF_THE_PAST,
+    2659723068: ActivityID.Type.GARDEN_OF_SALVATION,
+}
+DESTINY_1_ACTIVITIES_BY_HASH = {
+    2659248071: ActivityID.Type.VAULT_OF_GLASS,
+    2659248068: ActivityID.Type.VAULT_OF_GLASS_PRESTIGE,
+    1836893116: ActivityID.Type.CROPTAS_END,
+    1836893119: ActivityID.Type.CROPTAS_END_PRESTIGE,
+    1733556769: ActivityID.Type.THE_TAKEN_KING,
+    3534581229: ActivityID.Type.THE_TAKEN_KING_PRESTIGE,
+    260765522: ActivityID.Type.WRATH_OF_THE_MACHINE,
+    1387993552: ActivityID.Type.WRATH_OF_THE_MACHINE_PRESTIGE,
+}
@@ -0,0 +1,151 @@
+from array import array
+import mmap
+import os
+from pathlib import Path
+import struct
+import sys
+
+MAGIC = b'CAIX'
+FORMAT_VERSION = 1
+# Magic, format version, number of slots as a power of 2, number of entries, length of the
+# manifest version.
+HEADER = struct.Struct('<4sIIII')
+# Activity hash, ActivityID.Type. Slots with the UNKNOWN type (0) are empty.
+SLOT = struct.Struct('<II')
+HASH_MULTIPLIER = 0x9E3779B1
+MAX_LOAD_FACTOR = 0.5
+
+
+def activity_types_from_manifest(definitions, seed_types_by_hash):
+    """
+    Extends hand-maintained activity hashes with every variant found in the Destiny manifest.
+    Variants of an activity share its display name in the manifest, e.g. every "Leviathan" or
+    "Leviathan: Prestige" launch hash.
+    :param definitions: The DestinyActivityDefinition table of the manifest, as a {hash: definition}
+    dict decoded from JSON.
+    :param seed_types_by_hash: A {hash: ActivityID.Type} dict of known activities.
+    :return: A {hash: ActivityID.Type} dict with the seeds and their variants.
+    """
+    types_by_name = {}
+    for activity_hash, activity_type in seed_types_by_hash.items():
+        definition = definitions.get(str(activity_hash))
+        if definition is not None:
+            name = definition.get('displayProperties', {}).get('name')
+            if name:
+                types_by_name.setdefault(name, activity_type)
+    types_by_hash = dict(seed_types_by_hash)
+    for activity_hash, definition in definitions.items():
+        activity_type = types_by_name.get(definition.get('displayProperties', {}).get('name'))
+        if activity_type is not None:
+            types_by_hash.setdefault(int(activity_hash), activity_type)
+    return types_by_hash
+
+
+def slot_of(activity_hash, bits):
+    """:return: The first slot to probe for |activity_hash| in a table of 2^|bits| slots."""
+    return ((activity_hash * HASH_MULTIPLIER) & 0xFFFFFFFF) >> (32 - bits)
+
+
+class ActivityIndex:
+    """
+    On-disk index from activity hash to ActivityID.Type, memory-mapped for constant-time lookups.
+    The index is an open-addressing hash table with linear probing, tagged with the version of
+    the manifest it was built from.
+    """
+
+    def __init__(self, filepath):
+        """
+        :param filepath: The index, as written by |write|.
+        :raises: IOError if the index cannot be read or is not a valid index.
+        """
+        try:
+            with open(filepath, 'rb') as index_file:
+                self.__map = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            raise IOError("Impossible de lire l'index des activités.")
+        try:
+            (magic, format_version, bits, entries, version_length) = \
+                HEADER.unpack_from(self.__map, 0)
+        except struct.error:
+            magic = None
+        if magic != MAGIC or format_version != FORMAT_VERSION or not 0 < bits <= 32 or \
+                len(self.__map) != HEADER.size + version_length + SLOT.size * 2**bits:
+            self.__map.close()
+            raise IOError("Index des activités invalide.")
+        self.__bits = bits
+        self.__mask = 2**bits - 1
+        self.__entries = entries
+        version = self.__map[HEADER.size:HEADER.size + version_length]
+        self.__version = version.rstrip(b'\0').decode('utf-8')
+        # Alternating hashes and types. The version is padded so that they are aligned, and read in
+        # place on little-endian hosts.
+        self.__slots = memoryview(self.__map)[HEADER.size + version_length:].cast('I')
+        if sys.byteorder != 'little':
+            slots = array('I', self.__slots)
+            slots.byteswap()
+            self.__slots.release()
+            self.__slots = slots
+
+    @staticmethod
+    def write(filepath, version, types_by_hash):
+        """
+        Builds an index and writes it atomically, so that readers see the old or new index only.
+        :param filepath: Where to write the index.
+        :param version: The version of the manifest the index was built from.
+        :param types_by_hash: A {hash: ActivityID.Type} dict. UNKNOWN types are left out.
+        """
+        types_by_hash = {h: t for h, t in types_by_hash.items() if t}
+        bits = 1
+        while len(types_by_hash) > MAX_LOAD_FACTOR * 2**bits:
+            bits += 1
+        slots = bytearray(SLOT.size * 2**bits)
+        mask = 2**bits - 1
+        for activity_hash, activity_type in types_by_hash.items():
+            slot = slot_of(activity_hash, bits)
+            while SLOT.unpack_from(slots, slot * SLOT.size)[1]:
+                slot = (slot + 1) & mask
+            SLOT.pack_into(slots, slot * SLOT.size, activity_hash, activity_type)
+        version = version.encode('utf-8')
+        version += b'\0' * (-len(version) % SLOT.size)
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, bits, len(types_by_hash), len(version))
+        filepath = Path(filepath)
+        temporary_filepath = filepath.with_name(filepath.name + '.tmp')
+        try:
+            filepath.parent.mkdir(parents=True, exist_ok=True)
+            temporary_filepath.write_bytes(header + version + bytes(slots))
+            os.replace(temporary_filepath, filepath)
+        except OSError:
+            raise IOError("Impossible d'écrire l'index des activités.")
+
+    def __len__(self):
+        return self.__entries
+
+    def __contains__(self, activity_hash):
+        return self.get(activity_hash) is not None
+
+    def version(self):
+        """:return: The version of the manifest the index was built from."""
+        return self.__version
+
+    def get(self, activity_hash, default=None):
+        """
+        :param activity_hash: The hash of an activity.
+        :param default: Returned for unknown activities.
+        :return: The ActivityID.Type of the activity.
+        """
+        if not 0 <= activity_hash <= 0xFFFFFFFF:
+            return default
+        slot = slot_of(activity_hash, self.__bits)
+        while True:
+            slot_type = self.__slots[2 * slot + 1]
+            if not slot_type:
+                return default
+            if self.__slots[2 * slot] == activity_hash:
+                return slot_type
+            slot = (slot + 1) & self.__mask
+
+    def close(self):
+        """Unmaps the index."""
+        if isinstance(self.__slots, memoryview):
+            self.__slots.release()
+        self.__map.close()
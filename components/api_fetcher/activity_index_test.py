@@ -0,0 +1,86 @@
+from pathlib import Path
+import tempfile
+import unittest
+from components.api_fetcher import activity_index
+from protos.activity_id_pb2 import ActivityID
+
+
+class ActivityIndexTest(unittest.TestCase):
+    """Test class for the memory-mapped index of activity hashes."""
+
+    def setUp(self):
+        """Sets up a directory for the index."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.filepath = Path(self.directory.name).joinpath('activity_index.dat')
+
+    def tearDown(self):
+        """Performs some cleanups at the end of each test."""
+        self.directory.cleanup()
+
+    def test_write_then_read(self):
+        """Verifies every hash is found, including colliding ones, and unknown ones are not."""
+        types_by_hash = {
+            activity_hash: ActivityID.Type.LAST_WISH if activity_hash % 2 else
+            ActivityID.Type.LEVIATHAN
+            for activity_hash in range(1, 2**32, 2**32 // 1000)
+        }
+        types_by_hash[0] = ActivityID.Type.GARDEN_OF_SALVATION
+        types_by_hash[2**32 - 1] = ActivityID.Type.CROWN_OF_SORROW
+        types_by_hash[42] = ActivityID.Type.UNKNOWN
+        activity_index.ActivityIndex.write(self.filepath, '87654.20.08.12', types_by_hash)
+        sut = activity_index.ActivityIndex(self.filepath)
+        self.assertEqual(sut.version(), '87654.20.08.12')
+        self.assertEqual(len(sut), len(types_by_hash) - 1)
+        for activity_hash, activity_type in types_by_hash.items():
+            if activity_type:
+                self.assertEqual(sut.get(activity_hash), activity_type)
+        self.assertNotIn(42, sut)
+        self.assertNotIn(7, sut)
+        self.assertIsNone(sut.get(2**40))
+        self.assertEqual(sut.get(7, ActivityID.Type.UNKNOWN), ActivityID.Type.UNKNOWN)
+        sut.close()
+
+    def test_rewrite(self):
+        """Verifies an index can be replaced while the previous one is mapped."""
+        activity_index.ActivityIndex.write(self.filepath, '1', {1: ActivityID.Type.LAST_WISH})
+        previous = activity_index.ActivityIndex(self.filepath)
+        activity_index.ActivityIndex.write(self.filepath, '2', {})
+        sut = activity_index.ActivityIndex(self.filepath)
+        self.assertEqual(previous.get(1), ActivityID.Type.LAST_WISH)
+        self.assertEqual(sut.version(), '2')
+        self.assertEqual(len(sut), 0)
+        self.assertIsNone(sut.get(1))
+        previous.close()
+        sut.close()
+
+    def test_invalid_index(self):
+        """Verifies missing and corrupted indexes are rejected."""
+        self.assertRaises(IOError, activity_index.ActivityIndex, self.filepath)
+        self.filepath.write_bytes(b'')
+        self.assertRaises(IOError, activity_index.ActivityIndex, self.filepath)
+        activity_index.ActivityIndex.write(self.filepath, '1', {1: ActivityID.Type.LAST_WISH})
+        self.filepath.write_bytes(self.filepath.read_bytes()[:-1])
+        self.assertRaises(IOError, activity_index.ActivityIndex, self.filepath)
+
+    def test_activity_types_from_manifest(self):
+        """Verifies variants of known activities are found by name in the manifest."""
+        definitions = {
+            '1': {'displayProperties': {'name': 'Leviathan'}},
+            '2': {'displayProperties': {'name': 'Leviathan'}},
+            '3': {'displayProperties': {'name': 'Leviathan: Prestige'}},
+            '4': {'displayProperties': {'name': 'Patrol'}},
+            '5': {'displayProperties': {}},
+        }
+        types_by_hash = activity_index.activity_types_from_manifest(definitions, {
+            1: ActivityID.Type.LEVIATHAN,
+            6: ActivityID.Type.LAST_WISH,
+        })
+        self.assertEqual(types_by_hash, {
+            1: ActivityID.Type.LEVIATHAN,
+            2: ActivityID.Type.LEVIATHAN,
+            6: ActivityID.Type.LAST_WISH,
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,19 +1,49 @@
-from concurrent.futures import ThreadPoolExecutor
+import asyncio
 from datetime import datetime
+from datetime import timedelta
 from datetime import tzinfo
-from functools import reduce
+import functools
 import itertools
-import requests
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
-from protos.activity_id_pb2 import ActivityID
+import json
+import time
+import urllib.parse
+import aiohttp
+from components.api_fetcher.activity_hashes import DESTINY_1_ACTIVITIES_BY_HASH
+from components.api_fetcher.completions_matrix import new_completions_row
+from components.api_fetcher.hedging import RequestHedger
+from components.api_fetcher.manifest import ActivityTypes
+from components.api_fetcher.rate_limiter import ConcurrencyController, TokenBucket
+from components.api_fetcher.response_cache import ResponseCache
+from components.api_fetcher.session_pool import SessionPool
+from components.api_fetcher.single_flight import SingleFlight
+from components.api_fetcher.sync_context import SyncContext
+from components.api_fetcher.sync_context import SyncResult
+from components.api_fetcher.throttling import get_throttle_seconds
+from components.api_fetcher.throttling import STATUS_TOO_MANY_REQUESTS
 from protos.api_bundle_pb2 import APIBundle
+from protos.sync_state_pb2 import SyncCheckpoint
+from protos.sync_state_pb2 import SyncState
 
-MAX_NETWORK_WORKERS = 32
+MAX_CONCURRENT_REQUESTS = 32
+INITIAL_CONCURRENT_REQUESTS = 8
+MAX_REQUESTS_PER_SECOND = 25
 MAX_NETWORK_RETRIES_PER_REQUEST = 6
 BACKOFF_FACTOR = 0.5
-STATUS_FORCELIST = (500, 502, 504)
+REQUEST_TIMEOUT_SECONDS = 15
+CHECKPOINT_INTERVAL_SECONDS = 10
+CHECKPOINT_MAX_AGE = timedelta(hours=1)
+STATUS_OK = 200
+STATUS_NOT_MODIFIED = 304
+STATUS_FORCELIST = (STATUS_TOO_MANY_REQUESTS, 500, 502, 503, 504)
+BUNGIE_SUCCESS_ERROR_CODE = 1
 BUNGIE_API_ENDPOINT = 'https://www.bungie.net/platform'
+# Destiny 1 requests are sent to that path on the host of the endpoint.
+DESTINY_1_PLATFORM_PATH = '/d1/Platform'
+DESTINY_1_PATH_PREFIX = '/Destiny/'
+# Manifest content is served from the root of the host of the endpoint.
+MANIFEST_CONTENT_PATH_PREFIX = '/common/'
+# Destiny 1 was only released on Xbox and PlayStation.
+DESTINY_1_MEMBERSHIP_TYPES = ('1', '2')
 DESTINY_2_CLANS_WATCHLIST = [
     696852, # La fine equipe du 11
     4220683, # Finis Terræ
@@ -21,225 +51,931 @@ DESTINY_2_CLANS_WATCHLIST = [
     1890420, # Le Survivant du Cuirassé
     1907122, # Olympic Gaming
 ]
-DESTINY_2_ACTIVITIES_BY_HASH = {
-    1875726950: ActivityID.Type.LEVIATHAN,
-    2693136600: ActivityID.Type.LEVIATHAN,
-    2693136601: ActivityID.Type.LEVIATHAN,
-    2693136602: ActivityID.Type.LEVIATHAN,
-    2693136603: ActivityID.Type.LEVIATHAN,
-    2693136604: ActivityID.Type.LEVIATHAN,
-    2693136605: ActivityID.Type.LEVIATHAN,
-    417231112: ActivityID.Type.LEVIATHAN_PRESTIGE,
-    757116822: ActivityID.Type.LEVIATHAN_PRESTIGE,
-    1685065161: ActivityID.Type.LEVIATHAN_PRESTIGE,
-    3446541099: ActivityID.Type.LEVIATHAN_PRESTIGE,
-    3879860661: ActivityID.Type.LEVIATHAN_PRESTIGE,
-    2449714930: ActivityID.Type.LEVIATHAN_PRESTIGE,
-    2164432138: ActivityID.Type.EATER_OF_WORLDS,
-    3089205900: ActivityID.Type.EATER_OF_WORLDS,
-    809170886: ActivityID.Type.EATER_OF_WORLDS_PRESTIGE,
-    119944200: ActivityID.Type.SPIRE_OF_STARS,
-    3213556450: ActivityID.Type.SPIRE_OF_STARS_PRESTIGE,
-    3333172150: ActivityID.Type.CROWN_OF_SORROW,
-    2122313384: ActivityID.Type.LAST_WISH,
-    548750096: ActivityID.Type.SCOURGE_OF_THE_PAST,
-    2812525063: ActivityID.Type.SCOURGE_OF_THE_PAST,
-    2659723068: ActivityID.Type.GARDEN_OF_SALVATION,
-}
+
+
+class FetcherOptions:
+    """
+    Tuning of a Fetcher. Every option has a default suited to the Bungie API, overridden by
+    keyword, e.g FetcherOptions(max_concurrent_requests=4).
+    - max_concurrent_requests: The maximum number of requests in flight.
+    - max_requests_per_second: The sustained request rate allowed by Bungie.
+    - request_timeout_seconds: Attempts that take longer than that are abandoned and retried.
+    - max_network_retries: The number of times a failed request is retried before giving up.
+    - sync_freshness_seconds: Syncs requested within that many seconds after the end of the
+    previous one get its result instead of a new sync. 0 disables it.
+    - sync_deadline_seconds: Optional time budget of a sync. Syncs that run out of time return
+    partial results. See |Fetcher.sync|.
+    - checkpoint_interval_seconds: Syncs with a checkpoint callback call it at most once per that
+    many seconds. See |Fetcher.fetch_async|.
+    - endpoint: The root URL of the Bungie API. Defaults to BUNGIE_API_ENDPOINT. Destiny 1 requests
+    go to DESTINY_1_PLATFORM_PATH on the same host.
+    - response_cache: Optional ResponseCache of the Bungie responses.
+    - hedger: Optional RequestHedger that duplicates slow requests.
+    - activity_index_path: Optional file of the ActivityIndex built from the Destiny manifest.
+    Memory-mapped if it exists, and kept up to date by syncs. Without it, only the activities of
+    DESTINY_2_ACTIVITIES_BY_HASH are counted.
+    - clock: Returns the current time in seconds.
+    """
+    max_concurrent_requests = MAX_CONCURRENT_REQUESTS
+    max_requests_per_second = MAX_REQUESTS_PER_SECOND
+    request_timeout_seconds = REQUEST_TIMEOUT_SECONDS
+    max_network_retries = MAX_NETWORK_RETRIES_PER_REQUEST
+    sync_freshness_seconds = 0
+    sync_deadline_seconds = None
+    checkpoint_interval_seconds = CHECKPOINT_INTERVAL_SECONDS
+    endpoint = None
+    response_cache = None
+    hedger = None
+    activity_index_path = None
+    clock = time.monotonic
+
+    def __init__(self, **options):
+        """
+        :param options: The options that differ from their default.
+        :raises: ValueError if an option is unknown or invalid.
+        """
+        for name, value in options.items():
+            if name.startswith('_') or not hasattr(FetcherOptions, name):
+                raise ValueError("Option du fetcher inconnue: " + name)
+            setattr(self, name, value)
+        if not isinstance(self.max_concurrent_requests, int) or self.max_concurrent_requests < 1:
+            raise ValueError("Nombre de requêtes simultanées invalide")
+        if self.response_cache is not None and not isinstance(self.response_cache, ResponseCache):
+            raise ValueError("Cache HTTP invalide")
+        if self.sync_freshness_seconds < 0:
+            raise ValueError("Durée de fraîcheur des synchros invalide")
+        if self.request_timeout_seconds <= 0:
+            raise ValueError("Délai d'attente des requêtes invalide")
+        if not isinstance(self.max_network_retries, int) or self.max_network_retries < 0:
+            raise ValueError("Nombre de réessais des requêtes invalide")
+        if self.sync_deadline_seconds is not None and self.sync_deadline_seconds <= 0:
+            raise ValueError("Délai des synchros invalide")
+        if self.hedger is not None and not isinstance(self.hedger, RequestHedger):
+            raise ValueError("Duplication des requêtes invalide")
+        if self.checkpoint_interval_seconds < 0:
+            raise ValueError("Intervalle des points de reprise invalide")
 
 
 class Fetcher:
-    """Parser for user input (intents)."""
+    """
+    Client of the Bungie API that syncs the stats of the players of the clan watchlists.
+    Requests run concurrently on the asyncio event loop, over a pooled session per loop, within
+    the rate and concurrency limits of Bungie.
+    """
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, options=None):
+        """
+        :param api_key: The Bungie API key.
+        :param options: Optional FetcherOptions. Defaults to FetcherOptions().
+        """
         if not isinstance(api_key, str) or len(api_key) == 0:
             raise ValueError("Clé d'API Bungie non spécifiée")
-        self.__api_key = api_key
-        self.__session = None
-        self.__executor = ThreadPoolExecutor(max_workers=MAX_NETWORK_WORKERS)
+        if options is not None and not isinstance(options, FetcherOptions):
+            raise ValueError("Options du fetcher invalides")
+        options = options or FetcherOptions()
+        self.__options = options
+        self.__activity_types = ActivityTypes(options.activity_index_path, options.clock)
+        self.__rate_limiter = TokenBucket(
+            options.max_requests_per_second, options.max_requests_per_second
+        )
+        self.__concurrency_controller = ConcurrencyController(
+            min(INITIAL_CONCURRENT_REQUESTS, options.max_concurrent_requests),
+            options.max_concurrent_requests
+        )
+        # The pool is doubled with a hedger so that duplicates do not wait for a connection.
+        self.__sessions = SessionPool(
+            {'X-API-KEY': api_key},
+            options.max_concurrent_requests * (1 if options.hedger is None else 2)
+        )
+        self.__single_flight = SingleFlight(options.sync_freshness_seconds, options.clock)
+        self.__stats = {
+            'requests': 0, 'retries': 0, 'throttles': 0,
+            'syncs': 0, 'joined': 0, 'fresh': 0, 'partial': 0, 'checkpoints': 0, 'resumed': 0,
+        }
+
+    def fetch(self, now, sync_state=None, checkpoint=None, on_checkpoint=None):
+        """
+        Blocking version of |fetch_async|. Must not be called from a running event loop.
+        Runs on a private event loop that is kept across calls so that connections are reused.
+        :param now: Now as a datetime.
+        :param sync_state: Optional SyncState of the previous sync. Updated in place.
+        :param checkpoint: Optional SyncCheckpoint of an interrupted sync to resume.
+        :param on_checkpoint: Optional callback that saves the SyncCheckpoint of the sync.
+        :return: The fetched APIBundle.
+        """
+        return self.run_blocking(self.fetch_async(now, sync_state, checkpoint, on_checkpoint))
+
+    def fetch_clans(self, now, sync_states_by_clan, checkpoint=None, on_checkpoint=None):
+        """
+        Blocking version of |fetch_clans_async|. Must not be called from a running event loop.
+        :param now: Now as a datetime.
+        :param sync_states_by_clan: A {clan ID: SyncState or None} dict. Updated in place.
+        :param checkpoint: Optional SyncCheckpoint of an interrupted sync to resume.
+        :param on_checkpoint: Optional callback that saves the SyncCheckpoint of the sync.
+        :return: A {clan ID: APIBundle} dict.
+        """
+        return self.run_blocking(
+            self.fetch_clans_async(now, sync_states_by_clan, checkpoint, on_checkpoint)
+        )
+
+    def fetch_player(self, account_id, sync_states):
+        """
+        Blocking version of |fetch_player_async|. Must not be called from a running event loop.
+        :param account_id: The account ID of the player.
+        :param sync_states: SyncStates of previous syncs. Updated in place.
+        :return: The fetched APIBundle.Stats of the player.
+        """
+        return self.run_blocking(self.fetch_player_async(account_id, sync_states))
 
-    def fetch(self, now):
+    def search_player(self, display_names):
+        """
+        Blocking version of |search_player_async|. Must not be called from a running event loop.
+        :param display_names: The display names to search, in order of preference.
+        :return: A (gamer_tag, membership_type, membership_id, account_id) tuple or None.
+        """
+        return self.run_blocking(self.search_player_async(display_names))
+
+    def run_blocking(self, coroutine):
+        """
+        Runs |coroutine| on the private event loop of the blocking methods.
+        :return: The result of the coroutine.
+        """
+        return self.__sessions.run_blocking(coroutine)
+
+    async def fetch_async(self, now, sync_state=None, checkpoint=None, on_checkpoint=None):
         """
         Fetches all stats for Destiny 1 and 2 players in the clan watchlists.
+        Runs natively on the current event loop, without any extra thread.
         :param now: Now as a datetime.
+        :param sync_state: Optional SyncState of the previous sync. When given, the sync is
+        incremental: characters that have not been played since then are not refetched.
+        It is then updated in place so that it can be saved for the next sync.
+        :param checkpoint: Optional SyncCheckpoint of an interrupted sync. The players it has
+        finished are not refetched, unless it is older than CHECKPOINT_MAX_AGE.
+        :param on_checkpoint: Optional callback that saves the SyncCheckpoint of the sync as players
+        are finished, to be given back as |checkpoint| if the sync is interrupted. The checkpoint
+        must not be kept by the callback. IOErrors raised by the callback are ignored.
+        Calls that join a sync in flight or get a fresh result ignore both.
         :return: The fetched APIBundle.
         """
-        assert isinstance(now, datetime), "Horloge non configurée"
-        assert isinstance(now.tzinfo, tzinfo), "Fuseau horaire non configuré"
-        self.start_new_session()
-        destiny2_data = self.fetch_destiny2_data()
-        self.close_session()
+        assert sync_state is None or isinstance(sync_state, SyncState), "État de synchro invalide"
+        result = await self.sync_once(
+            now, DESTINY_2_CLANS_WATCHLIST, sync_state, checkpoint, on_checkpoint
+        )
         bundle = APIBundle()
-        bundle.last_sync_datetime = now.isoformat()
-        for row in destiny2_data:
-            gamer_tag = row[0]
-            stat = APIBundle.Stats.ActivityStat()
-            stat.activity_type = row[1]
-            stat.completions = row[2]
-            bundle.stats_by_player[gamer_tag].activity_stats.append(stat)
+        bundle.CopyFrom(result.bundle)
+        if sync_state is not None:
+            sync_state.CopyFrom(result.sync_state)
         return bundle
 
-    def fetch_destiny2_data(self):
+    async def fetch_clans_async(
+            self, now, sync_states_by_clan, checkpoint=None, on_checkpoint=None):
         """
-        Fetches all stats for Destiny 1 and 2 players in the clan watchlists.
-        :return: An array of (gamer_tag, ActivityID.Type, completions) tuples.
+        Same as |fetch_async| for the given clans, with separate stats for each clan.
+        Players listed in several clans are fetched once and reported in each of them.
+        :param now: Now as a datetime.
+        :param sync_states_by_clan: A {clan ID: SyncState or None} dict with the SyncState of the
+        previous sync of each clan. Each of them is updated in place like in |fetch_async|.
+        :param checkpoint: Optional SyncCheckpoint of an interrupted sync. See |fetch_async|.
+        :param on_checkpoint: Optional callback that saves the SyncCheckpoint of the sync.
+        :return: A {clan ID: APIBundle} dict.
         """
-        players = self.parallel_flat_map(
-            self.fetch_destiny2_clan_members,
-            DESTINY_2_CLANS_WATCHLIST
+        previous_sync_state = SyncState()
+        for sync_state in sync_states_by_clan.values():
+            assert sync_state is None or isinstance(sync_state, SyncState), \
+                "État de synchro invalide"
+            if sync_state is not None:
+                previous_sync_state.MergeFrom(sync_state)
+        result = await self.sync_once(
+            now, sync_states_by_clan.keys(), previous_sync_state, checkpoint, on_checkpoint
         )
-        characters = self.parallel_flat_map(
-            self.fetch_destiny2_player_characters,
+        bundles_by_clan = {}
+        for clan_id, sync_state in sync_states_by_clan.items():
+            bundles_by_clan[clan_id] = APIBundle()
+            bundles_by_clan[clan_id].CopyFrom(result.clan_bundles[clan_id])
+            if sync_state is not None:
+                sync_state.CopyFrom(result.clan_sync_states[clan_id])
+        return bundles_by_clan
+
+    async def fetch_player_async(self, account_id, sync_states):
+        """
+        Refreshes the stats of a single player, without fetching their clans. Incremental like
+        |fetch_async|: only the characters played since the previous sync are refetched.
+        Meant for syncs asked by users: cached responses are revalidated even within their TTL, so
+        that the activities that the player just finished are seen.
+        :param account_id: The account ID of the player, as in SyncState.players_by_account_id.
+        :param sync_states: SyncStates of previous syncs. The first one that knows the player is
+        the previous sync state. The player and their characters are updated in place in each of
+        those that know the player.
+        :return: The fetched APIBundle.Stats of the player.
+        :raises: ValueError if no sync state knows the membership of the player.
+        """
+        sync_states = [
+            sync_state for sync_state in sync_states
+            if account_id in sync_state.players_by_account_id
+        ]
+        if not sync_states or not sync_states[0].players_by_account_id[account_id].membership_id:
+            raise ValueError("Joueur inconnu des synchros précédentes")
+        saved_player = sync_states[0].players_by_account_id[account_id]
+        player = (
+            saved_player.gamer_tag,
+            saved_player.membership_type,
+            saved_player.membership_id,
+            account_id,
+        )
+        context = SyncContext(sync_states[0], [])
+        await self.fetch_player_completions(player, context, revalidate=True)
+        for sync_state in sync_states:
+            for character_id in sync_state.players_by_account_id[account_id].character_ids:
+                if character_id in sync_state.characters_by_id:
+                    del sync_state.characters_by_id[character_id]
+            sync_state.players_by_account_id[account_id].CopyFrom(
+                context.sync_state.players_by_account_id[account_id]
+            )
+            for character_id, character in context.sync_state.characters_by_id.items():
+                sync_state.characters_by_id[character_id].CopyFrom(character)
+        stats = APIBundle.Stats()
+        stats.CopyFrom(context.completions.to_api_bundle().stats_by_player[player[0]])
+        return stats
+
+    async def search_player_async(self, display_names):
+        """
+        Searches Destiny 2 players by display name, on every platform. The names are searched
+        concurrently, one request each.
+        :param display_names: The display names to search, in order of preference.
+        :return: A (gamer_tag, membership_type, membership_id, account_id) tuple for the first name
+        that matches a player, or None. The account ID is the same as in clan syncs, see
+        |account_id_of|.
+        """
+        responses = await self.parallel_map(
+            lambda display_name: self.request(
+                '/Destiny2/SearchDestinyPlayer/-1/' + urllib.parse.quote(display_name) + '/'
+            ),
+            display_names
+        )
+        for response in responses:
+            results = response.get('Response') or []
+            if results:
+                result = results[0]
+                account = await self.fetch_account(result)
+                (membership_type, membership_id) = primary_membership(
+                    result, account.get('destinyMemberships', [])
+                )
+                return (
+                    result['displayName'],
+                    membership_type,
+                    membership_id,
+                    account_id_of(result, account.get('bungieNetUser')),
+                )
+        return None
+
+    async def fetch_account(self, user_info, revalidate=False):
+        """
+        Fetches the account of a player with GetMembershipsById.
+        :param user_info: A destinyUserInfo dict of the player.
+        :param revalidate: Whether a fresh cached response is revalidated too. See |request|.
+        :return: The account, with every Destiny membership of the player (destinyMemberships) and
+        their Bungie.net account if linked (bungieNetUser). Empty if Bungie did not return it.
+        """
+        path = '/User/GetMembershipsById/' + str(user_info['membershipId']) + '/' + \
+            str(user_info['membershipType']) + '/'
+        response = await self.request(path, revalidate)
+        return response.get('Response') or {}
+
+    async def fetch_primary_membership(self, user_info):
+        """
+        Resolves the membership whose stats are fetched for a player. Cross-saved players play on
+        the platform of their crossSaveOverride, whose membership has its own ID: it is looked up
+        with GetMembershipsById when |user_info| is another membership of the player.
+        The account is cached for long, as its memberships rarely change: only a crossSaveOverride
+        that none of the cached memberships matches revalidates it.
+        :param user_info: A destinyUserInfo dict, from a clan members page or a player search.
+        :return: A (membership_type, membership_id) tuple of strings. The membership of
+        |user_info| itself if the primary one cannot be found.
+        """
+        override = user_info.get('crossSaveOverride') or 0
+        memberships = []
+        if override and override != user_info['membershipType']:
+            memberships = (await self.fetch_account(user_info)).get('destinyMemberships', [])
+            if all(membership.get('membershipType') != override for membership in memberships):
+                account = await self.fetch_account(user_info, revalidate=True)
+                memberships = account.get('destinyMemberships', [])
+        return primary_membership(user_info, memberships)
+
+    async def sync_once(
+            self, now, clan_ids, previous_sync_state, checkpoint=None, on_checkpoint=None):
+        """
+        Single-flight: while a sync of the same clans is in flight, new calls join it and get the
+        same result. Within the freshness window of the previous sync of the same clans, its result
+        is returned right away.
+        :param now: Now as a datetime.
+        :param clan_ids: The clans to sync.
+        :param previous_sync_state: The SyncState of the previous sync or None. Not modified.
+        :param checkpoint: The SyncCheckpoint of an interrupted sync or None. Not modified.
+        :param on_checkpoint: Saves the SyncCheckpoint of the sync, or None.
+        :return: The SyncResult of the sync. Shared, must not be modified.
+        """
+        assert isinstance(now, datetime), "Horloge non configurée"
+        assert isinstance(now.tzinfo, tzinfo), "Fuseau horaire non configuré"
+        key = tuple(sorted(set(clan_ids)))
+        fresh_result = self.__single_flight.fresh_result(key)
+        if fresh_result is not None:
+            self.__stats['fresh'] += 1
+            return fresh_result
+        sync_in_flight = self.__single_flight.sync_in_flight(key)
+        if sync_in_flight is not None:
+            self.__stats['joined'] += 1
+            return await asyncio.shield(sync_in_flight)
+        self.__stats['syncs'] += 1
+        if previous_sync_state is not None:
+            snapshot = SyncState()
+            snapshot.CopyFrom(previous_sync_state)
+            previous_sync_state = snapshot
+        if checkpoint is not None:
+            assert isinstance(checkpoint, SyncCheckpoint), "Point de reprise invalide"
+            snapshot = SyncCheckpoint()
+            snapshot.CopyFrom(checkpoint)
+            checkpoint = snapshot
+        sync = asyncio.get_running_loop().create_task(
+            self.sync(now, key, previous_sync_state, checkpoint, on_checkpoint)
+        )
+        self.__single_flight.start(key, sync)
+        return await asyncio.shield(sync)
+
+    async def sync(self, now, clan_ids, previous_sync_state, checkpoint=None, on_checkpoint=None):
+        """
+        Runs a single sync. Shared by every caller that joins it.
+        When the sync runs out of time, the requests in flight are cancelled and the result is
+        partial: players that were not reached keep their stats from the previous sync state and
+        are marked as stale.
+        :param now: Now as a datetime.
+        :param clan_ids: The clans to sync.
+        :param previous_sync_state: The SyncState of the previous sync or None.
+        :param checkpoint: The SyncCheckpoint of an interrupted sync or None. Ignored if too old.
+        :param on_checkpoint: Saves the SyncCheckpoint of the sync, or None.
+        :return: The SyncResult of the sync.
+        """
+        if checkpoint is not None and \
+                now - datetime.fromisoformat(checkpoint.started_datetime) > CHECKPOINT_MAX_AGE:
+            checkpoint = None
+        context = SyncContext(previous_sync_state, clan_ids, now, checkpoint, on_checkpoint)
+        try:
+            await asyncio.wait_for(
+                self.fetch_clans_data(context), self.__options.sync_deadline_seconds
+            )
+        except asyncio.TimeoutError:
+            self.__stats['partial'] += 1
+            context.cancel_players()
+            context.keep_stale_players()
+        self.__stats['resumed'] += context.resumed_players
+        return SyncResult(now, context)
+
+    async def refresh_activity_index(self):
+        """Rebuilds the activity index for a new Destiny manifest. See ActivityTypes.refresh."""
+        await self.__activity_types.refresh(self.request)
+
+    def destiny2_activity_type(self, activity_hash):
+        """
+        :param activity_hash: The hash of a Destiny 2 activity.
+        :return: The ActivityID.Type of the activity, or None if it is not tracked.
+        """
+        return self.__activity_types.get(activity_hash)
+
+    async def fetch_clans_data(self, context):
+        """
+        Fetches all Destiny 1 and Destiny 2 stats of the players in the clans of the sync.
+        The activity index is refreshed first, within the deadline of the sync.
+        :param context: The SyncContext of the sync. Its completions matrices receive the stats.
+        """
+        await self.refresh_activity_index()
+        await self.parallel_map(
+            lambda clanID: self.fetch_destiny2_clan_completions(clanID, context),
+            context.clan_ids
+        )
+
+    async def fetch_destiny2_clan_completions(self, clanID, context):
+        """
+        Fetches the activity completions of every character of every member of the given clanID.
+        Pipelined: each member's characters are requested as soon as the clan page lands,
+        without waiting for the other clans of the sync.
+        Members already fetched for another clan of the sync are not fetched again.
+        :param clanID: The clan identifier in the form of an integer.
+        :param context: The SyncContext of the sync. Its completions matrices receive the stats.
+        """
+        players = list(await self.fetch_destiny2_clan_members(clanID))
+        context.members_by_clan[clanID] = players
+        await self.parallel_map(
+            lambda player: self.fetch_destiny2_clan_member_completions(clanID, player, context),
             players
         )
-        completions = self.parallel_flat_map(
-            self.fetch_destiny2_character_activity_completions,
+
+    async def fetch_destiny2_clan_member_completions(self, clanID, player, context):
+        """
+        Fetches the activity completions of a clan member, unless another clan of the sync already
+        did, then adds them to the clan.
+        :param clanID: The clan identifier in the form of an integer.
+        :param player: A (gamer_tag, membership_type, membership_id, account_id) tuple.
+        :param context: The SyncContext of the sync. Its completions matrices receive the stats.
+        """
+        await context.fetch_player_once(
+            player[3],
+            lambda: self.fetch_player_completions(player, context)
+        )
+        context.add_clan_player(clanID, player[3])
+        self.save_checkpoint(context)
+
+    def save_checkpoint(self, context):
+        """
+        Saves the checkpoint of a sync, unless it has been saved less than
+        |checkpoint_interval_seconds| ago.
+        :param context: The SyncContext of the sync.
+        """
+        if context.on_checkpoint is None:
+            return
+        now = self.__options.clock()
+        if context.last_checkpoint is not None and \
+                now - context.last_checkpoint < self.__options.checkpoint_interval_seconds:
+            return
+        context.last_checkpoint = now
+        try:
+            context.on_checkpoint(context.checkpoint)
+            self.__stats['checkpoints'] += 1
+        except IOError:
+            pass
+
+    async def fetch_player_completions(self, player, context, revalidate=False):
+        """
+        Fetches the Destiny 1 and Destiny 2 activity completions of every character of a player.
+        Both games are fetched concurrently, through the same pool and rate limiter, and summed in
+        a single row since their activity types are distinct.
+        :param player: A (gamer_tag, membership_type, membership_id, account_id) tuple.
+        :param context: The SyncContext of the sync. Its completions matrix receives the stats.
+        :param revalidate: Whether fresh cached responses are revalidated too. See |request|.
+        """
+        characters_by_game = await asyncio.gather(
+            self.fetch_destiny2_player_completions(player, context, revalidate),
+            self.fetch_destiny1_player_completions(player, context, revalidate),
+        )
+        completions = new_completions_row()
+        character_ids = []
+        for characters in characters_by_game:
+            for (character_id, row) in characters:
+                character_ids.append(character_id)
+                for activity_type, activity_completions in enumerate(row):
+                    completions[activity_type] += activity_completions
+        context.add_player(player, completions, character_ids)
+
+    async def fetch_destiny2_player_completions(self, player, context, revalidate=False):
+        """
+        Fetches the Destiny 2 activity completions of every character of a player.
+        Pipelined: each character's stats are requested as soon as the profile lands,
+        without waiting for the other players.
+        :param player: A (gamer_tag, membership_type, membership_id, account_id) tuple.
+        :param context: The SyncContext of the sync. Its sync state receives the completions.
+        :param revalidate: Whether fresh cached responses are revalidated too. See |request|.
+        :return: An array of (character ID, row of completions) tuples.
+        """
+        characters = list(await self.fetch_destiny2_player_characters(player, revalidate))
+        fetch_completions = functools.partial(
+            self.fetch_destiny2_character_activity_completions, revalidate=revalidate
+        )
+        rows = await self.parallel_map(
+            lambda character: self.fetch_character_activity_completions_incrementally(
+                character, context, fetch_completions
+            ),
             characters
         )
-        completions_by_player = self.reduce_by_key(
-            lambda c: (c[2], c[4]),
-            lambda c1, c2: (c1[0], c1[1], c1[2], c1[3]+","+c1[3], c1[4], c1[5]+c2[5]),
-            completions
+        return list(zip([character[3] for character in characters], rows))
+
+    async def fetch_destiny1_player_completions(self, player, context, revalidate=False):
+        """
+        Same as |fetch_destiny2_player_completions| for Destiny 1. Players whose platform is not
+        one of DESTINY_1_MEMBERSHIP_TYPES are not fetched.
+        """
+        if player[1] not in DESTINY_1_MEMBERSHIP_TYPES:
+            return []
+        characters = list(await self.fetch_destiny1_player_characters(player, revalidate))
+        fetch_completions = functools.partial(
+            self.fetch_destiny1_character_activity_completions, revalidate=revalidate
+        )
+        rows = await self.parallel_map(
+            lambda character: self.fetch_character_activity_completions_incrementally(
+                character, context, fetch_completions
+            ),
+            characters
         )
-        completions_by_player = map(lambda c: (c[0], c[4], c[5]), completions_by_player)
-        return completions_by_player
+        return list(zip([character[3] for character in characters], rows))
 
-    def fetch_destiny2_clan_members(self, clanID):
+    async def fetch_destiny2_clan_members(self, clanID):
         """
         Fetches the members of the given clanID.
+        Cross-saved accounts are returned with the membership of their primary platform. See
+        |fetch_primary_membership|.
         :param clanID: The clan identifier in the form of an integer.
-        :return: An array of (gamer_tag, membership_type, membership_id) tuples.
+        :return: An array of (gamer_tag, membership_type, membership_id, account_id) tuples.
+        The account ID identifies a player regardless of clans and platforms.
         """
-        response = self.request('/GroupV2/'+str(clanID)+'/members/').json()
+        response = await self.request('/GroupV2/'+str(clanID)+'/members/')
         results = response['Response']['results']
-        members = map(lambda result: result['destinyUserInfo'], results)
+        memberships = await self.parallel_map(
+            lambda result: self.fetch_primary_membership(result['destinyUserInfo']),
+            results
+        )
         members = map(
-            lambda m: (m['displayName'], str(m['membershipType']), str(m['membershipId'])),
-            members
+            lambda m: (
+                m[0]['destinyUserInfo']['displayName'],
+                m[1][0],
+                m[1][1],
+                account_id_of(m[0]['destinyUserInfo'], m[0].get('bungieNetUserInfo'))
+            ),
+            zip(results, memberships)
         )
         return members
 
-    def fetch_destiny2_player_characters(self, player):
+    async def fetch_destiny2_player_characters(self, player, revalidate=False):
         """
         Fetches the characters of a player.
         Deleted characters are not returned.
-        :param player: A (gamer_tag, membership_type, membership_id) tuple.
-        :return: An array of (gamer_tag, membership_type, membership_id, character_id) tuples.
+        :param player: A (gamer_tag, membership_type, membership_id, account_id) tuple.
+        :param revalidate: Whether a fresh cached response is revalidated too. See |request|.
+        :return: An array of (gamer_tag, membership_type, membership_id, character_id,
+        date_last_played) tuples.
         """
         gamer_tag = player[0]
         membership_type = player[1]
         membership_id = player[2]
         path = '/Destiny2/'+membership_type+'/Profile/'+membership_id+'/?components=Characters'
-        response = self.request(path).json()
-        results = response['Response']['characters']['data'].keys()
+        response = await self.request(path, revalidate)
+        results = response['Response']['characters']['data'].items()
         characters = map(
-            lambda characterID: (gamer_tag, membership_type, membership_id, str(characterID)),
+            lambda result: (
+                gamer_tag,
+                membership_type,
+                membership_id,
+                str(result[0]),
+                result[1].get('dateLastPlayed', '')
+            ),
             results
         )
         return characters
 
-    def fetch_destiny2_character_activity_completions(self, character):
+    async def fetch_destiny1_player_characters(self, player, revalidate=False):
+        """
+        Fetches the Destiny 1 characters of a player.
+        :param player: A (gamer_tag, membership_type, membership_id, account_id) tuple.
+        :param revalidate: Whether a fresh cached response is revalidated too. See |request|.
+        :return: An array of (gamer_tag, membership_type, membership_id, character_id,
+        date_last_played) tuples. Empty if the player has no Destiny 1 account.
+        """
+        gamer_tag = player[0]
+        membership_type = player[1]
+        membership_id = player[2]
+        path = DESTINY_1_PATH_PREFIX+membership_type+'/Account/'+membership_id+'/Summary/'
+        response = await self.request(path, revalidate)
+        try:
+            results = response['Response']['data']['characters']
+        except:
+            return []
+        characters = map(
+            lambda result: (
+                gamer_tag,
+                membership_type,
+                membership_id,
+                str(result['characterBase']['characterId']),
+                result['characterBase'].get('dateLastPlayed', '')
+            ),
+            results
+        )
+        return characters
+
+    async def fetch_character_activity_completions_incrementally(
+            self, character, context, fetch_completions):
+        """
+        Same as |fetch_completions| but reuses the completions saved in the sync state when the
+        character has not been played since the previous sync, and the activity index that typed
+        them has not changed since.
+        :param character: A (gamer_tag, membership_type, membership_id, character_id,
+        date_last_played) tuple.
+        :param context: The SyncContext of the sync. Its sync state receives the completions.
+        :param fetch_completions: Fetches the completions of a character of the right game.
+        :return: A row of completions, indexed by ActivityID.Type.
+        """
+        character_id = character[3]
+        date_last_played = character[4]
+        saved = context.saved_character(character_id)
+        activity_index_version = self.__activity_types.version()
+        if date_last_played and saved is not None and \
+                saved.date_last_played == date_last_played and \
+                saved.activity_index_version == activity_index_version:
+            completions = new_completions_row()
+            for stat in saved.activity_stats:
+                completions[stat.activity_type] += stat.completions
+        else:
+            completions = await fetch_completions(character)
+        new_character = context.sync_state.characters_by_id[character_id]
+        new_character.date_last_played = date_last_played
+        new_character.activity_index_version = activity_index_version
+        for activity_type, activity_completions in enumerate(completions):
+            if activity_completions:
+                stat = new_character.activity_stats.add()
+                stat.activity_type = activity_type
+                stat.completions = activity_completions
+        return completions
+
+    async def fetch_destiny2_character_activity_completions(self, character, revalidate=False):
         """
         Fetches the activity completions of a character.
+        Completions are summed by activity type in a single pass over the response.
         :param character: A (gamer_tag, membership_type, membership_id, character_id) tuple.
-        :return: An array of: (gamer_tag, membership_type, membership_id, character_id,
-        ActivityID.Type, completions) tuples.
+        :param revalidate: Whether a fresh cached response is revalidated too. See |request|.
+        :return: A row of completions, indexed by ActivityID.Type.
         """
-        gamer_tag = character[0]
         membership_type = character[1]
         membership_id = character[2]
         character_id = character[3]
-        defaults = []
-        for activity_type in DESTINY_2_ACTIVITIES_BY_HASH.values():
-            default = (gamer_tag, membership_type, membership_id, character_id, activity_type, 0)
-            defaults.append(default)
+        completions = new_completions_row()
         path = '/Destiny2/'+membership_type+'/Account/'+membership_id+ \
             '/Character/'+character_id+'/Stats/AggregateActivityStats/'
-        response = self.request(path).json()
+        response = await self.request(path, revalidate)
         try:
             results = response['Response']['activities']
         except:
-            return defaults
-        results = filter(
-            lambda result: result['activityHash'] in DESTINY_2_ACTIVITIES_BY_HASH,
-            results
-        )
-        results = map(
-            lambda result: (
-                DESTINY_2_ACTIVITIES_BY_HASH[result['activityHash']],
-                int(result['values']['activityCompletions']['basic']['value'])
-            ),
-            results
-        )
-        activities = map(
-            lambda result: (
-                gamer_tag,
-                membership_type,
-                membership_id,
-                character_id,
-                result[0],
-                result[1]
-            ),
-            results
-        )
-        activities = list(activities) + defaults
-        completions = self.reduce_by_key(
-            lambda a: a[4],
-            lambda a1, a2: (a1[0], a1[1], a1[2], a1[3], a1[4], a1[5]+a2[5]),
-            activities
-        )
+            return completions
+        for result in results:
+            activity_type = self.destiny2_activity_type(result['activityHash'])
+            if activity_type is not None:
+                completions[activity_type] += \
+                    int(result['values']['activityCompletions']['basic']['value'])
         return completions
 
-    def reduce_by_key(self, key_function, reduce_function, iterable):
+    async def fetch_destiny1_character_activity_completions(self, character, revalidate=False):
         """
-        :param key_function: Used to group iterable elements by key_function.
-        :param reduce_function: Reduce each group with reduce_function.
-        :param iterable: The iterable serving as input.
-        :return: An array of (key, reduce_output) tuples.
+        Fetches the Destiny 1 activity completions of a character.
+        :param character: A (gamer_tag, membership_type, membership_id, character_id) tuple.
+        :param revalidate: Whether a fresh cached response is revalidated too. See |request|.
+        :return: A row of completions, indexed by ActivityID.Type.
         """
-        iterable = list(iterable)
-        iterable.sort(key=key_function)
-        grouped = [list(values) for key, values in itertools.groupby(iterable, key_function)]
-        return map(lambda row: reduce(reduce_function, row), grouped)
+        membership_type = character[1]
+        membership_id = character[2]
+        character_id = character[3]
+        completions = new_completions_row()
+        path = DESTINY_1_PATH_PREFIX+'Stats/AggregateActivityStats/'+membership_type+'/'+ \
+            membership_id+'/'+character_id+'/'
+        response = await self.request(path, revalidate)
+        try:
+            results = response['Response']['data']['activities']
+        except:
+            return completions
+        for result in results:
+            activity_type = DESTINY_1_ACTIVITIES_BY_HASH.get(result['activityHash'])
+            if activity_type is not None:
+                completions[activity_type] += \
+                    int(result['values']['activityCompletions']['basic']['value'])
+        return completions
 
-    def parallel_map(self, function, iterable):
-        """Same as map but parallelized with a thread pool."""
-        return self.__executor.map(function, iterable)
+    async def parallel_map(self, function, iterable):
+        """Same as map but runs the coroutine |function| concurrently on the event loop."""
+        return await asyncio.gather(*map(function, iterable))
 
-    def parallel_flat_map(self, function, iterable):
-        """Same as map + flatten but parallelized with a thread pool."""
-        matrix = self.parallel_map(function, iterable)
-        return itertools.chain(*matrix)
+    def pool_stats(self):
+        """:return: The stats of the connection pool. See SessionPool.stats."""
+        return self.__sessions.stats()
 
-    def start_new_session(self):
+    def request_stats(self):
         """
-        Starts a new session that can be reused for several HTTP requests.
-        The session has exponential backoff set up for every rquest.
-        The sessions also has the Bungie API Key set up for every request.
+        :return: A dict with the number of requests sent (requests), of those that were failed
+        attempts (retries) or throttled by Bungie (throttles), and the current adaptive limit of
+        requests in flight (concurrency).
         """
-        session = requests.Session()
-        retry = Retry(
-            total=MAX_NETWORK_RETRIES_PER_REQUEST,
-            read=MAX_NETWORK_RETRIES_PER_REQUEST,
-            connect=MAX_NETWORK_RETRIES_PER_REQUEST,
-            backoff_factor=BACKOFF_FACTOR,
-            status_forcelist=STATUS_FORCELIST,
-        )
-        adapter = HTTPAdapter(max_retries=retry)
-        session.mount('http://', adapter)
-        session.mount('https://', adapter)
-        session.headers.update({'X-API-KEY': self.__api_key})
-        self.__session = session
+        stats = {name: self.__stats[name] for name in ['requests', 'retries', 'throttles']}
+        stats['concurrency'] = self.__concurrency_controller.limit
+        return stats
 
-    def request(self, path):
+    def sync_stats(self):
+        """
+        :return: A dict with the number of syncs that were actually run (syncs), of those that ran
+        out of time (partial), and of calls that joined the sync in flight (joined) or got the
+        result of a recent one (fresh). Also reports the number of checkpoints saved (checkpoints)
+        and of players taken from a resumed checkpoint (resumed).
         """
-        Makes a request with the currently active session.
-        :param path: The path of the request. Appended to BUNGIE_API_ENDPOINT.
-        :return: The URL's content.
+        return {
+            name: self.__stats[name]
+            for name in ['syncs', 'joined', 'fresh', 'partial', 'checkpoints', 'resumed']
+        }
+
+    def syncs_in_flight(self):
+        """:return: The number of syncs that are running."""
+        return len(self.__single_flight)
+
+    def cache_stats(self):
+        """:return: The stats of the response cache. See ResponseCache.stats. Empty if disabled."""
+        if self.__options.response_cache is None:
+            return {}
+        return self.__options.response_cache.stats()
+
+    def hedging_stats(self):
+        """:return: The stats of the request hedger. See RequestHedger.stats. Empty if disabled."""
+        if self.__options.hedger is None:
+            return {}
+        return self.__options.hedger.stats()
+
+    async def request(self, path, revalidate=False):
         """
-        return self.__session.get(BUNGIE_API_ENDPOINT + path)
+        Makes a request with the persistent session.
+        Requests go through the shared rate limiter and the adaptive concurrency controller.
+        Failed requests are retried with exponential backoff.
+        Throttled requests shrink the concurrency and pause the rate limiter for as long as Bungie
+        asks, before being retried.
+        With a response cache, fresh responses are served from disk without any request, and stale
+        ones are revalidated with a conditional request. Only successful responses are cached. The
+        cache is read and written in the default executor of the loop, and failures to write it
+        are logged and ignored. Manifest content is versioned by path and too large to be worth
+        caching: it always bypasses the cache.
+        With a hedger, slow attempts are duplicated. See |attempt|.
+        :param path: The path of the request. Appended to the endpoint.
+        :param revalidate: Whether a fresh cached response is revalidated too, e.g. when a user
+        asks for a sync right after playing.
+        :return: The URL's content, decoded from JSON.
+        """
+        cached_response = None
+        headers = {}
+        response_cache = self.__options.response_cache
+        if path.startswith(MANIFEST_CONTENT_PATH_PREFIX):
+            response_cache = None
+        if response_cache is not None:
+            cached_response = await self.run_in_executor(response_cache.get, self.url(path))
+            if cached_response is not None and cached_response.fresh and not revalidate:
+                return cached_response.content
+            if cached_response is not None:
+                headers = cached_response.validators()
+        session = self.__sessions.session()
+        for attempt in itertools.count():
+            can_retry = attempt < self.__options.max_network_retries
+            backoff = BACKOFF_FACTOR * 2 ** attempt
+            if attempt > 0:
+                self.__stats['retries'] += 1
+            try:
+                response = await self.attempt(session, path, headers, cached_response, can_retry)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if not can_retry:
+                    raise
+                await asyncio.sleep(backoff)
+                continue
+            (status, content) = response[:2]
+            throttle_seconds = get_throttle_seconds(status, content)
+            healthy = content is not None and throttle_seconds is None
+            if healthy:
+                self.__concurrency_controller.increase()
+                if response_cache is not None:
+                    await self.cache_response(path, response, cached_response)
+            if healthy or not can_retry:
+                return content
+            if throttle_seconds is None:
+                await asyncio.sleep(backoff)
+                continue
+            self.__stats['throttles'] += 1
+            self.__concurrency_controller.decrease()
+            self.__rate_limiter.pause(max(throttle_seconds, backoff))
+
+    async def cache_response(self, path, response, cached_response):
+        """
+        Stores a successful response in the cache, or restarts the TTL of a cached response that
+        was not modified. Error payloads are not stored. Failures to write the cache are logged.
+        :param path: The path of the request. Its URL is the key of the cache.
+        :param response: The (HTTP status, content, ETag, Last-Modified) tuple of the response.
+        :param cached_response: The stale cached response being revalidated, or None.
+        """
+        response_cache = self.__options.response_cache
+        (status, content, etag, last_modified) = response
+        url = self.url(path)
+        try:
+            if status == STATUS_NOT_MODIFIED and cached_response is not None:
+                await self.run_in_executor(response_cache.not_modified, url, cached_response)
+            elif status == STATUS_OK and isinstance(content, dict) and \
+                    content.get('ErrorCode', BUNGIE_SUCCESS_ERROR_CODE) == \
+                    BUNGIE_SUCCESS_ERROR_CODE:
+                await self.run_in_executor(
+                    response_cache.put, url, content, etag, last_modified
+                )
+        except IOError as e:
+            print("Échec de l'écriture du cache HTTP: " + str(e))
+
+    def url(self, path):
+        """
+        :param path: The path of a request.
+        :return: The URL of the request: the path appended to the endpoint, or to the Destiny 1
+        endpoint or the host for Destiny 1 and manifest content paths.
+        """
+        endpoint = self.__options.endpoint or BUNGIE_API_ENDPOINT
+        host = endpoint[:endpoint.rindex('/')]
+        if path.startswith(DESTINY_1_PATH_PREFIX):
+            endpoint = host + DESTINY_1_PLATFORM_PATH
+        elif path.startswith(MANIFEST_CONTENT_PATH_PREFIX):
+            endpoint = host
+        return endpoint + path
+
+    async def run_in_executor(self, function, *args):
+        """
+        Runs a blocking call, e.g. of the response cache, in the default executor of the loop.
+        :return: What |function| returns.
+        :raises: What |function| raises.
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def attempt(self, session, path, headers, cached_response, can_retry):
+        """
+        Makes a single attempt of a request, within the rate and concurrency limits.
+        With a hedger, the attempt is duplicated when it is slow to answer. The duplicate goes
+        through the rate limiter but not the concurrency controller, as the hedger already caps
+        the duplicates.
+        :param session: The persistent session of the running event loop.
+        :param path: The path of the request. Appended to the endpoint.
+        :param headers: The headers of the request.
+        :param cached_response: The stale cached response being revalidated, or None.
+        :param can_retry: Whether the request can still be retried. Otherwise, the content of
+        failed responses is decoded as well.
+        :return: A (HTTP status, content or None, ETag, Last-Modified) tuple.
+        """
+        get = functools.partial(self.get, session, path, headers, cached_response, can_retry)
+        await self.__rate_limiter.acquire()
+        async with self.__concurrency_controller:
+            if self.__options.hedger is None:
+                return await get()
+            return await self.__options.hedger.run(get, functools.partial(self.hedge, get))
+
+    async def hedge(self, get):
+        """
+        Duplicates a slow attempt. See |attempt|.
+        :param get: Returns a new coroutine that sends the request.
+        :return: See |get|.
+        """
+        await self.__rate_limiter.acquire()
+        return await get()
+
+    async def get(self, session, path, headers, cached_response, can_retry):
+        """
+        Sends a request. See |attempt| for the parameters.
+        Manifest content is decoded in the default executor of the loop, as it weighs megabytes.
+        :return: A (HTTP status, content or None, ETag, Last-Modified) tuple.
+        """
+        self.__stats['requests'] += 1
+        async with session.get(
+                self.url(path),
+                headers=headers,
+                timeout=aiohttp.ClientTimeout(total=self.__options.request_timeout_seconds)
+        ) as response:
+            status = response.status
+            content = None
+            if status == STATUS_NOT_MODIFIED and cached_response is not None:
+                content = cached_response.content
+            elif path.startswith(MANIFEST_CONTENT_PATH_PREFIX) and status == STATUS_OK:
+                content = await self.run_in_executor(json.loads, await response.read())
+            elif not can_retry or status not in STATUS_FORCELIST:
+                content = await response.json(content_type=None)
+            return (
+                status,
+                content,
+                response.headers.get('ETag'),
+                response.headers.get('Last-Modified'),
+            )
+
+    async def close_async(self):
+        """
+        Closes the persistent session of the running event loop and releases its sockets.
+        Must be awaited on every event loop the fetcher was used on, except the private one of the
+        blocking methods that |close| takes care of.
+        """
+        await self.__sessions.close_async()
+
+    def close(self):
+        """Blocking version of |close_async|. Also disposes of the private event loop of |fetch|."""
+        self.__sessions.close()
+
+
+def primary_membership(user_info, memberships):
+    """
+    :param user_info: A destinyUserInfo dict of a player.
+    :param memberships: The other destinyUserInfo dicts of the account of the player.
+    :return: A (membership_type, membership_id) tuple of strings for the membership of the
+    crossSaveOverride platform of the player. The membership of |user_info| itself if the player
+    is not cross-saved or the primary membership is not in |memberships|.
+    """
+    override = user_info.get('crossSaveOverride') or 0
+    if override and override != user_info['membershipType']:
+        for membership in memberships:
+            if membership.get('membershipType') == override:
+                return str(override), str(membership['membershipId'])
+    return str(user_info['membershipType']), str(user_info['membershipId'])
+
 
-    def close_session(self):
-        """Ends the currently active session and releases its sockets."""
-        self.__session.close()
-        self.__session = None
+def account_id_of(user_info, bungie_net_user_info):
+    """
+    :param user_info: A destinyUserInfo dict of a player.
+    :param bungie_net_user_info: The bungieNetUserInfo dict of the player, or None.
+    :return: The account ID of the player, as in SyncState.players_by_account_id. The Bungie.net
+    account of the player when linked, so that every membership of a player maps to it.
+    """
+    bungie_net_id = (bungie_net_user_info or {}).get('membershipId')
+    if bungie_net_id:
+        return 'bungie:' + str(bungie_net_id)
+    return 'destiny:' + str(user_info['membershipId'])
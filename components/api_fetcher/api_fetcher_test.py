@@ -1,11 +1,30 @@
+import asyncio
 from datetime import datetime
+from datetime import timedelta
+import gc
 import os
+import tempfile
 import unittest
+import urllib.parse
+import warnings
+import aiohttp
 from dateutil import tz
 from components.api_fetcher import api_fetcher
+from components.api_fetcher.fake_bungie_server import FakeBungieOptions
+from components.api_fetcher.fake_bungie_server import FakeBungieServer
+from components.api_fetcher.fake_bungie_server import FakePlayer
+from components.api_fetcher.fake_clock import FakeClock
+from components.api_fetcher.hedging import RequestHedger
+from components.api_fetcher.manifest import MANIFEST_CHECK_INTERVAL_SECONDS
+from components.api_fetcher.response_cache import ResponseCache
 from protos.activity_id_pb2 import ActivityID
+from protos.sync_state_pb2 import SyncCheckpoint
+from protos.sync_state_pb2 import SyncState
 
 SUT_NOW = datetime(2020, 8, 12, 18, 15, 0, 0, tz.gettz('Europe/Paris'))
+LEVIATHAN_HASH = 2693136600
+LAST_WISH_HASH = 2122313384
+VAULT_OF_GLASS_HASH = 2659248071
 
 
 class FetcherTest(unittest.TestCase):
@@ -15,6 +34,710 @@ class FetcherTest(unittest.TestCase):
         """Set up method."""
         api_key = os.environ.get('CORTANA_BUNGIE_API_KEY', '')
         self.sut = api_fetcher.Fetcher(api_key)
+        self.fake = FakeBungieServer(FakeBungieOptions(clans=0))
+        self.endpoint = None
+        self.fetchers = []
+
+    def tearDown(self):
+        """Releases the fetchers' pooled connections and stops the fake Bungie API."""
+        for fetcher in self.fetchers:
+            fetcher.close()
+        self.sut.close()
+        self.fake.stop()
+
+    def fetcher(self, **options):
+        """
+        :param options: The FetcherOptions that differ from their default. Requests are not rate
+        limited unless specified.
+        :return: A new Fetcher pointed at the fake Bungie API unless specified. The fake Bungie API
+        is started on first use.
+        """
+        if self.endpoint is None:
+            self.endpoint = self.fake.start()
+        options.setdefault('endpoint', self.endpoint)
+        options.setdefault('max_requests_per_second', 1000)
+        fetcher = api_fetcher.Fetcher('key', api_fetcher.FetcherOptions(**options))
+        self.fetchers.append(fetcher)
+        return fetcher
+
+    def test_fetch_offline(self):
+        """Fetches from a fake Bungie API and verifies completions are summed per player."""
+        clans = api_fetcher.DESTINY_2_CLANS_WATCHLIST
+        self.fake.add_player(clans[0], FakePlayer('Walnut Waffle', '1', {
+            '11': {LEVIATHAN_HASH: 2, LAST_WISH_HASH: 1},
+            '12': {LEVIATHAN_HASH: 3, 1234: 99},
+        }))
+        self.fake.add_player(clans[1], FakePlayer('Oby1Chick', '2', {'21': {LAST_WISH_HASH: 4}}))
+        bundle = self.fetcher().fetch(SUT_NOW)
+        self.assertEqual(bundle.last_sync_datetime, SUT_NOW.isoformat())
+        self.assertEqual(set(bundle.stats_by_player.keys()), {'Walnut Waffle', 'Oby1Chick'})
+        expectations = {
+            ('Walnut Waffle', ActivityID.Type.LEVIATHAN): 5,
+            ('Walnut Waffle', ActivityID.Type.LAST_WISH): 1,
+            ('Walnut Waffle', ActivityID.Type.GARDEN_OF_SALVATION): 0,
+            ('Oby1Chick', ActivityID.Type.LAST_WISH): 4,
+            ('Oby1Chick', ActivityID.Type.LEVIATHAN): 0,
+        }
+        for (gamer_tag, activity_type), completions in expectations.items():
+            stats = bundle.stats_by_player[gamer_tag].activity_stats
+            stat = next(stat for stat in stats if stat.activity_type == activity_type)
+            self.assertEqual(stat.completions, completions)
+        types = [stat.activity_type for stat in bundle.stats_by_player['Oby1Chick'].activity_stats]
+        self.assertEqual(len(types), len(set(types)))
+
+    def test_fetch_is_pipelined(self):
+        """Verifies stats requests go out before a slow clan page has landed."""
+        clans = api_fetcher.DESTINY_2_CLANS_WATCHLIST
+        self.fake.add_player(
+            clans[0], FakePlayer('Walnut Waffle', '1', {'11': {LEVIATHAN_HASH: 2}})
+        )
+        self.fake.add_player(clans[1], FakePlayer('Oby1Chick', '2', {'21': {LAST_WISH_HASH: 4}}))
+        slow_clan_path = '/GroupV2/' + str(clans[1]) + '/members/'
+        self.fake.hold_until_stats_requested(slow_clan_path)
+        bundle = self.fetcher().fetch(SUT_NOW)
+        self.assertEqual(set(bundle.stats_by_player.keys()), {'Walnut Waffle', 'Oby1Chick'})
+        requested_paths = self.fake.requested_paths()
+        first_stats_index = next(
+            i for i, path in enumerate(requested_paths)
+            if path.endswith('/AggregateActivityStats/')
+        )
+        oby_profile_index = requested_paths.index('/Destiny2/3/Profile/2/?components=Characters')
+        self.assertLess(first_stats_index, oby_profile_index)
+
+    def test_players_are_fetched_once(self):
+        """Verifies players listed in several clans or platforms are fetched and counted once."""
+        clans = api_fetcher.DESTINY_2_CLANS_WATCHLIST
+        walnut = FakePlayer('Walnut Waffle', '1', {'11': {LEVIATHAN_HASH: 2}})
+        self.fake.add_player(clans[0], walnut)
+        self.fake.add_player(clans[1], walnut)
+        self.fake.add_player(clans[0], FakePlayer(
+            'Oby1Chick', '2', {'21': {LAST_WISH_HASH: 4}}, bungie_net_id='42'
+        ))
+        self.fake.add_player(clans[2], FakePlayer(
+            'Oby1Chick', '3', {'31': {LAST_WISH_HASH: 4}}, bungie_net_id='42'
+        ))
+        bundle = self.fetcher().fetch(SUT_NOW)
+        profile_paths = [p for p in self.fake.requested_paths() if '/Profile/' in p]
+        self.assertEqual(len(profile_paths), 2)
+        for gamer_tag, activity_type, completions in [
+                ('Walnut Waffle', ActivityID.Type.LEVIATHAN, 2),
+                ('Oby1Chick', ActivityID.Type.LAST_WISH, 4)]:
+            stats = bundle.stats_by_player[gamer_tag].activity_stats
+            stat = next(stat for stat in stats if stat.activity_type == activity_type)
+            self.assertEqual(stat.completions, completions)
+
+    def test_incremental_fetch(self):
+        """Verifies only characters played since the previous sync are refetched."""
+        clans = api_fetcher.DESTINY_2_CLANS_WATCHLIST
+        self.fake.add_player(clans[0], FakePlayer('Walnut Waffle', '1', {
+            '11': {LEVIATHAN_HASH: 2},
+            '12': {LAST_WISH_HASH: 1},
+        }))
+        self.fake.add_player(clans[1], FakePlayer('Oby1Chick', '2', {'21': {LAST_WISH_HASH: 4}}))
+        sut = self.fetcher()
+        sync_state = SyncState()
+        full_bundle = sut.fetch(SUT_NOW, sync_state)
+        self.assertEqual(set(sync_state.characters_by_id.keys()), {'11', '12', '21'})
+
+        self.fake.clear_requested_paths()
+        bundle = sut.fetch(SUT_NOW, sync_state)
+        self.assertEqual(bundle, full_bundle)
+        stats_paths = [
+            p for p in self.fake.requested_paths() if p.endswith('AggregateActivityStats/')
+        ]
+        self.assertEqual(stats_paths, [])
+
+        self.fake.add_player(clans[1], FakePlayer(
+            'Oby1Chick', '2', {'22': {LAST_WISH_HASH: 7}}, date_last_played='2020-08-12T20:00:00Z'
+        ))
+        self.fake.clear_requested_paths()
+        bundle = sut.fetch(SUT_NOW, sync_state)
+        stats_paths = [
+            p for p in self.fake.requested_paths() if p.endswith('AggregateActivityStats/')
+        ]
+        self.assertEqual(len(stats_paths), 1)
+        self.assertEqual(set(sync_state.characters_by_id.keys()), {'11', '12', '22'})
+        self.assertEqual(bundle.stats_by_player['Walnut Waffle'],
+                         full_bundle.stats_by_player['Walnut Waffle'])
+        stats_by_type = {
+            stat.activity_type: stat.completions
+            for stat in bundle.stats_by_player['Oby1Chick'].activity_stats
+        }
+        self.assertEqual(stats_by_type[ActivityID.Type.LAST_WISH], 7)
+
+    def test_fetch_player(self):
+        """Verifies a single player is refreshed in every sync state that knows them."""
+        walnut = FakePlayer('Walnut Waffle', '1', {'11': {LEVIATHAN_HASH: 2}})
+        self.fake.add_player(1, walnut)
+        self.fake.add_player(2, walnut)
+        self.fake.add_player(2, FakePlayer('Oby1Chick', '2', {'21': {LAST_WISH_HASH: 4}}))
+        sut = self.fetcher()
+        sync_states_by_clan = {1: SyncState(), 2: SyncState()}
+        sut.fetch_clans(SUT_NOW, sync_states_by_clan)
+        player = sync_states_by_clan[1].players_by_account_id['destiny:1']
+        self.assertEqual((player.membership_type, player.membership_id), ('3', '1'))
+
+        self.fake.add_player(1, FakePlayer(
+            'Walnut Waffle', '1', {'12': {LEVIATHAN_HASH: 5}},
+            date_last_played='2020-08-12T20:00:00Z'
+        ))
+        self.fake.clear_requested_paths()
+        stats = sut.fetch_player('destiny:1', sync_states_by_clan.values())
+        self.assertEqual(self.fake.requested_paths(), [
+            '/Destiny2/3/Profile/1/?components=Characters',
+            '/Destiny2/3/Account/1/Character/12/Stats/AggregateActivityStats/',
+        ])
+        stat = next(s for s in stats.activity_stats if s.activity_type == ActivityID.Type.LEVIATHAN)
+        self.assertEqual(stat.completions, 5)
+        for sync_state in sync_states_by_clan.values():
+            self.assertEqual(
+                list(sync_state.players_by_account_id['destiny:1'].character_ids), ['12']
+            )
+            self.assertIn('12', sync_state.characters_by_id)
+            self.assertNotIn('11', sync_state.characters_by_id)
+        self.assertIn('21', sync_states_by_clan[2].characters_by_id)
+        self.assertRaises(ValueError, sut.fetch_player, 'destiny:3', [SyncState()])
+
+    def test_fetch_player_revalidates_the_cache(self):
+        """Verifies a player synced right after playing gets their new completions."""
+        self.fake.add_player(1, FakePlayer('Walnut Waffle', '1', {'11': {LEVIATHAN_HASH: 2}}))
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResponseCache(
+                directory, [(r'/Profile/', 300), (r'/AggregateActivityStats/$', 60)]
+            )
+            sut = self.fetcher(response_cache=cache)
+            sync_states_by_clan = {1: SyncState()}
+            sut.fetch_clans(SUT_NOW, sync_states_by_clan)
+            self.fake.add_player(1, FakePlayer(
+                'Walnut Waffle', '1', {'11': {LEVIATHAN_HASH: 3}},
+                date_last_played='2020-08-12T20:00:00Z'
+            ))
+            stats = sut.fetch_player('destiny:1', sync_states_by_clan.values())
+            cache_stats = sut.cache_stats()
+        stat = next(s for s in stats.activity_stats if s.activity_type == ActivityID.Type.LEVIATHAN)
+        self.assertEqual(stat.completions, 3)
+        self.assertEqual(cache_stats['not_modified'], 0)
+        self.assertEqual(
+            sync_states_by_clan[1].characters_by_id['11'].date_last_played, '2020-08-12T20:00:00Z'
+        )
+
+    def test_activity_index_within_deadline(self):
+        """Verifies a slow manifest download is bounded by the deadline, then retried."""
+        variant_hash = 1234
+        self.fake.add_player(1, FakePlayer(
+            'Walnut Waffle', '1', {'11': {LAST_WISH_HASH: 2, variant_hash: 3}}
+        ))
+        content_path = '/common/destiny2_content/json/en/DestinyActivityDefinition-1.json'
+        self.fake.add_fixture('/Destiny2/Manifest/', {'Response': {
+            'version': '1',
+            'jsonWorldComponentContentPaths': {'en': {'DestinyActivityDefinition': content_path}},
+        }})
+        self.fake.add_fixture(content_path, {
+            str(LAST_WISH_HASH): {'displayProperties': {'name': 'Last Wish'}},
+            str(variant_hash): {'displayProperties': {'name': 'Last Wish'}},
+        })
+        self.fake.hang(content_path)
+        with tempfile.TemporaryDirectory() as directory:
+            index_path = os.path.join(directory, 'activity_index.dat')
+            sut = self.fetcher(
+                clock=FakeClock(), sync_deadline_seconds=0.2, activity_index_path=index_path
+            )
+            bundle = sut.fetch_clans(SUT_NOW, {1: SyncState()})[1]
+            self.assertEqual(sut.sync_stats()['partial'], 1)
+            self.assertEqual(len(bundle.stats_by_player), 0)
+            self.assertIsNone(sut.destiny2_activity_type(variant_hash))
+
+            self.fake.clear_faults()
+            bundle = sut.fetch_clans(SUT_NOW, {1: SyncState()})[1]
+            stats = bundle.stats_by_player['Walnut Waffle'].activity_stats
+            stat = next(s for s in stats if s.activity_type == ActivityID.Type.LAST_WISH)
+            self.assertEqual(stat.completions, 5)
+            sut.close()
+
+    def test_new_activity_index_refetches_completions(self):
+        """Verifies completions typed by a previous activity index are not reused."""
+        variant_hash = 1234
+        self.fake.add_player(1, FakePlayer(
+            'Walnut Waffle', '1', {'11': {LAST_WISH_HASH: 2, variant_hash: 3}}
+        ))
+        clock = FakeClock()
+        sync_state = SyncState()
+
+        def sync(version, activity_hashes):
+            content_path = '/common/destiny2_content/json/en/DestinyActivityDefinition-' + \
+                version + '.json'
+            self.fake.add_fixture('/Destiny2/Manifest/', {'Response': {
+                'version': version,
+                'jsonWorldComponentContentPaths': {
+                    'en': {'DestinyActivityDefinition': content_path}
+                },
+            }})
+            self.fake.add_fixture(content_path, {
+                str(activity_hash): {'displayProperties': {'name': 'Last Wish'}}
+                for activity_hash in activity_hashes
+            })
+            stats = sut.fetch_clans(SUT_NOW, {1: sync_state})[1] \
+                .stats_by_player['Walnut Waffle'].activity_stats
+            return next(s for s in stats if s.activity_type == ActivityID.Type.LAST_WISH)
+
+        with tempfile.TemporaryDirectory() as directory:
+            index_path = os.path.join(directory, 'activity_index.dat')
+            sut = self.fetcher(clock=clock, activity_index_path=index_path)
+            self.assertEqual(sync('1', [LAST_WISH_HASH]).completions, 2)
+            self.assertEqual(sync_state.characters_by_id['11'].activity_index_version, '1')
+            clock.now += MANIFEST_CHECK_INTERVAL_SECONDS
+            self.assertEqual(sync('2', [LAST_WISH_HASH, variant_hash]).completions, 5)
+            self.assertEqual(sync_state.characters_by_id['11'].activity_index_version, '2')
+            sut.close()
+
+    def test_cross_saved_players(self):
+        """Verifies cross-saved players are fetched with the membership of their main platform."""
+        self.fake.add_player(1, FakePlayer(
+            'Walnut Waffle', '11', {'111': {LAST_WISH_HASH: 2}}, bungie_net_id='9',
+            listed_membership=(2, '12')
+        ))
+        self.fake.add_fixture('/Destiny2/SearchDestinyPlayer/-1/Walnut%20Waffle/', {'Response': [{
+            'displayName': 'Walnut Waffle',
+            'membershipType': 2,
+            'membershipId': '12',
+            'crossSaveOverride': 3,
+        }]})
+        sut = self.fetcher()
+        sync_state = SyncState()
+        bundle = sut.fetch_clans(SUT_NOW, {1: sync_state})[1]
+        player = sync_state.players_by_account_id['bungie:9']
+        self.assertEqual((player.membership_type, player.membership_id), ('3', '11'))
+        stat = next(
+            s for s in bundle.stats_by_player['Walnut Waffle'].activity_stats
+            if s.activity_type == ActivityID.Type.LAST_WISH
+        )
+        self.assertEqual(stat.completions, 2)
+        self.assertEqual(
+            sut.search_player(['Walnut Waffle']), ('Walnut Waffle', '3', '11', 'bungie:9')
+        )
+
+    def test_cross_save_memberships_are_cached(self):
+        """Verifies primary memberships are only resolved again when the cross save changes."""
+        account_path = '/User/GetMembershipsById/12/2/'
+        self.fake.add_player(1, FakePlayer(
+            'Walnut Waffle', '11', {'111': {LAST_WISH_HASH: 2}}, bungie_net_id='9',
+            listed_membership=(2, '12')
+        ))
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResponseCache(directory, [(r'/User/GetMembershipsById/', 3600)])
+            sut = self.fetcher(response_cache=cache)
+            sut.fetch_clans(SUT_NOW, {1: None})
+            self.fake.clear_requested_paths()
+            sut.fetch_clans(SUT_NOW, {1: None})
+            self.assertNotIn(account_path, self.fake.requested_paths())
+
+            player = FakePlayer(
+                'Walnut Waffle', '13', {'131': {LAST_WISH_HASH: 5}}, bungie_net_id='9',
+                listed_membership=(2, '12'), membership_type=1
+            )
+            self.fake.add_player(1, player)
+            self.fake.add_fixture('/GroupV2/1/members/', {'Response': {'results': [{
+                'destinyUserInfo': player.user_info(),
+                'bungieNetUserInfo': {'membershipId': '9'},
+            }]}})
+            self.fake.clear_requested_paths()
+            sync_state = SyncState()
+            sut.fetch_clans(SUT_NOW, {1: sync_state})
+        self.assertEqual(self.fake.requested_paths().count(account_path), 1)
+        player = sync_state.players_by_account_id['bungie:9']
+        self.assertEqual((player.membership_type, player.membership_id), ('1', '13'))
+
+    def test_search_player(self):
+        """Verifies searched players get the same account ID as in clan syncs."""
+        self.fake.add_player(1, FakePlayer(
+            'Walnut Waffle', '1', {'11': {LAST_WISH_HASH: 2}}, bungie_net_id='9'
+        ))
+        self.fake.add_player(1, FakePlayer('Oby1Chick', '2', {'21': {LAST_WISH_HASH: 4}}))
+        for (gamer_tag, membership_id) in (('Walnut Waffle', '1'), ('Oby1Chick', '2')):
+            path = '/Destiny2/SearchDestinyPlayer/-1/' + urllib.parse.quote(gamer_tag) + '/'
+            self.fake.add_fixture(path, {'Response': [{
+                'displayName': gamer_tag,
+                'membershipType': 3,
+                'membershipId': membership_id,
+                'crossSaveOverride': 0,
+            }]})
+        sut = self.fetcher()
+        sync_state = SyncState()
+        sut.fetch_clans(SUT_NOW, {1: sync_state})
+        for gamer_tag in ('Walnut Waffle', 'Oby1Chick'):
+            account_id = sut.search_player([gamer_tag])[3]
+            self.assertEqual(sync_state.players_by_account_id[account_id].gamer_tag, gamer_tag)
+
+    def test_destiny1_stats(self):
+        """Verifies Destiny 1 stats are fetched alongside the Destiny 2 ones and merged."""
+        self.fake.add_player(1, FakePlayer(
+            'Walnut Waffle', '1', {'11': {LAST_WISH_HASH: 2}}, membership_type=2,
+            destiny1_completions_by_character={
+                '91': {VAULT_OF_GLASS_HASH: 3, 1234: 5},
+                '92': {VAULT_OF_GLASS_HASH: 1},
+            }
+        ))
+        self.fake.add_player(1, FakePlayer('Oby1Chick', '2', {'21': {LAST_WISH_HASH: 4}}))
+        self.fake.delay_once('/Destiny2/2/Profile/1/?components=Characters', 0.2)
+        sut = self.fetcher(max_requests_per_second=api_fetcher.MAX_REQUESTS_PER_SECOND)
+        sync_states_by_clan = {1: SyncState()}
+        bundle = sut.fetch_clans(SUT_NOW, sync_states_by_clan)[1]
+        first_paths = self.fake.requested_paths()
+        self.fake.clear_requested_paths()
+        sut.fetch_clans(SUT_NOW, sync_states_by_clan)
+        stats_by_type = {
+            gamer_tag: {s.activity_type: s.completions for s in stats.activity_stats}
+            for gamer_tag, stats in bundle.stats_by_player.items()
+        }
+        self.assertEqual(stats_by_type['Walnut Waffle'][ActivityID.Type.VAULT_OF_GLASS], 4)
+        self.assertEqual(stats_by_type['Walnut Waffle'][ActivityID.Type.LAST_WISH], 2)
+        self.assertEqual(stats_by_type['Oby1Chick'][ActivityID.Type.VAULT_OF_GLASS], 0)
+        self.assertEqual(stats_by_type['Oby1Chick'][ActivityID.Type.LAST_WISH], 4)
+        self.assertLess(
+            first_paths.index('/Destiny/Stats/AggregateActivityStats/2/1/91/'),
+            first_paths.index('/Destiny2/2/Account/1/Character/11/Stats/AggregateActivityStats/')
+        )
+        self.assertFalse(any(path.startswith('/Destiny/3/') for path in first_paths))
+        player = sync_states_by_clan[1].players_by_account_id['destiny:1']
+        self.assertEqual(sorted(player.character_ids), ['11', '91', '92'])
+        self.assertFalse(
+            any(path.endswith('/AggregateActivityStats/') for path in self.fake.requested_paths())
+        )
+
+    def test_fetch_clans(self):
+        """Verifies clans are reported separately, with players shared by clans fetched once."""
+        walnut = FakePlayer('Walnut Waffle', '1', {'11': {LEVIATHAN_HASH: 2}})
+        self.fake.add_player(1, walnut)
+        self.fake.add_player(2, walnut)
+        self.fake.add_player(2, FakePlayer('Oby1Chick', '2', {'21': {LAST_WISH_HASH: 4}}))
+        sut = self.fetcher()
+        sync_states_by_clan = {1: SyncState(), 2: None}
+        bundles_by_clan = sut.fetch_clans(SUT_NOW, sync_states_by_clan)
+        self.assertEqual(set(bundles_by_clan[1].stats_by_player.keys()), {'Walnut Waffle'})
+        self.assertEqual(set(bundles_by_clan[2].stats_by_player.keys()),
+                         {'Walnut Waffle', 'Oby1Chick'})
+        self.assertEqual(bundles_by_clan[1].stats_by_player['Walnut Waffle'],
+                         bundles_by_clan[2].stats_by_player['Walnut Waffle'])
+        self.assertEqual(bundles_by_clan[1].last_sync_datetime, SUT_NOW.isoformat())
+        self.assertEqual(list(sync_states_by_clan[1].characters_by_id.keys()), ['11'])
+        profile_paths = [p for p in self.fake.requested_paths() if '/Profile/' in p]
+        self.assertEqual(len(profile_paths), 2)
+
+        self.fake.clear_requested_paths()
+        sync_states_by_clan = {1: sync_states_by_clan[1]}
+        sut.fetch_clans(SUT_NOW, sync_states_by_clan)
+        stats_paths = [
+            p for p in self.fake.requested_paths() if p.endswith('AggregateActivityStats/')
+        ]
+        self.assertEqual(stats_paths, [])
+
+    def test_concurrent_fetches_are_coalesced(self):
+        """Verifies fetches requested while a sync is in flight join it."""
+        clans = api_fetcher.DESTINY_2_CLANS_WATCHLIST
+        self.fake.add_player(
+            clans[0], FakePlayer('Walnut Waffle', '1', {'11': {LEVIATHAN_HASH: 2}})
+        )
+        self.fake.add_player(clans[1], FakePlayer('Oby1Chick', '2', {'21': {LAST_WISH_HASH: 4}}))
+        sut = self.fetcher()
+        sync_states = [SyncState(), SyncState(), None]
+
+        async def fetch_all():
+            bundles = await asyncio.gather(
+                *[sut.fetch_async(SUT_NOW, sync_state) for sync_state in sync_states]
+            )
+            await sut.close_async()
+            return bundles
+
+        bundles = asyncio.run(fetch_all())
+        self.assertEqual(bundles[0], bundles[1])
+        self.assertEqual(bundles[0], bundles[2])
+        self.assertEqual(len(bundles[0].stats_by_player), 2)
+        self.assertEqual(sync_states[0], sync_states[1])
+        self.assertEqual(len(sync_states[1].characters_by_id), 2)
+        profile_paths = [p for p in self.fake.requested_paths() if '/Profile/' in p]
+        self.assertEqual(len(profile_paths), 2)
+        self.assertEqual(sut.sync_stats(), {
+            'syncs': 1, 'joined': 2, 'fresh': 0, 'partial': 0, 'checkpoints': 0, 'resumed': 0,
+        })
+
+        # Past the sync, with no freshness window, fetches run again.
+        sut.fetch(SUT_NOW)
+        self.assertEqual(sut.sync_stats()['syncs'], 2)
+
+    def test_recent_sync_is_reused(self):
+        """Verifies fetches within the freshness window get the result of the previous sync."""
+        clans = api_fetcher.DESTINY_2_CLANS_WATCHLIST
+        self.fake.add_player(
+            clans[0], FakePlayer('Walnut Waffle', '1', {'11': {LEVIATHAN_HASH: 2}})
+        )
+        clock = FakeClock()
+        sut = self.fetcher(sync_freshness_seconds=60, clock=clock)
+        bundle = sut.fetch(SUT_NOW)
+        requests_count = len(self.fake.requested_paths())
+        clock.now += 59
+        sync_state = SyncState()
+        fresh_bundle = sut.fetch(SUT_NOW, sync_state)
+        self.assertEqual(fresh_bundle, bundle)
+        self.assertEqual(list(sync_state.characters_by_id.keys()), ['11'])
+        self.assertEqual(len(self.fake.requested_paths()), requests_count)
+        clock.now += 1
+        sut.fetch(SUT_NOW)
+        self.assertEqual(len(self.fake.requested_paths()), 2 * requests_count)
+        self.assertEqual(sut.sync_stats(), {
+            'syncs': 2, 'joined': 0, 'fresh': 1, 'partial': 0, 'checkpoints': 0, 'resumed': 0,
+        })
+        self.assertRaises(ValueError, api_fetcher.FetcherOptions, sync_freshness_seconds=-1)
+
+    def test_sync_deadline(self):
+        """Verifies players not reached in time keep their previous stats and are marked stale."""
+        self.fake.add_player(1, FakePlayer('Walnut Waffle', '1', {'11': {LEVIATHAN_HASH: 2}}))
+        self.fake.add_player(2, FakePlayer('Oby1Chick', '2', {'21': {LAST_WISH_HASH: 4}}))
+        sut = self.fetcher(sync_deadline_seconds=0.2)
+        sync_states_by_clan = {1: SyncState(), 2: SyncState()}
+        sut.fetch_clans(SUT_NOW, sync_states_by_clan)
+
+        self.fake.add_player(1, FakePlayer(
+            'Walnut Waffle', '1', {'11': {LEVIATHAN_HASH: 3}},
+            date_last_played='2020-08-12T20:00:00Z'
+        ))
+        self.fake.hang('/Destiny2/3/Profile/2/?components=Characters')
+        self.fake.hang('/GroupV2/2/members/')
+        bundles_by_clan = sut.fetch_clans(SUT_NOW, sync_states_by_clan)
+        self.assertEqual(sut.sync_stats()['partial'], 1)
+        walnut = bundles_by_clan[1].stats_by_player['Walnut Waffle']
+        self.assertFalse(walnut.stale)
+        stat = next(
+            s for s in walnut.activity_stats if s.activity_type == ActivityID.Type.LEVIATHAN
+        )
+        self.assertEqual(stat.completions, 3)
+        oby = bundles_by_clan[2].stats_by_player['Oby1Chick']
+        self.assertTrue(oby.stale)
+        stat = next(s for s in oby.activity_stats if s.activity_type == ActivityID.Type.LAST_WISH)
+        self.assertEqual(stat.completions, 4)
+        self.assertEqual(list(sync_states_by_clan[2].clans_by_id[2].account_ids), ['destiny:2'])
+        self.assertEqual(list(sync_states_by_clan[2].characters_by_id.keys()), ['21'])
+
+        self.fake.clear_faults()
+        bundles_by_clan = sut.fetch_clans(SUT_NOW, sync_states_by_clan)
+        self.assertFalse(bundles_by_clan[2].stats_by_player['Oby1Chick'].stale)
+        self.assertEqual(sut.sync_stats()['partial'], 1)
+        self.assertRaises(ValueError, api_fetcher.FetcherOptions, sync_deadline_seconds=0)
+        self.assertRaises(ValueError, api_fetcher.FetcherOptions, request_timeout_seconds=0)
+
+    def test_interrupted_sync_is_resumed(self):
+        """Verifies an interrupted sync resumes from its checkpoint without the finished players."""
+        self.fake.add_player(1, FakePlayer('Walnut Waffle', '1', {'11': {LEVIATHAN_HASH: 2}}))
+        self.fake.add_player(2, FakePlayer('Oby1Chick', '2', {'21': {LAST_WISH_HASH: 4}}))
+        walnut_profile_path = '/Destiny2/3/Profile/1/?components=Characters'
+        oby_profile_path = '/Destiny2/3/Profile/2/?components=Characters'
+        self.fake.fail(oby_profile_path)
+        sut = self.fetcher(checkpoint_interval_seconds=0, max_network_retries=0)
+        checkpoints = []
+
+        def on_checkpoint(checkpoint):
+            checkpoints.append(SyncCheckpoint())
+            checkpoints[-1].CopyFrom(checkpoint)
+
+        self.assertRaises(
+            aiohttp.ClientConnectionError,
+            sut.fetch_clans, SUT_NOW, {1: None, 2: None}, None, on_checkpoint
+        )
+        checkpoint = checkpoints[-1]
+        self.assertEqual(checkpoint.started_datetime, SUT_NOW.isoformat())
+        self.assertEqual(list(checkpoint.sync_state.players_by_account_id.keys()), ['destiny:1'])
+        self.assertEqual(list(checkpoint.sync_state.characters_by_id.keys()), ['11'])
+
+        self.fake.clear_faults()
+        self.fake.clear_requested_paths()
+        later = SUT_NOW + timedelta(minutes=5)
+        bundles_by_clan = sut.fetch_clans(later, {1: None, 2: None}, checkpoint, on_checkpoint)
+        self.assertNotIn(walnut_profile_path, self.fake.requested_paths())
+        self.assertIn(oby_profile_path, self.fake.requested_paths())
+        self.assertEqual(
+            bundles_by_clan[1].stats_by_player['Walnut Waffle'].activity_stats[0].completions, 2
+        )
+        self.assertEqual(set(bundles_by_clan[2].stats_by_player.keys()), {'Oby1Chick'})
+        self.assertEqual(sut.sync_stats()['resumed'], 1)
+        self.assertEqual(checkpoints[-1].started_datetime, SUT_NOW.isoformat())
+        self.assertEqual(len(checkpoints[-1].sync_state.players_by_account_id), 2)
+
+        self.fake.clear_requested_paths()
+        sut.fetch_clans(SUT_NOW + timedelta(hours=2), {1: None}, checkpoint)
+        self.assertIn(walnut_profile_path, self.fake.requested_paths())
+
+    def test_connections_are_reused_across_syncs(self):
+        """Verifies the connection pool outlives a sync and never exceeds the concurrency limit."""
+        clans = api_fetcher.DESTINY_2_CLANS_WATCHLIST
+        for i in range(20):
+            self.fake.add_player(clans[i % 2], FakePlayer('Player' + str(i), str(i), {
+                str(i) + '1': {LEVIATHAN_HASH: 1},
+                str(i) + '2': {LAST_WISH_HASH: 2},
+            }))
+        sut = self.fetcher(max_concurrent_requests=4)
+        sut.fetch(SUT_NOW)
+        first_stats = sut.pool_stats()
+        bundle = sut.fetch(SUT_NOW)
+        second_stats = sut.pool_stats()
+        self.assertEqual(len(bundle.stats_by_player), 20)
+        self.assertLessEqual(first_stats['new_connections'], 4)
+        self.assertEqual(second_stats['new_connections'], first_stats['new_connections'])
+        requests_count = len(self.fake.requested_paths())
+        self.assertEqual(
+            second_stats['hits'] + second_stats['new_connections'],
+            requests_count
+        )
+
+    def test_sessions_of_every_loop_are_closed(self):
+        """Verifies switching between the blocking and async methods leaks no session."""
+        clans = api_fetcher.DESTINY_2_CLANS_WATCHLIST
+        self.fake.add_player(
+            clans[0], FakePlayer('Walnut Waffle', '1', {'11': {LEVIATHAN_HASH: 2}})
+        )
+        sut = self.fetcher(max_concurrent_requests=4)
+
+        async def fetch_async():
+            bundle = await sut.fetch_async(SUT_NOW)
+            await sut.close_async()
+            return bundle
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            sut.fetch(SUT_NOW)
+            bundle = asyncio.run(fetch_async())
+            sut.fetch(SUT_NOW)
+            sut.close()
+            self.fetchers.remove(sut)
+            del sut
+            gc.collect()
+        self.assertIn('Walnut Waffle', bundle.stats_by_player)
+        self.assertEqual(
+            [warning for warning in caught if 'Unclosed' in str(warning.message)], []
+        )
+
+    def test_response_cache(self):
+        """Verifies cached responses are served fresh from disk, then revalidated with ETags."""
+        clans = api_fetcher.DESTINY_2_CLANS_WATCHLIST
+        self.fake.add_player(
+            clans[0], FakePlayer('Walnut Waffle', '1', {'11': {LEVIATHAN_HASH: 2}})
+        )
+        self.fake.add_player(clans[1], FakePlayer('Oby1Chick', '2', {'21': {LAST_WISH_HASH: 4}}))
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResponseCache(directory, [(r'/GroupV2/', 3600)])
+            bundle = self.fetcher(max_concurrent_requests=4, response_cache=cache).fetch(SUT_NOW)
+            first_requests = len(self.fake.requested_paths())
+            # After a restart, with a new fetcher.
+            cache = ResponseCache(directory, [(r'/GroupV2/', 3600)])
+            sut = self.fetcher(max_concurrent_requests=4, response_cache=cache)
+            bundle2 = sut.fetch(SUT_NOW)
+            second_requests = len(self.fake.requested_paths()) - first_requests
+            stats = sut.cache_stats()
+        self.assertEqual(bundle2, bundle)
+        clan_pages = len(clans)
+        self.assertEqual(stats['misses'], 0)
+        self.assertEqual(stats['hits'], clan_pages)
+        self.assertEqual(second_requests, first_requests - clan_pages)
+        self.assertEqual(stats['revalidations'], second_requests)
+        self.assertEqual(stats['not_modified'], second_requests)
+
+    def test_response_cache_failures(self):
+        """Verifies error payloads are not cached, and failures to write the cache are ignored."""
+        manifest_path = '/Destiny2/Manifest/'
+        error_path = '/Destiny2/SearchDestinyPlayer/-1/Nobody/'
+        self.fake.add_fixture(manifest_path, {'ErrorCode': 1, 'Response': {'version': '1'}})
+        self.fake.add_fixture(error_path, {'ErrorCode': 5, 'Message': 'SystemDisabled'})
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ResponseCache(directory, [(r'/', 3600)])
+            sut = self.fetcher(max_concurrent_requests=4, response_cache=cache)
+            self.assertEqual(sut.run_blocking(sut.request(error_path))['ErrorCode'], 5)
+            sut.run_blocking(sut.request(manifest_path))
+            self.assertFalse(cache.filepath(sut.url(error_path)).exists())
+            self.assertTrue(cache.filepath(sut.url(manifest_path)).exists())
+
+            broken_directory = os.path.join(directory, 'broken')
+            broken_cache = ResponseCache(broken_directory)
+            os.rmdir(broken_directory)
+            with open(broken_directory, 'w', encoding='utf-8'):
+                pass
+            sut = self.fetcher(max_concurrent_requests=4, response_cache=broken_cache)
+            content = sut.run_blocking(sut.request(manifest_path))
+            self.assertEqual(content['Response'], {'version': '1'})
+
+    def test_response_cache_keys(self):
+        """Verifies the responses of an endpoint are not served for another endpoint."""
+        manifest_path = '/Destiny2/Manifest/'
+        self.fake.add_fixture(manifest_path, {'ErrorCode': 1, 'Response': {'version': '1'}})
+        other_fake = FakeBungieServer(FakeBungieOptions(clans=0))
+        other_fake.add_fixture(manifest_path, {'ErrorCode': 1, 'Response': {'version': '2'}})
+        other_endpoint = other_fake.start()
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                cache = ResponseCache(directory, [(r'/', 3600)])
+                sut = self.fetcher(response_cache=cache)
+                other_sut = self.fetcher(response_cache=cache, endpoint=other_endpoint)
+                content = sut.run_blocking(sut.request(manifest_path))
+                other_content = other_sut.run_blocking(other_sut.request(manifest_path))
+        finally:
+            other_fake.stop()
+        self.assertEqual(content['Response'], {'version': '1'})
+        self.assertEqual(other_content['Response'], {'version': '2'})
+        self.assertEqual(sut.url(manifest_path), self.endpoint + manifest_path)
+
+    def test_throttled_requests_are_retried(self):
+        """Verifies throttled responses shrink the concurrency and are retried."""
+        clans = api_fetcher.DESTINY_2_CLANS_WATCHLIST
+        self.fake.add_player(
+            clans[0], FakePlayer('Walnut Waffle', '1', {'11': {LEVIATHAN_HASH: 2}})
+        )
+        self.fake.add_player(clans[1], FakePlayer('Oby1Chick', '2', {'21': {LAST_WISH_HASH: 4}}))
+        self.fake.throttle('/GroupV2/' + str(clans[0]) + '/members/', 1, 200)
+        self.fake.throttle(
+            '/Destiny2/3/Account/2/Character/21/Stats/AggregateActivityStats/', 1, 429
+        )
+        sut = self.fetcher(max_concurrent_requests=16)
+        bundle = sut.fetch(SUT_NOW)
+        stats = sut.request_stats()
+        self.assertEqual(set(bundle.stats_by_player.keys()), {'Walnut Waffle', 'Oby1Chick'})
+        stats_by_type = {
+            stat.activity_type: stat.completions
+            for stat in bundle.stats_by_player['Oby1Chick'].activity_stats
+        }
+        self.assertEqual(stats_by_type[ActivityID.Type.LAST_WISH], 4)
+        self.assertEqual(stats['throttles'], 2)
+        self.assertEqual(stats['retries'], 2)
+        self.assertEqual(stats['requests'], len(self.fake.requested_paths()))
+        self.assertLess(stats['concurrency'], api_fetcher.INITIAL_CONCURRENT_REQUESTS)
+
+    def test_slow_requests_are_hedged(self):
+        """Verifies a slow request is duplicated and answered by the duplicate."""
+        self.fake.add_player(1, FakePlayer('Walnut Waffle', '1', {'11': {LEVIATHAN_HASH: 2}}))
+        self.fake.add_player(2, FakePlayer('Oby1Chick', '2', {'21': {LAST_WISH_HASH: 4}}))
+        hedger = RequestHedger(percentile=50, max_hedge_ratio=1, min_samples=1)
+        sut = self.fetcher(max_concurrent_requests=16, hedger=hedger)
+        sut.fetch_clans(SUT_NOW, {1: None, 2: None})
+        self.fake.delay_once(
+            '/Destiny2/3/Account/2/Character/21/Stats/AggregateActivityStats/', 1
+        )
+        bundles_by_clan = sut.fetch_clans(SUT_NOW, {1: None, 2: None})
+        stats = sut.hedging_stats()
+        request_stats = sut.request_stats()
+        stats_by_type = {
+            stat.activity_type: stat.completions
+            for stat in bundles_by_clan[2].stats_by_player['Oby1Chick'].activity_stats
+        }
+        self.assertEqual(stats_by_type[ActivityID.Type.LAST_WISH], 4)
+        self.assertGreaterEqual(stats['hedge_wins'], 1)
+        self.assertLess(stats['p99_request_seconds'], 1)
+        self.assertEqual(request_stats['requests'], len(self.fake.requested_paths()))
+        self.assertEqual(request_stats['requests'], stats['requests'] + stats['hedges'])
+        self.assertRaises(ValueError, api_fetcher.FetcherOptions, hedger=0.95)
+
+    def test_invalid_concurrency(self):
+        """Verifies the fetcher rejects invalid concurrency limits."""
+        self.assertRaises(ValueError, api_fetcher.FetcherOptions, max_concurrent_requests=0)
+        self.assertRaises(ValueError, api_fetcher.FetcherOptions, max_concurrent_requests=None)
+        self.assertRaises(ValueError, api_fetcher.FetcherOptions, max_network_retries=-1)
+        self.assertRaises(ValueError, api_fetcher.FetcherOptions, max_concurrency=4)
+        self.assertRaises(ValueError, api_fetcher.Fetcher, 'key', 4)
 
     def test_fetch(self):
         """Makes a fetch call and asserts its contents against some known stuff."""
@@ -0,0 +1,67 @@
+from array import array
+from protos.activity_id_pb2 import ActivityID
+from protos.api_bundle_pb2 import APIBundle
+
+ACTIVITY_TYPES_COUNT = max(ActivityID.Type.values()) + 1
+
+
+def new_completions_row():
+    """:return: A row of zero completions, indexed by ActivityID.Type."""
+    return array('l', [0]) * ACTIVITY_TYPES_COUNT
+
+
+class CompletionsMatrix:
+    """
+    Dense players × ActivityID.Type matrix of completions.
+    Rows are aggregated by gamer tag in a single pass, then turned into an APIBundle.
+    """
+
+    def __init__(self, activity_types):
+        """
+        :param activity_types: The activity types to report for every player, even when they have
+        no completion.
+        """
+        self.__activity_types = sorted(set(activity_types))
+        self.__row_by_gamer_tag = {}
+        self.__completions = array('l')
+        self.__stale_gamer_tags = set()
+
+    def __len__(self):
+        return len(self.__row_by_gamer_tag)
+
+    def __contains__(self, gamer_tag):
+        return gamer_tag in self.__row_by_gamer_tag
+
+    def add(self, gamer_tag, completions, stale=False):
+        """
+        Adds a row of completions to the totals of a player.
+        :param gamer_tag: The player's gamer tag.
+        :param completions: A row of completions, indexed by ActivityID.Type.
+        :param stale: Whether the completions are the ones of a previous sync.
+        """
+        if stale:
+            self.__stale_gamer_tags.add(gamer_tag)
+        row = self.__row_by_gamer_tag.get(gamer_tag)
+        if row is None:
+            self.__row_by_gamer_tag[gamer_tag] = len(self.__row_by_gamer_tag)
+            self.__completions.extend(completions)
+            return
+        offset = row * ACTIVITY_TYPES_COUNT
+        for activity_type in range(ACTIVITY_TYPES_COUNT):
+            self.__completions[offset + activity_type] += completions[activity_type]
+
+    def to_api_bundle(self):
+        """
+        :return: An APIBundle with the stats of every player of the matrix, sorted by activity type.
+        """
+        bundle = APIBundle()
+        for gamer_tag, row in self.__row_by_gamer_tag.items():
+            offset = row * ACTIVITY_TYPES_COUNT
+            stats = bundle.stats_by_player[gamer_tag]
+            stats.stale = gamer_tag in self.__stale_gamer_tags
+            activity_stats = stats.activity_stats
+            for activity_type in self.__activity_types:
+                stat = activity_stats.add()
+                stat.activity_type = activity_type
+                stat.completions = self.__completions[offset + activity_type]
+        return bundle
@@ -0,0 +1,134 @@
+"""
+Micro-benchmark of the aggregation of activity completions, from the Bungie responses of every
+character to the APIBundle. Compares the dense completions matrix with the former sort/groupby
+reduce_by_key pipeline.
+Usage: completions_matrix_benchmark [players] [repetitions]
+"""
+from functools import reduce
+import itertools
+import random
+import sys
+import time
+from components.api_fetcher.activity_hashes import DESTINY_2_ACTIVITIES_BY_HASH
+from components.api_fetcher.completions_matrix import CompletionsMatrix
+from components.api_fetcher.completions_matrix import new_completions_row
+from protos.api_bundle_pb2 import APIBundle
+
+DEFAULT_PLAYERS = 1000
+DEFAULT_REPETITIONS = 5
+CHARACTERS_PER_PLAYER = 3
+OTHER_ACTIVITIES_PER_CHARACTER = 40
+
+
+def generate_characters(players):
+    """
+    :param players: The number of players.
+    :return: An array of (gamer_tag, membership_type, membership_id, character_id, activities)
+    tuples, where activities mimics the AggregateActivityStats response of the character.
+    """
+    generator = random.Random(42)
+    raid_hashes = list(DESTINY_2_ACTIVITIES_BY_HASH.keys())
+    characters = []
+    for player in range(players):
+        for character in range(CHARACTERS_PER_PLAYER):
+            hashes = generator.sample(raid_hashes, generator.randint(0, len(raid_hashes)))
+            hashes += [generator.randint(1, 2**32) for _ in range(OTHER_ACTIVITIES_PER_CHARACTER)]
+            activities = [
+                {
+                    'activityHash': activity_hash,
+                    'values': {'activityCompletions': {'basic': {
+                        'value': float(generator.randint(0, 50))
+                    }}},
+                }
+                for activity_hash in hashes
+            ]
+            characters.append(
+                ('Player' + str(player), '3', str(player), str(player * 10 + character), activities)
+            )
+    return characters
+
+
+def reduce_by_key(key_function, reduce_function, iterable):
+    """The former sort + groupby aggregation."""
+    iterable = list(iterable)
+    iterable.sort(key=key_function)
+    grouped = [list(values) for key, values in itertools.groupby(iterable, key_function)]
+    return map(lambda row: reduce(reduce_function, row), grouped)
+
+
+def aggregate_with_reduce_by_key(characters):
+    """The former aggregation pipeline. :return: The APIBundle."""
+    completions = []
+    for gamer_tag, membership_type, membership_id, character_id, activities in characters:
+        defaults = [
+            (gamer_tag, membership_type, membership_id, character_id, activity_type, 0)
+            for activity_type in DESTINY_2_ACTIVITIES_BY_HASH.values()
+        ]
+        results = filter(lambda a: a['activityHash'] in DESTINY_2_ACTIVITIES_BY_HASH, activities)
+        results = map(
+            lambda a, character=(gamer_tag, membership_type, membership_id, character_id): (
+                *character,
+                DESTINY_2_ACTIVITIES_BY_HASH[a['activityHash']],
+                int(a['values']['activityCompletions']['basic']['value'])
+            ),
+            results
+        )
+        completions += reduce_by_key(
+            lambda a: a[4],
+            lambda a1, a2: (a1[0], a1[1], a1[2], a1[3], a1[4], a1[5]+a2[5]),
+            list(results) + defaults
+        )
+    completions = reduce_by_key(
+        lambda c: (c[2], c[4]),
+        lambda c1, c2: (c1[0], c1[1], c1[2], c1[3], c1[4], c1[5]+c2[5]),
+        completions
+    )
+    bundle = APIBundle()
+    for completion in completions:
+        stat = APIBundle.Stats.ActivityStat()
+        stat.activity_type = completion[4]
+        stat.completions = completion[5]
+        bundle.stats_by_player[completion[0]].activity_stats.append(stat)
+    return bundle
+
+
+def aggregate_with_matrix(characters):
+    """The current aggregation pipeline. :return: The APIBundle."""
+    matrix = CompletionsMatrix(DESTINY_2_ACTIVITIES_BY_HASH.values())
+    for character in characters:
+        completions = new_completions_row()
+        for activity in character[4]:
+            activity_type = DESTINY_2_ACTIVITIES_BY_HASH.get(activity['activityHash'])
+            if activity_type is not None:
+                completions[activity_type] += \
+                    int(activity['values']['activityCompletions']['basic']['value'])
+        matrix.add(character[0], completions)
+    return matrix.to_api_bundle()
+
+
+def measure(function, characters, repetitions):
+    """:return: The best wall time in seconds of |function| over |repetitions| runs."""
+    timings = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        function(characters)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    """Runs the benchmark with the players and repetitions given on the command line."""
+    player_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PLAYERS
+    repetition_count = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_REPETITIONS
+    all_characters = generate_characters(player_count)
+    if aggregate_with_reduce_by_key(all_characters) != aggregate_with_matrix(all_characters):
+        raise AssertionError("Les deux agrégations ne donnent pas le même résultat.")
+    legacy = measure(aggregate_with_reduce_by_key, all_characters, repetition_count)
+    current = measure(aggregate_with_matrix, all_characters, repetition_count)
+    print(f"{player_count} joueurs, {len(all_characters)} personnages")
+    print(f"reduce_by_key : {legacy * 1000:.1f} ms")
+    print(f"matrice : {current * 1000:.1f} ms (x{legacy / current:.1f})")
+
+
+if __name__ == "__main__":
+    main()
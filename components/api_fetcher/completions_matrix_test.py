@@ -0,0 +1,65 @@
+import unittest
+from components.api_fetcher import completions_matrix
+from protos.activity_id_pb2 import ActivityID
+
+
+def row(**completions_by_type):
+    """:return: A row of completions with the given completions by ActivityID.Type name."""
+    result = completions_matrix.new_completions_row()
+    for activity_type, completions in completions_by_type.items():
+        result[ActivityID.Type.Value(activity_type)] = completions
+    return result
+
+
+class CompletionsMatrixTest(unittest.TestCase):
+    """Test class for the dense completions matrix."""
+
+    def setUp(self):
+        """Sets up a basic sut."""
+        self.sut = completions_matrix.CompletionsMatrix([
+            ActivityID.Type.LAST_WISH,
+            ActivityID.Type.LEVIATHAN,
+            ActivityID.Type.LAST_WISH,
+        ])
+
+    def test_empty(self):
+        """Verifies an empty matrix has no player."""
+        self.assertEqual(len(self.sut), 0)
+        self.assertEqual(len(self.sut.to_api_bundle().stats_by_player), 0)
+
+    def test_rows_are_summed_by_gamer_tag(self):
+        """Verifies the rows of a player are summed and reported for every activity type."""
+        self.sut.add('Oscar', row(LEVIATHAN=2, LAST_WISH=1))
+        self.sut.add('Tango', row(LAST_WISH=5))
+        self.sut.add('Oscar', row(LEVIATHAN=3, CROWN_OF_SORROW=4))
+        self.assertEqual(len(self.sut), 2)
+        bundle = self.sut.to_api_bundle()
+        stats = {
+            gamer_tag: [(s.activity_type, s.completions) for s in player_stats.activity_stats]
+            for gamer_tag, player_stats in bundle.stats_by_player.items()
+        }
+        self.assertEqual(stats, {
+            'Oscar': [(ActivityID.Type.LEVIATHAN, 5), (ActivityID.Type.LAST_WISH, 1)],
+            'Tango': [(ActivityID.Type.LEVIATHAN, 0), (ActivityID.Type.LAST_WISH, 5)],
+        })
+
+    def test_stale_rows(self):
+        """Verifies players with a stale row are marked as stale."""
+        self.sut.add('Oscar', row(LEVIATHAN=2))
+        self.sut.add('Tango', row(LAST_WISH=5), stale=True)
+        self.assertIn('Tango', self.sut)
+        self.assertNotIn('Kilo', self.sut)
+        bundle = self.sut.to_api_bundle()
+        self.assertFalse(bundle.stats_by_player['Oscar'].stale)
+        self.assertTrue(bundle.stats_by_player['Tango'].stale)
+
+    def test_rows_cover_every_activity_type(self):
+        """Verifies rows can be indexed by any ActivityID.Type."""
+        completions = completions_matrix.new_completions_row()
+        for activity_type in ActivityID.Type.values():
+            completions[activity_type] += 1
+        self.assertEqual(sum(completions), len(ActivityID.Type.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,624 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import urllib.parse
+from aiohttp import web
+from components.api_fetcher.activity_hashes import DESTINY_1_ACTIVITIES_BY_HASH
+from components.api_fetcher.activity_hashes import DESTINY_2_ACTIVITIES_BY_HASH
+from components.api_fetcher.api_fetcher import DESTINY_1_PLATFORM_PATH
+
+LATENCY_DISTRIBUTIONS = ('constant', 'uniform', 'exponential')
+FIRST_CLAN_ID = 1000
+DISPLAY_NAME_PREFIX = 'Gardien'
+PLATFORM_PREFIX = '/platform'
+DATE_LAST_PLAYED = '2020-08-01T20:00:00Z'
+OTHER_ACTIVITIES_PER_CHARACTER = 20
+THROTTLE_ERROR_CODE = 36 # ThrottleLimitExceeded
+SUCCESS_ERROR_CODE = 1 # Success
+UNHANDLED_EXCEPTION_ERROR_CODE = 3 # UnhandledException
+MANIFEST_VERSION = 'synthetic'
+ACTIVITY_DEFINITIONS_PATH = \
+    '/common/destiny2_content/json/en/DestinyActivityDefinition-synthetic.json'
+FAULT_POLL_SECONDS = 0.01
+FAILURE_DELAY_SECONDS = 0.05
+MAX_HOLD_SECONDS = 5
+
+
+def activities(completions):
+    """
+    :param completions: An {activity_hash: completions} dict.
+    :return: The activities of an AggregateActivityStats response.
+    """
+    return [
+        {'activityHash': h, 'values': {'activityCompletions': {'basic': {'value': n}}}}
+        for h, n in completions.items()
+    ]
+
+
+class FakeBungieOptions:
+    """
+    Configuration of a FakeBungieServer. Every option has a default, overridden by keyword, e.g
+    FakeBungieOptions(clans=2, roster_size=5).
+    - clans: The number of synthetic clans. See |FakeBungieServer.clan_ids|.
+    - roster_size: The number of members of each synthetic clan.
+    - characters_per_player: The number of characters of each synthetic member.
+    - destiny1_rate: The probability of a synthetic member playing on PlayStation, with Destiny 1
+    characters as well. Others play on Steam.
+    - latency_seconds: The mean latency of responses.
+    - latency_distribution: One of LATENCY_DISTRIBUTIONS.
+    - error_rate: The probability of a response being an HTTP 500.
+    - throttle_rate: The probability of a response being throttled.
+    - throttle_seconds: The ThrottleSeconds of throttled responses.
+    - throttle_status: The HTTP status of throttled responses: 200 like Bungie, or 429.
+    - seed: Seed of the synthetic data and of the random latencies, errors and throttles.
+    """
+    clans = 5
+    roster_size = 100
+    characters_per_player = 3
+    destiny1_rate = 0
+    latency_seconds = 0
+    latency_distribution = 'constant'
+    error_rate = 0
+    throttle_rate = 0
+    throttle_seconds = 0
+    throttle_status = 200
+    seed = 0
+
+    def __init__(self, **options):
+        """
+        :param options: The options that differ from their default.
+        :raises: ValueError if an option is unknown or invalid.
+        """
+        for name, value in options.items():
+            if name.startswith('_') or not hasattr(FakeBungieOptions, name):
+                raise ValueError("Option du faux serveur Bungie inconnue: " + name)
+            setattr(self, name, value)
+        if min(self.clans, self.roster_size, self.characters_per_player, self.latency_seconds) < 0:
+            raise ValueError("Configuration du faux serveur Bungie invalide")
+        if self.latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError("Distribution de latence inconnue: " + str(self.latency_distribution))
+        if not 0 <= self.error_rate <= 1 or not 0 <= self.throttle_rate <= 1:
+            raise ValueError("Taux d'erreurs invalide")
+        if not 0 <= self.destiny1_rate <= 1:
+            raise ValueError("Proportion de joueurs Destiny 1 invalide")
+
+
+class FakePlayer:
+    """
+    A player served from the fixtures of a FakeBungieServer. See |FakeBungieServer.add_player|.
+    Every detail has a default, overridden by keyword:
+    - membership_type: The platform of the player.
+    - date_last_played: The last played datetime of every character of the player.
+    - bungie_net_id: The ID of the Bungie.net account of the player, if linked.
+    - destiny1_completions_by_character: Same as |completions_by_character| for the Destiny 1
+    characters of the player.
+    - listed_membership: Optional (membership_type, membership_id) tuple of another membership of
+    a cross-saved player, listed by clans instead of the primary one.
+    """
+    membership_type = 3
+    date_last_played = DATE_LAST_PLAYED
+    bungie_net_id = None
+    destiny1_completions_by_character = None
+    listed_membership = None
+
+    def __init__(self, gamer_tag, membership_id, completions_by_character, **details):
+        """
+        :param gamer_tag: The display name of the player.
+        :param membership_id: The membership ID of the player, as a string.
+        :param completions_by_character: A {character_id: {activity_hash: completions}} dict.
+        :param details: The details that differ from their default.
+        """
+        for name, value in details.items():
+            if name.startswith('_') or not hasattr(FakePlayer, name):
+                raise ValueError("Détail de joueur inconnu: " + name)
+            setattr(self, name, value)
+        self.gamer_tag = gamer_tag
+        self.membership_id = membership_id
+        self.completions_by_character = completions_by_character
+
+    def user_info(self):
+        """:return: The destinyUserInfo of the player, as listed by clans."""
+        if self.listed_membership is not None:
+            return {
+                'displayName': self.gamer_tag,
+                'membershipType': self.listed_membership[0],
+                'membershipId': self.listed_membership[1],
+                'crossSaveOverride': self.membership_type,
+            }
+        return {
+            'displayName': self.gamer_tag,
+            'membershipType': self.membership_type,
+            'membershipId': self.membership_id,
+            'crossSaveOverride': 0,
+        }
+
+    def account(self):
+        """:return: The GetMembershipsById response of the membership listed by clans."""
+        user_info = self.user_info()
+        memberships = [user_info]
+        if user_info['membershipId'] != self.membership_id:
+            memberships.append({
+                'displayName': self.gamer_tag,
+                'membershipType': self.membership_type,
+                'membershipId': self.membership_id,
+                'crossSaveOverride': self.membership_type,
+            })
+        account = {'destinyMemberships': memberships}
+        if self.bungie_net_id:
+            account['bungieNetUser'] = {'membershipId': self.bungie_net_id}
+        return {'Response': account}
+
+
+class LocalServer:
+    """Serves an aiohttp request handler on a local port."""
+
+    def __init__(self, handler):
+        """:param handler: The aiohttp request handler of every path."""
+        self.__handler = handler
+        self.__runner = None
+        self.__loop = None
+        self.__thread = None
+
+    async def start_async(self, host, port):
+        """
+        Starts serving on the running event loop.
+        :param host: The interface to listen on.
+        :param port: The port to listen on. 0 picks a free one.
+        :return: The root URL of the server.
+        """
+        app = web.Application()
+        app.router.add_get('/{tail:.*}', self.__handler)
+        self.__runner = web.AppRunner(app, access_log=None)
+        await self.__runner.setup()
+        site = web.TCPSite(self.__runner, host, port)
+        await site.start()
+        return 'http://' + host + ':' + str(self.__runner.addresses[0][1])
+
+    async def stop_async(self):
+        """Stops serving."""
+        if self.__runner is not None:
+            await self.__runner.cleanup()
+            self.__runner = None
+
+    def start(self, host, port):
+        """
+        Same as |start_async| but serves from a background thread with its own event loop.
+        :return: The root URL of the server.
+        """
+        self.__loop = asyncio.new_event_loop()
+        url = self.__loop.run_until_complete(self.start_async(host, port))
+        self.__thread = threading.Thread(target=self.__loop.run_forever, daemon=True)
+        self.__thread.start()
+        return url
+
+    def stop(self):
+        """Stops the server started with |start|."""
+        if self.__loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.stop_async(), self.__loop).result()
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join()
+        self.__loop.close()
+        self.__loop = None
+
+
+class FakeBungieServer:
+    """
+    Local stand-in for the Bungie API, for reproducible sync benchmarks and fetcher tests.
+    Serves the GroupV2 members, SearchDestinyPlayer, GetMembershipsById, Profile and
+    AggregateActivityStats endpoints, the Destiny 1 Account Summary and AggregateActivityStats
+    endpoints, and the manifest with its activity definitions, from recorded fixtures or from
+    synthetic clans generated on the fly.
+    Synthetic characters also play variants of the raids that are only listed in the manifest.
+    Latency, errors and throttling are configurable, and faults can be injected on given paths.
+    """
+
+    def __init__(self, options=None, fixtures=None):
+        """
+        :param options: Optional FakeBungieOptions. Defaults to FakeBungieOptions().
+        :param fixtures: Optional {path: content} dict of recorded responses. Served first.
+        """
+        self.__options = options or FakeBungieOptions()
+        self.__fixtures = dict(fixtures or {})
+        self.__random = random.Random(self.__options.seed)
+        self.__stats = {'requests': 0, 'errors': 0, 'throttles': 0, 'not_found': 0}
+        self.__requested_paths = []
+        self.__faults_by_path = {}
+        self.__server = LocalServer(self.handle)
+
+    @staticmethod
+    def load_fixtures(filepath):
+        """
+        :param filepath: A JSON file with a {path: content} object of recorded responses.
+        :return: The recorded responses, to be given as |fixtures|.
+        """
+        with open(filepath, encoding='utf-8') as fixtures_file:
+            return json.load(fixtures_file)
+
+    def clan_ids(self):
+        """:return: The IDs of the synthetic clans, then of the clans of the fixtures."""
+        clan_ids = self.synthetic_clan_ids()
+        for path in self.__fixtures:
+            parts = path.strip('/').split('/')
+            if len(parts) == 3 and parts[0] == 'GroupV2' and parts[2] == 'members':
+                clan_ids.append(int(parts[1]))
+        return clan_ids
+
+    def synthetic_clan_ids(self):
+        """:return: The IDs of the synthetic clans."""
+        return list(range(FIRST_CLAN_ID, FIRST_CLAN_ID + self.__options.clans))
+
+    def stats(self):
+        """
+        :return: A dict with the number of requests received (requests), and of those answered with
+        a server error (errors), a throttle (throttles) or a 404 (not_found).
+        """
+        return dict(self.__stats)
+
+    def respond(self, path):
+        """
+        :param path: The requested path, relative to the API root.
+        :return: A (HTTP status, content) tuple. Content is None for unknown paths.
+        """
+        self.__stats['requests'] += 1
+        if self.__random.random() < self.__options.error_rate:
+            self.__stats['errors'] += 1
+            content = {
+                'ErrorCode': UNHANDLED_EXCEPTION_ERROR_CODE,
+                'ThrottleSeconds': 0,
+                'Response': {},
+            }
+            return 500, content
+        if self.__random.random() < self.__options.throttle_rate:
+            self.__stats['throttles'] += 1
+            content = {
+                'ErrorCode': THROTTLE_ERROR_CODE,
+                'ThrottleSeconds': self.__options.throttle_seconds,
+                'Response': {},
+            }
+            return self.__options.throttle_status, content
+        content = self.__fixtures.get(path)
+        if content is None:
+            content = self.synthetic_response(path)
+        if content is None:
+            self.__stats['not_found'] += 1
+            return 404, None
+        return 200, content
+
+    def synthetic_response(self, path):
+        """
+        :param path: The requested path, relative to the API root.
+        :return: The synthetic content for |path|, or None if it is unknown.
+        """
+        if path == ACTIVITY_DEFINITIONS_PATH:
+            return self.synthetic_activity_definitions()
+        parts = path.split('?')[0].strip('/').split('/')
+        if parts == ['Destiny2', 'Manifest']:
+            return self.synthetic_manifest()
+        if len(parts) == 3 and parts[0] == 'GroupV2' and parts[2] == 'members':
+            return self.synthetic_members(int(parts[1]))
+        if len(parts) == 4 and parts[0] == 'Destiny2' and parts[1] == 'SearchDestinyPlayer':
+            return self.synthetic_search(urllib.parse.unquote(parts[3]))
+        if len(parts) == 4 and parts[0] == 'User' and parts[1] == 'GetMembershipsById':
+            return self.synthetic_account(parts[2])
+        if len(parts) == 4 and parts[0] == 'Destiny2' and parts[2] == 'Profile':
+            return self.synthetic_profile(parts[3])
+        if len(parts) == 8 and parts[0] == 'Destiny2' and parts[7] == 'AggregateActivityStats':
+            return self.synthetic_activity_stats(parts[5])
+        if len(parts) == 5 and parts[0] == 'Destiny' and parts[4] == 'Summary':
+            return self.synthetic_destiny1_summary(parts[3])
+        if len(parts) == 6 and parts[0] == 'Destiny' and parts[2] == 'AggregateActivityStats':
+            return self.synthetic_activity_stats(parts[5], destiny1=True)
+        return None
+
+    def synthetic_manifest(self):
+        """:return: The synthetic manifest. Its version never changes."""
+        return {'ErrorCode': SUCCESS_ERROR_CODE, 'Response': {
+            'version': MANIFEST_VERSION,
+            'jsonWorldComponentContentPaths': {
+                'en': {'DestinyActivityDefinition': ACTIVITY_DEFINITIONS_PATH},
+            },
+        }}
+
+    @staticmethod
+    def synthetic_variant_hashes():
+        """:return: A {raid hash: hash of a variant} dict, for the Destiny 2 raids."""
+        return {
+            activity_hash: (activity_hash * 31 + 7) % 2**32
+            for activity_hash in DESTINY_2_ACTIVITIES_BY_HASH
+        }
+
+    def synthetic_activity_definitions(self):
+        """:return: The synthetic activity definitions: the Destiny 2 raids and their variants."""
+        definitions = {}
+        for activity_hash, variant_hash in self.synthetic_variant_hashes().items():
+            definition = {'displayProperties': {
+                'name': 'Raid ' + str(DESTINY_2_ACTIVITIES_BY_HASH[activity_hash])
+            }}
+            definitions[str(activity_hash)] = definition
+            definitions[str(variant_hash)] = definition
+        return definitions
+
+    def synthetic_membership_type(self, member):
+        """:return: The platform of a synthetic member: 2 for PlayStation, 3 for Steam."""
+        generator = random.Random(str(self.__options.seed) + '/platform/' + str(member))
+        return 2 if generator.random() < self.__options.destiny1_rate else 3
+
+    def synthetic_members(self, clan_id):
+        """:return: The members page of a synthetic clan. Unknown clans have no members."""
+        results = []
+        if clan_id in self.synthetic_clan_ids():
+            first_member = (clan_id - FIRST_CLAN_ID) * self.__options.roster_size
+            for member in range(first_member, first_member + self.__options.roster_size):
+                results.append({
+                    'destinyUserInfo': {
+                        'displayName': DISPLAY_NAME_PREFIX + str(member),
+                        'membershipType': self.synthetic_membership_type(member),
+                        'membershipId': str(member),
+                        'crossSaveOverride': 0,
+                    },
+                    'bungieNetUserInfo': {'membershipId': str(member)},
+                })
+        return {'ErrorCode': SUCCESS_ERROR_CODE, 'Response': {'results': results}}
+
+    def synthetic_search(self, display_name):
+        """:return: The synthetic members whose display name is |display_name|."""
+        results = []
+        member = display_name[len(DISPLAY_NAME_PREFIX):]
+        if display_name.startswith(DISPLAY_NAME_PREFIX) and member.isdigit() and \
+                int(member) < self.__options.clans * self.__options.roster_size:
+            results.append({
+                'displayName': display_name,
+                'membershipType': self.synthetic_membership_type(int(member)),
+                'membershipId': member,
+                'crossSaveOverride': 0,
+            })
+        return {'ErrorCode': SUCCESS_ERROR_CODE, 'Response': results}
+
+    def synthetic_account(self, membership_id):
+        """:return: The memberships of a synthetic member, and their Bungie.net account."""
+        if not membership_id.isdigit() or \
+                int(membership_id) >= self.__options.clans * self.__options.roster_size:
+            return None
+        return {'ErrorCode': SUCCESS_ERROR_CODE, 'Response': {
+            'destinyMemberships': [{
+                'displayName': DISPLAY_NAME_PREFIX + membership_id,
+                'membershipType': self.synthetic_membership_type(int(membership_id)),
+                'membershipId': membership_id,
+                'crossSaveOverride': 0,
+            }],
+            'bungieNetUser': {'membershipId': membership_id},
+        }}
+
+    def synthetic_profile(self, membership_id):
+        """:return: The characters of a synthetic member."""
+        characters = {
+            f'{membership_id}{character:03d}': {'dateLastPlayed': DATE_LAST_PLAYED}
+            for character in range(self.__options.characters_per_player)
+        }
+        return {'ErrorCode': SUCCESS_ERROR_CODE, 'Response': {'characters': {'data': characters}}}
+
+    def synthetic_destiny1_summary(self, membership_id):
+        """
+        :return: The Destiny 1 characters of a synthetic member. Their IDs do not collide with the
+        Destiny 2 ones.
+        """
+        characters = [
+            {'characterBase': {
+                'characterId': f'1{membership_id}{character:03d}',
+                'dateLastPlayed': DATE_LAST_PLAYED,
+            }}
+            for character in range(self.__options.characters_per_player)
+        ]
+        return {'ErrorCode': SUCCESS_ERROR_CODE, 'Response': {'data': {'characters': characters}}}
+
+    def synthetic_activity_stats(self, character_id, destiny1=False):
+        """
+        :param destiny1: Whether the character is a Destiny 1 one.
+        :return: The activity stats of a synthetic character. Stable across calls.
+        """
+        generator = random.Random(str(self.__options.seed) + '/' + character_id)
+        if destiny1:
+            raid_hashes = list(DESTINY_1_ACTIVITIES_BY_HASH.keys())
+        else:
+            raid_hashes = list(DESTINY_2_ACTIVITIES_BY_HASH.keys()) + \
+                list(self.synthetic_variant_hashes().values())
+        hashes = generator.sample(raid_hashes, generator.randint(0, len(raid_hashes)))
+        hashes += [generator.randint(1, 2**32) for _ in range(OTHER_ACTIVITIES_PER_CHARACTER)]
+        stats = [
+            {
+                'activityHash': activity_hash,
+                'values': {'activityCompletions': {'basic': {
+                    'value': float(generator.randint(0, 30))
+                }}},
+            }
+            for activity_hash in hashes
+        ]
+        if destiny1:
+            response = {'data': {'activities': stats}}
+            return {'ErrorCode': SUCCESS_ERROR_CODE, 'Response': response}
+        return {'ErrorCode': SUCCESS_ERROR_CODE, 'Response': {'activities': stats}}
+
+    def latency(self):
+        """:return: The latency of the next response, in seconds."""
+        (distribution, seconds) = (self.__options.latency_distribution,
+                                   self.__options.latency_seconds)
+        if distribution == 'uniform':
+            return self.__random.uniform(0, 2 * seconds)
+        if distribution == 'exponential' and seconds > 0:
+            return self.__random.expovariate(1 / seconds)
+        return seconds
+
+    def add_fixture(self, path, content):
+        """
+        Serves |content| for |path|, before any synthetic response. Replaces the previous fixture.
+        :param path: The path, relative to the API root. Query and escapes included.
+        :param content: The content of the responses, as a JSON-serializable dict.
+        """
+        self.__fixtures[path] = content
+
+    def add_player(self, clan_id, player):
+        """
+        Adds the fixtures of a player and their characters, and lists them in a clan. Adding a
+        player again replaces their characters.
+        :param clan_id: The clan the player belongs to.
+        :param player: The FakePlayer.
+        """
+        members_path = '/GroupV2/' + str(clan_id) + '/members/'
+        members = self.__fixtures.setdefault(members_path, {'Response': {'results': []}})
+        member = {'destinyUserInfo': player.user_info()}
+        if player.bungie_net_id:
+            member['bungieNetUserInfo'] = {'membershipId': player.bungie_net_id}
+        if member not in members['Response']['results']:
+            members['Response']['results'].append(member)
+        listed_user_info = player.user_info()
+        self.__fixtures['/User/GetMembershipsById/' + listed_user_info['membershipId'] + '/' +
+                        str(listed_user_info['membershipType']) + '/'] = player.account()
+        membership = str(player.membership_type) + '/'
+        profile_path = '/Destiny2/' + membership + 'Profile/' + player.membership_id + \
+            '/?components=Characters'
+        self.__fixtures[profile_path] = {'Response': {'characters': {'data': {
+            c: {'dateLastPlayed': player.date_last_played} for c in player.completions_by_character
+        }}}}
+        for character_id, completions in player.completions_by_character.items():
+            self.__fixtures[
+                '/Destiny2/' + membership + 'Account/' + player.membership_id + '/Character/' +
+                character_id + '/Stats/AggregateActivityStats/'
+            ] = {'Response': {'activities': activities(completions)}}
+        if player.destiny1_completions_by_character is None:
+            return
+        self.__fixtures[
+            '/Destiny/' + membership + 'Account/' + player.membership_id + '/Summary/'
+        ] = {'Response': {'data': {'characters': [
+            {'characterBase': {'characterId': c, 'dateLastPlayed': player.date_last_played}}
+            for c in player.destiny1_completions_by_character
+        ]}}}
+        for character_id, completions in player.destiny1_completions_by_character.items():
+            self.__fixtures[
+                '/Destiny/Stats/AggregateActivityStats/' + membership + player.membership_id +
+                '/' + character_id + '/'
+            ] = {'Response': {'data': {'activities': activities(completions)}}}
+
+    def requested_paths(self):
+        """
+        :return: The paths requested since the start or |clear_requested_paths|, in order. Paths
+        are relative to the API root, with the Destiny 1 platform prefix removed.
+        """
+        return list(self.__requested_paths)
+
+    def clear_requested_paths(self):
+        """Forgets the paths requested so far."""
+        self.__requested_paths.clear()
+
+    def hang(self, path):
+        """Does not answer requests for |path| until |clear_faults|."""
+        self.__faults_by_path[path] = ('hang', None)
+
+    def fail(self, path):
+        """Fails requests for |path| by closing their connection, shortly after they come in."""
+        self.__faults_by_path[path] = ('fail', None)
+
+    def delay_once(self, path, seconds):
+        """Delays the next response for |path| by |seconds|."""
+        self.__faults_by_path[path] = ('delay', seconds)
+
+    def throttle(self, path, times, status):
+        """
+        Throttles the first requests for |path|.
+        :param path: The path to throttle.
+        :param times: The number of requests to throttle.
+        :param status: The HTTP status of throttled responses: 200 like Bungie, or 429.
+        """
+        self.__faults_by_path[path] = ('throttle', (times, status))
+
+    def hold_until_stats_requested(self, path):
+        """Holds back the responses for |path| until a first AggregateActivityStats request."""
+        self.__faults_by_path[path] = ('hold', None)
+
+    def clear_faults(self):
+        """Removes the faults of every path. Hung requests are answered."""
+        self.__faults_by_path.clear()
+
+    async def inject_fault(self, path):
+        """
+        Applies the fault of |path|, if any. A path has at most one fault: the last one injected.
+        Faults are polled rather than awaited, as they are injected from another thread.
+        :param path: The requested path, relative to the API root.
+        :return: A (HTTP status, content) tuple that replaces the response, or None.
+        """
+        (fault, argument) = self.__faults_by_path.get(path, (None, None))
+        if fault == 'hang':
+            while self.__faults_by_path.get(path, (None,))[0] == 'hang':
+                await asyncio.sleep(FAULT_POLL_SECONDS)
+        elif fault == 'hold':
+            for _ in range(int(MAX_HOLD_SECONDS / FAULT_POLL_SECONDS)):
+                if any(p.endswith('/AggregateActivityStats/') for p in self.__requested_paths):
+                    break
+                await asyncio.sleep(FAULT_POLL_SECONDS)
+        elif fault == 'delay':
+            del self.__faults_by_path[path]
+            await asyncio.sleep(argument)
+        elif fault == 'throttle':
+            (times, status) = argument
+            if times > 1:
+                self.__faults_by_path[path] = ('throttle', (times - 1, status))
+            else:
+                del self.__faults_by_path[path]
+            self.__stats['requests'] += 1
+            self.__stats['throttles'] += 1
+            return status, {'ErrorCode': THROTTLE_ERROR_CODE, 'ThrottleSeconds': 0, 'Response': {}}
+        return None
+
+    async def handle(self, request):
+        """aiohttp request handler. Supports ETag revalidation like Bungie."""
+        path = re.sub(
+            '^(' + re.escape(DESTINY_1_PLATFORM_PATH) + '|' + re.escape(PLATFORM_PREFIX) + ')',
+            '',
+            request.raw_path
+        )
+        self.__requested_paths.append(path)
+        if self.__faults_by_path.get(path, (None,))[0] == 'fail':
+            await asyncio.sleep(FAILURE_DELAY_SECONDS)
+            request.transport.close()
+            return web.Response(status=500)
+        latency = self.latency()
+        if latency > 0:
+            await asyncio.sleep(latency)
+        response = await self.inject_fault(path)
+        (status, content) = response or self.respond(path)
+        if content is None:
+            return web.Response(status=status)
+        etag = '"' + hashlib.sha1(json.dumps(content).encode()).hexdigest() + '"'
+        if status == 200 and request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.json_response(content, status=status, headers={'ETag': etag})
+
+    async def start_async(self, host='127.0.0.1', port=0):
+        """
+        Starts serving on the running event loop.
+        :param host: The interface to listen on.
+        :param port: The port to listen on. 0 picks a free one.
+        :return: The endpoint to give to the fetcher.
+        """
+        return await self.__server.start_async(host, port) + PLATFORM_PREFIX
+
+    async def stop_async(self):
+        """Stops serving. Hung requests are answered first."""
+        self.clear_faults()
+        await self.__server.stop_async()
+
+    def start(self, host='127.0.0.1', port=0):
+        """
+        Same as |start_async| but serves from a background thread with its own event loop, so that
+        the server does not compete with the fetcher for the loop.
+        :return: The endpoint to give to the fetcher.
+        """
+        return self.__server.start(host, port) + PLATFORM_PREFIX
+
+    def stop(self):
+        """Stops the server started with |start|. Hung requests are answered first."""
+        self.clear_faults()
+        self.__server.stop()
@@ -0,0 +1,174 @@
+from datetime import datetime
+import os
+import tempfile
+import unittest
+from dateutil import tz
+from components.api_fetcher import fake_bungie_server
+from components.api_fetcher.api_fetcher import Fetcher
+from components.api_fetcher.api_fetcher import FetcherOptions
+from components.api_fetcher.response_cache import ResponseCache
+from protos.activity_id_pb2 import ActivityID
+
+SUT_NOW = datetime(2020, 8, 12, 18, 15, 0, 0, tz.gettz('Europe/Paris'))
+LAST_WISH_HASH = 2122313384
+
+
+class FakeBungieServerTest(unittest.TestCase):
+    """Test class for the local stand-in of the Bungie API."""
+
+    def sync(self, sut):
+        """
+        Syncs every clan of |sut| with a fetcher pointed at it.
+        :return: A ({clan ID: APIBundle}, fetcher request stats) tuple.
+        """
+        endpoint = sut.start()
+        try:
+            fetcher = Fetcher('key', FetcherOptions(
+                max_concurrent_requests=8, max_requests_per_second=1000, endpoint=endpoint
+            ))
+            bundles_by_clan = fetcher.fetch_clans(
+                SUT_NOW, {clan_id: None for clan_id in sut.clan_ids()}
+            )
+            request_stats = fetcher.request_stats()
+            fetcher.close()
+        finally:
+            sut.stop()
+        return bundles_by_clan, request_stats
+
+    def test_synthetic_clans(self):
+        """Verifies synthetic clans are served with the configured rosters."""
+        sut = fake_bungie_server.FakeBungieServer(fake_bungie_server.FakeBungieOptions(
+            clans=2, roster_size=5, characters_per_player=2
+        ))
+        (bundles_by_clan, request_stats) = self.sync(sut)
+        self.assertEqual(sorted(bundles_by_clan.keys()), sut.clan_ids())
+        for bundle in bundles_by_clan.values():
+            self.assertEqual(len(bundle.stats_by_player), 5)
+        self.assertEqual(
+            sut.stats(), {'requests': 32, 'errors': 0, 'throttles': 0, 'not_found': 0}
+        )
+        self.assertEqual(request_stats['requests'], 32)
+        self.assertEqual(
+            sut.synthetic_activity_stats('1000'), sut.synthetic_activity_stats('1000')
+        )
+
+    def test_destiny1_players(self):
+        """Verifies synthetic PlayStation members are served Destiny 1 stats as well."""
+        sut = fake_bungie_server.FakeBungieServer(fake_bungie_server.FakeBungieOptions(
+            clans=1, roster_size=20, characters_per_player=2, destiny1_rate=0.5
+        ))
+        (bundles_by_clan, request_stats) = self.sync(sut)
+        bundle = bundles_by_clan[sut.clan_ids()[0]]
+        destiny1_players = [
+            gamer_tag for gamer_tag, stats in bundle.stats_by_player.items()
+            if any(stat.activity_type == ActivityID.Type.VAULT_OF_GLASS and stat.completions
+                   for stat in stats.activity_stats)
+        ]
+        self.assertGreater(len(destiny1_players), 0)
+        self.assertLess(len(destiny1_players), 20)
+        self.assertEqual(sut.stats()['not_found'], 0)
+        self.assertGreater(request_stats['requests'], 1 + 20 * 3)
+
+    def test_manifest(self):
+        """
+        Verifies the raid variants of the synthetic manifest are indexed and counted, and the
+        activity definitions are not kept in the response cache.
+        """
+        sut = fake_bungie_server.FakeBungieServer(
+            fake_bungie_server.FakeBungieOptions(clans=1, roster_size=5)
+        )
+        endpoint = sut.start()
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                index_path = os.path.join(directory, 'activity_index.dat')
+                cache = ResponseCache(os.path.join(directory, 'cache'))
+                fetcher = Fetcher('key', FetcherOptions(
+                    max_concurrent_requests=8,
+                    max_requests_per_second=1000,
+                    endpoint=endpoint,
+                    response_cache=cache,
+                    activity_index_path=index_path,
+                ))
+                bundles_by_clan = fetcher.fetch_clans(SUT_NOW, {sut.clan_ids()[0]: None})
+                variant_hashes = sut.synthetic_variant_hashes()
+                activity_type = fetcher.destiny2_activity_type(variant_hashes[LAST_WISH_HASH])
+                fetcher.close()
+                self.assertFalse(cache.filepath(
+                    fetcher.url(fake_bungie_server.ACTIVITY_DEFINITIONS_PATH)
+                ).exists())
+                self.assertTrue(cache.filepath(fetcher.url('/Destiny2/Manifest/')).exists())
+        finally:
+            sut.stop()
+        self.assertEqual(activity_type, ActivityID.Type.LAST_WISH)
+        self.assertEqual(len(bundles_by_clan[sut.clan_ids()[0]].stats_by_player), 5)
+        self.assertEqual(sut.stats()['not_found'], 0)
+
+    def test_search_player(self):
+        """Verifies synthetic members can be searched by display name."""
+        sut = fake_bungie_server.FakeBungieServer(
+            fake_bungie_server.FakeBungieOptions(clans=1, roster_size=5)
+        )
+        endpoint = sut.start()
+        try:
+            fetcher = Fetcher('key', FetcherOptions(
+                max_concurrent_requests=8, max_requests_per_second=1000, endpoint=endpoint
+            ))
+            player = fetcher.search_player(['Gardien3 junk', 'Gardien3'])
+            missing_player = fetcher.search_player(['Gardien5'])
+            fetcher.close()
+        finally:
+            sut.stop()
+        self.assertEqual(player, ('Gardien3', '3', '3', 'bungie:3'))
+        self.assertIsNone(missing_player)
+
+    def test_errors_and_throttles_are_retried(self):
+        """Verifies injected errors and throttles are retried by the fetcher."""
+        sut = fake_bungie_server.FakeBungieServer(fake_bungie_server.FakeBungieOptions(
+            clans=1, roster_size=4, characters_per_player=1,
+            error_rate=0.1, throttle_rate=0.1, throttle_status=429, seed=3
+        ))
+        (bundles_by_clan, request_stats) = self.sync(sut)
+        self.assertEqual(len(bundles_by_clan[sut.clan_ids()[0]].stats_by_player), 4)
+        stats = sut.stats()
+        self.assertGreater(stats['errors'] + stats['throttles'], 0)
+        self.assertEqual(request_stats['retries'], stats['errors'] + stats['throttles'])
+        self.assertEqual(request_stats['throttles'], stats['throttles'])
+
+    def test_fixtures(self):
+        """Verifies recorded responses are served before synthetic ones."""
+        fixtures = {
+            '/GroupV2/42/members/': {'Response': {'results': [{'destinyUserInfo': {
+                'displayName': 'Oby1Chick', 'membershipType': 3, 'membershipId': '2',
+            }}]}},
+            '/Destiny2/3/Profile/2/?components=Characters': {'Response': {'characters': {
+                'data': {'21': {'dateLastPlayed': '2020-08-01T20:00:00Z'}}
+            }}},
+            '/Destiny2/3/Account/2/Character/21/Stats/AggregateActivityStats/': {'Response': {
+                'activities': [{
+                    'activityHash': LAST_WISH_HASH,
+                    'values': {'activityCompletions': {'basic': {'value': 4.0}}},
+                }]
+            }},
+        }
+        sut = fake_bungie_server.FakeBungieServer(
+            fake_bungie_server.FakeBungieOptions(clans=0), fixtures
+        )
+        self.assertEqual(sut.clan_ids(), [42])
+        (bundles_by_clan, _) = self.sync(sut)
+        stats = bundles_by_clan[42].stats_by_player['Oby1Chick'].activity_stats
+        stat = next(stat for stat in stats if stat.activity_type == ActivityID.Type.LAST_WISH)
+        self.assertEqual(stat.completions, 4)
+        self.assertEqual(sut.respond('/Unknown/'), (404, None))
+
+    def test_invalid_configuration(self):
+        """Verifies invalid configurations are rejected."""
+        self.assertRaises(ValueError, fake_bungie_server.FakeBungieOptions, clans=-1)
+        self.assertRaises(ValueError, fake_bungie_server.FakeBungieOptions, error_rate=2)
+        self.assertRaises(
+            ValueError, fake_bungie_server.FakeBungieOptions, latency_distribution='normal'
+        )
+        self.assertRaises(ValueError, fake_bungie_server.FakeBungieOptions, clan_count=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
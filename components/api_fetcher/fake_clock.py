@@ -0,0 +1,8 @@
+class FakeClock:
+    """Manually advanced clock, for tests of the fetcher and its components."""
+
+    def __init__(self):
+        self.now = 1000
+
+    def __call__(self):
+        return self.now
@@ -0,0 +1,149 @@
+import asyncio
+import collections
+import math
+import time
+
+LATENCY_WINDOW_SIZE = 1000
+MIN_LATENCY_SAMPLES = 50
+HEDGE_PERCENTILE = 95
+MAX_HEDGE_RATIO = 0.05
+
+
+class LatencyWindow:
+    """Latencies of the most recent requests, for percentile estimates."""
+
+    def __init__(self, size=LATENCY_WINDOW_SIZE):
+        """:param size: The number of latencies kept. Older ones are forgotten."""
+        if size < 1:
+            raise ValueError("Taille de fenêtre de latences invalide")
+        self.__latencies = collections.deque(maxlen=size)
+
+    def __len__(self):
+        return len(self.__latencies)
+
+    def record(self, seconds):
+        """:param seconds: The latency of a request."""
+        self.__latencies.append(seconds)
+
+    def percentile(self, percentile):
+        """
+        :param percentile: The percentile, between 0 and 100.
+        :return: The nearest-rank percentile of the recorded latencies in seconds. None if empty.
+        """
+        if not self.__latencies:
+            return None
+        latencies = sorted(self.__latencies)
+        rank = max(1, math.ceil(percentile / 100 * len(latencies)))
+        return latencies[rank - 1]
+
+
+class RequestHedger:
+    """
+    Cuts the tail latency of requests: when a request has not been answered after a percentile of
+    the recently observed latencies, a single duplicate is sent and the first answer wins.
+    The duplicates are capped to a fraction of the requests.
+    """
+
+    def __init__(
+            self, percentile=HEDGE_PERCENTILE, max_hedge_ratio=MAX_HEDGE_RATIO,
+            min_samples=MIN_LATENCY_SAMPLES, window_size=LATENCY_WINDOW_SIZE,
+            clock=time.monotonic):
+        """
+        :param percentile: Requests slower than that percentile of the recent latencies are
+        hedged. Between 0 and 100, exclusive.
+        :param max_hedge_ratio: The maximum number of duplicates, as a fraction of the requests.
+        :param min_samples: No request is hedged before that many latencies have been observed.
+        :param window_size: The number of recent latencies the percentile is computed on.
+        :param clock: Returns the current time in seconds.
+        """
+        if not 0 < percentile < 100:
+            raise ValueError("Percentile de duplication invalide")
+        if not 0 <= max_hedge_ratio <= 1:
+            raise ValueError("Taux de duplication invalide")
+        if min_samples < 1:
+            raise ValueError("Nombre minimum de mesures invalide")
+        self.__percentile = percentile
+        self.__max_hedge_ratio = max_hedge_ratio
+        self.__min_samples = min_samples
+        self.__clock = clock
+        self.__attempt_latencies = LatencyWindow(window_size)
+        self.__request_latencies = LatencyWindow(window_size)
+        self.__stats = {'requests': 0, 'hedges': 0, 'hedge_wins': 0, 'over_budget': 0}
+
+    def delay(self):
+        """
+        :return: How long to wait for an answer before sending a duplicate, in seconds. None until
+        enough latencies have been observed.
+        """
+        if len(self.__attempt_latencies) < self.__min_samples:
+            return None
+        return self.__attempt_latencies.percentile(self.__percentile)
+
+    def can_hedge(self):
+        """:return: Whether one more duplicate stays within the budget."""
+        return self.__stats['hedges'] + 1 <= self.__max_hedge_ratio * self.__stats['requests']
+
+    def stats(self):
+        """
+        :return: A dict with the number of requests (requests), of duplicates sent (hedges), of
+        those that answered first (hedge_wins) and of the ones the budget prevented (over_budget).
+        Also reports the 99th percentile of the latency of single attempts (p99_attempt_seconds),
+        i.e. without hedging, and of requests with hedging (p99_request_seconds).
+        """
+        stats = dict(self.__stats)
+        stats['p99_attempt_seconds'] = self.__attempt_latencies.percentile(99)
+        stats['p99_request_seconds'] = self.__request_latencies.percentile(99)
+        return stats
+
+    async def run(self, attempt, duplicate=None):
+        """
+        Runs |attempt|, and a duplicate of it if the first one is slow.
+        When an attempt fails while the other one is still running, the other one is awaited.
+        :param attempt: Returns a new coroutine that makes the request.
+        :param duplicate: Optional. Returns a new coroutine that makes the duplicate request.
+        Defaults to |attempt|.
+        :return: The result of the first successful attempt.
+        :raises: The error of the last attempt if they all fail.
+        """
+        self.__stats['requests'] += 1
+        start = self.__clock()
+        attempts = [asyncio.ensure_future(self.timed(attempt))]
+        try:
+            delay = self.delay()
+            if delay is not None:
+                (done, _) = await asyncio.wait(attempts, timeout=delay)
+                if not done and self.can_hedge():
+                    self.__stats['hedges'] += 1
+                    attempts.append(asyncio.ensure_future(self.timed(duplicate or attempt)))
+                elif not done:
+                    self.__stats['over_budget'] += 1
+            pending = attempts
+            while True:
+                (done, pending) = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                successful = [task for task in done if task.exception() is None]
+                if successful or not pending:
+                    break
+            if not successful:
+                return done.pop().result()
+            winner = successful[0]
+            if winner is not attempts[0]:
+                self.__stats['hedge_wins'] += 1
+            self.__request_latencies.record(self.__clock() - start)
+            return winner.result()
+        finally:
+            for task in attempts:
+                task.cancel()
+
+    async def timed(self, attempt):
+        """
+        Runs |attempt| and records its latency. Cancelled attempts record the time they ran for, so
+        that the slowest attempts still weigh on the percentiles.
+        :return: The result of the attempt.
+        """
+        start = self.__clock()
+        try:
+            return await attempt()
+        finally:
+            self.__attempt_latencies.record(self.__clock() - start)
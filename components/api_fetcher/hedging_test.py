@@ -0,0 +1,108 @@
+import asyncio
+import unittest
+from components.api_fetcher import hedging
+
+
+class LatencyWindowTest(unittest.TestCase):
+    """Test class for the window of recent latencies."""
+
+    def test_percentile(self):
+        """Verifies nearest-rank percentiles over the most recent latencies only."""
+        sut = hedging.LatencyWindow(size=10)
+        self.assertIsNone(sut.percentile(50))
+        for latency in [100] + list(range(1, 11)):
+            sut.record(latency)
+        self.assertEqual(len(sut), 10)
+        self.assertEqual(sut.percentile(50), 5)
+        self.assertEqual(sut.percentile(95), 10)
+        self.assertEqual(sut.percentile(0), 1)
+        self.assertRaises(ValueError, hedging.LatencyWindow, 0)
+
+
+class RequestHedgerTest(unittest.TestCase):
+    """Test class for the request hedger."""
+
+    def warm_up(self, sut, latency, count):
+        """Runs |count| attempts that answer after |latency| seconds."""
+        async def attempt():
+            await asyncio.sleep(latency)
+            return 'warm'
+
+        async def run_all():
+            for _ in range(count):
+                await sut.run(attempt)
+
+        asyncio.run(run_all())
+
+    def test_slow_requests_are_hedged(self):
+        """Verifies a duplicate is sent for slow requests and the first answer wins."""
+        sut = hedging.RequestHedger(percentile=50, max_hedge_ratio=1, min_samples=5)
+        self.assertIsNone(sut.delay())
+        self.warm_up(sut, 0.01, 5)
+        self.assertIsNotNone(sut.delay())
+        calls = []
+
+        async def attempt():
+            calls.append(len(calls))
+            if len(calls) == 1:
+                await asyncio.sleep(10)
+                return 'slow'
+            return 'fast'
+
+        result = asyncio.run(sut.run(attempt))
+        self.assertEqual(result, 'fast')
+        self.assertEqual(len(calls), 2)
+        stats = sut.stats()
+        self.assertEqual(stats['requests'], 6)
+        self.assertEqual(stats['hedges'], 1)
+        self.assertEqual(stats['hedge_wins'], 1)
+        self.assertLess(stats['p99_request_seconds'], 1)
+        self.assertIsNotNone(stats['p99_attempt_seconds'])
+
+    def test_hedges_are_capped(self):
+        """Verifies no duplicate is sent beyond the budget."""
+        sut = hedging.RequestHedger(percentile=50, max_hedge_ratio=0, min_samples=1)
+        self.warm_up(sut, 0, 1)
+        calls = []
+
+        async def attempt():
+            calls.append(len(calls))
+            await asyncio.sleep(0.05)
+            return 'only'
+
+        self.assertEqual(asyncio.run(sut.run(attempt)), 'only')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sut.stats()['hedges'], 0)
+        self.assertEqual(sut.stats()['over_budget'], 1)
+
+    def test_failed_attempts(self):
+        """Verifies a failed attempt falls back to the other one, and errors when both fail."""
+        sut = hedging.RequestHedger(percentile=50, max_hedge_ratio=1, min_samples=1)
+        self.warm_up(sut, 0, 1)
+        calls = []
+
+        async def attempt():
+            calls.append(len(calls))
+            if len(calls) == 1:
+                await asyncio.sleep(0.05)
+                raise asyncio.TimeoutError()
+            await asyncio.sleep(0.1)
+            return 'hedge'
+
+        self.assertEqual(asyncio.run(sut.run(attempt)), 'hedge')
+
+        async def failing_attempt():
+            await asyncio.sleep(0.01)
+            raise asyncio.TimeoutError()
+
+        self.assertRaises(asyncio.TimeoutError, asyncio.run, sut.run(failing_attempt))
+
+    def test_invalid_arguments(self):
+        """Verifies invalid percentiles, budgets and sample counts are rejected."""
+        self.assertRaises(ValueError, hedging.RequestHedger, percentile=100)
+        self.assertRaises(ValueError, hedging.RequestHedger, max_hedge_ratio=2)
+        self.assertRaises(ValueError, hedging.RequestHedger, min_samples=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
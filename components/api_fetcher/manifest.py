@@ -0,0 +1,98 @@
+import asyncio
+import time
+import aiohttp
+from components.api_fetcher.activity_hashes import DESTINY_2_ACTIVITIES_BY_HASH
+from components.api_fetcher.activity_index import activity_types_from_manifest
+from components.api_fetcher.activity_index import ActivityIndex
+
+# The version of the Destiny manifest is checked at most once per that many seconds.
+MANIFEST_CHECK_INTERVAL_SECONDS = 24 * 3600
+MANIFEST_LOCALE = 'en'
+MANIFEST_PATH = '/Destiny2/Manifest/'
+
+
+class ActivityTypes:
+    """
+    Types of the Destiny 2 activities, by hash. Backed by an ActivityIndex built from the Destiny
+    manifest when one is configured, and by DESTINY_2_ACTIVITIES_BY_HASH otherwise.
+    """
+
+    def __init__(self, index_path=None, clock=time.monotonic):
+        """
+        :param index_path: Optional file of the ActivityIndex. Memory-mapped if it exists, and
+        rebuilt by |refresh|.
+        :param clock: Returns the current time in seconds.
+        """
+        self.__index_path = index_path
+        self.__clock = clock
+        self.__index = None
+        self.__checked_at = None
+        if index_path is not None:
+            try:
+                self.__index = ActivityIndex(index_path)
+            except IOError:
+                pass
+
+    def get(self, activity_hash):
+        """
+        :param activity_hash: The hash of a Destiny 2 activity.
+        :return: The ActivityID.Type of the activity, or None if it is not tracked.
+        """
+        if self.__index is None:
+            return DESTINY_2_ACTIVITIES_BY_HASH.get(activity_hash)
+        return self.__index.get(activity_hash)
+
+    def version(self):
+        """:return: The version of the manifest of the activity index, empty without index."""
+        if self.__index is None:
+            return ''
+        return self.__index.version()
+
+    async def refresh(self, request):
+        """
+        Rebuilds the activity index when the version of the Destiny manifest changed. The version
+        is checked at most once per MANIFEST_CHECK_INTERVAL_SECONDS. The activity definitions are
+        only downloaded for a new version, and indexed in the default executor of the loop. On
+        failure, the current index is kept. When cancelled, e.g. by the deadline of a sync, the
+        current index is kept as well and the next call checks the version again.
+        :param request: The coroutine function that requests a Bungie path, e.g. Fetcher.request.
+        """
+        if self.__index_path is None:
+            return
+        now = self.__clock()
+        if self.__checked_at is not None and \
+                now - self.__checked_at < MANIFEST_CHECK_INTERVAL_SECONDS:
+            return
+        self.__checked_at = now
+        try:
+            manifest = (await request(MANIFEST_PATH))['Response']
+            version = manifest['version']
+            if self.__index is not None and self.__index.version() == version:
+                return
+            definitions = await request(
+                manifest['jsonWorldComponentContentPaths'][MANIFEST_LOCALE]
+                ['DestinyActivityDefinition']
+            )
+            index = await asyncio.get_running_loop().run_in_executor(
+                None, self.build_index, version, definitions
+            )
+        except asyncio.CancelledError:
+            self.__checked_at = None
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError, IOError, KeyError, TypeError):
+            return
+        if self.__index is not None:
+            self.__index.close()
+        self.__index = index
+
+    def build_index(self, version, definitions):
+        """
+        Writes the activity index of a version of the manifest.
+        :param version: The version of the manifest.
+        :param definitions: The DestinyActivityDefinition table of the manifest.
+        :return: The new ActivityIndex.
+        :raises: IOError if the index cannot be written.
+        """
+        types_by_hash = activity_types_from_manifest(definitions, DESTINY_2_ACTIVITIES_BY_HASH)
+        ActivityIndex.write(self.__index_path, version, types_by_hash)
+        return ActivityIndex(self.__index_path)
@@ -0,0 +1,86 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from components.api_fetcher import manifest
+from components.api_fetcher.fake_clock import FakeClock
+from protos.activity_id_pb2 import ActivityID
+
+LAST_WISH_HASH = 2122313384
+VARIANT_HASH = 1234
+CONTENT_PATH = '/common/destiny2_content/json/en/DestinyActivityDefinition-1.json'
+
+
+class FakeManifest:
+    """In-memory stand-in for the manifest endpoints, meant to be given to ActivityTypes.refresh."""
+
+    def __init__(self):
+        self.requested_paths = []
+        self.responses = {
+            manifest.MANIFEST_PATH: {'Response': {
+                'version': '1',
+                'jsonWorldComponentContentPaths': {
+                    'en': {'DestinyActivityDefinition': CONTENT_PATH}
+                },
+            }},
+            CONTENT_PATH: {
+                str(LAST_WISH_HASH): {'displayProperties': {'name': 'Last Wish'}},
+                str(VARIANT_HASH): {'displayProperties': {'name': 'Last Wish'}},
+                '99': {'displayProperties': {'name': 'Patrouille'}},
+            },
+        }
+
+    async def request(self, path):
+        """Serves |path| from the registered responses."""
+        self.requested_paths.append(path)
+        await asyncio.sleep(0)
+        return self.responses[path]
+
+
+class ActivityTypesTest(unittest.TestCase):
+    """Test class for the activity types indexed from the Destiny manifest."""
+
+    def test_without_index(self):
+        """Verifies only the hand-maintained activities are known without an index."""
+        sut = manifest.ActivityTypes()
+        asyncio.run(sut.refresh(FakeManifest().request))
+        self.assertEqual(sut.get(LAST_WISH_HASH), ActivityID.Type.LAST_WISH)
+        self.assertIsNone(sut.get(VARIANT_HASH))
+        self.assertEqual(sut.version(), '')
+
+    def test_refresh(self):
+        """Verifies variants found in the manifest are indexed, once per version."""
+        fake = FakeManifest()
+        clock = FakeClock()
+        with tempfile.TemporaryDirectory() as directory:
+            index_path = os.path.join(directory, 'activity_index.dat')
+            sut = manifest.ActivityTypes(index_path, clock)
+            asyncio.run(sut.refresh(fake.request))
+            self.assertEqual(sut.get(VARIANT_HASH), ActivityID.Type.LAST_WISH)
+            self.assertEqual(sut.version(), '1')
+            self.assertIn(CONTENT_PATH, fake.requested_paths)
+
+            fake.requested_paths.clear()
+            asyncio.run(sut.refresh(fake.request))
+            self.assertEqual(fake.requested_paths, [])
+            clock.now += manifest.MANIFEST_CHECK_INTERVAL_SECONDS
+            asyncio.run(sut.refresh(fake.request))
+            self.assertEqual(fake.requested_paths, [manifest.MANIFEST_PATH])
+
+            restarted_sut = manifest.ActivityTypes(index_path)
+            self.assertEqual(restarted_sut.get(VARIANT_HASH), ActivityID.Type.LAST_WISH)
+            self.assertIsNone(restarted_sut.get(99))
+
+    def test_failed_refresh(self):
+        """Verifies the current index is kept when the manifest cannot be read."""
+        fake = FakeManifest()
+        del fake.responses[CONTENT_PATH]
+        with tempfile.TemporaryDirectory() as directory:
+            sut = manifest.ActivityTypes(os.path.join(directory, 'activity_index.dat'))
+            asyncio.run(sut.refresh(fake.request))
+            self.assertEqual(sut.get(LAST_WISH_HASH), ActivityID.Type.LAST_WISH)
+            self.assertIsNone(sut.get(VARIANT_HASH))
+
+
+if __name__ == '__main__':
+    unittest.main()
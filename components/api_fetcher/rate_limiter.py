@@ -0,0 +1,130 @@
+import asyncio
+import collections
+import time
+
+DECREASE_FACTOR = 0.5
+DECREASE_COOLDOWN_SECONDS = 1.0
+
+
+class TokenBucket:
+    """Request rate limiter shared by every request of a fetcher. Event loop agnostic."""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        """
+        :param rate: Number of tokens refilled per second.
+        :param capacity: Maximum number of tokens, i.e the allowed burst.
+        :param clock: Returns the current time in seconds.
+        """
+        if rate <= 0 or capacity < 1:
+            raise ValueError("Limite de requêtes invalide")
+        self.__rate = rate
+        self.__capacity = capacity
+        self.__clock = clock
+        self.__tokens = capacity
+        self.__last_refill = clock()
+        self.__paused_until = 0
+
+    async def acquire(self):
+        """Waits until a token is available, then takes it."""
+        while True:
+            now = self.__clock()
+            if now < self.__paused_until:
+                await asyncio.sleep(self.__paused_until - now)
+                continue
+            self.__tokens = min(
+                self.__capacity,
+                self.__tokens + (now - self.__last_refill) * self.__rate
+            )
+            self.__last_refill = now
+            if self.__tokens >= 1:
+                self.__tokens -= 1
+                return
+            await asyncio.sleep((1 - self.__tokens) / self.__rate)
+
+    def pause(self, seconds):
+        """
+        Hands out no token for the given duration. The bucket is empty when the pause ends.
+        :param seconds: The duration of the pause.
+        """
+        now = self.__clock()
+        self.__paused_until = max(self.__paused_until, now + seconds)
+        self.__tokens = 0
+        self.__last_refill = self.__paused_until
+
+
+class ConcurrencyController:
+    """
+    Limits the number of requests in flight with an AIMD policy:
+    The limit grows by one per window of healthy responses and is multiplied by DECREASE_FACTOR on
+    throttling, down to a single request.
+    To be used as an async context manager around each request.
+    """
+
+    def __init__(self, initial, maximum, cooldown=DECREASE_COOLDOWN_SECONDS, clock=time.monotonic):
+        """
+        :param initial: The initial limit.
+        :param maximum: The limit never goes above that. Inclusive.
+        :param cooldown: Throttles reported within that many seconds after a decrease are
+        attributed to requests that were sent before it, and do not decrease the limit again.
+        :param clock: Returns the current time in seconds.
+        """
+        if not 1 <= initial <= maximum:
+            raise ValueError("Limite de requêtes simultanées invalide")
+        self.__limit = float(initial)
+        self.__maximum = maximum
+        self.__cooldown = cooldown
+        self.__clock = clock
+        self.__in_flight = 0
+        self.__last_decrease = None
+        self.__waiters = collections.deque()
+
+    @property
+    def limit(self):
+        """The current number of requests allowed in flight."""
+        return int(self.__limit)
+
+    @property
+    def in_flight(self):
+        """The current number of requests in flight."""
+        return self.__in_flight
+
+    def increase(self):
+        """Additive increase. Called on every healthy response."""
+        self.__limit = min(self.__maximum, self.__limit + 1 / self.__limit)
+        self.wake_up_waiters()
+
+    def decrease(self):
+        """Multiplicative decrease. Called on every throttled response."""
+        now = self.__clock()
+        if self.__last_decrease is not None and now - self.__last_decrease < self.__cooldown:
+            return
+        self.__last_decrease = now
+        self.__limit = max(1, self.__limit * DECREASE_FACTOR)
+
+    async def __aenter__(self):
+        while self.__in_flight >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self.__waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter in self.__waiters:
+                    self.__waiters.remove(waiter)
+                else:
+                    self.wake_up_waiters()
+                raise
+        self.__in_flight += 1
+        return self
+
+    async def __aexit__(self, *_):
+        self.__in_flight -= 1
+        self.wake_up_waiters()
+
+    def wake_up_waiters(self):
+        """Wakes up as many waiters as there are free slots."""
+        free_slots = self.limit - self.__in_flight
+        while free_slots > 0 and self.__waiters:
+            waiter = self.__waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free_slots -= 1
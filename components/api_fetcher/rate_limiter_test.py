@@ -0,0 +1,93 @@
+import asyncio
+import time
+import unittest
+from components.api_fetcher import rate_limiter
+from components.api_fetcher.fake_clock import FakeClock
+
+
+class TokenBucketTest(unittest.TestCase):
+    """Test class for the token bucket rate limiter."""
+
+    def test_invalid_arguments(self):
+        """Verifies invalid rates and capacities are rejected."""
+        self.assertRaises(ValueError, rate_limiter.TokenBucket, 0, 1)
+        self.assertRaises(ValueError, rate_limiter.TokenBucket, 1, 0)
+
+    def test_rate(self):
+        """Verifies tokens beyond the burst are handed out at the configured rate."""
+        sut = rate_limiter.TokenBucket(50, 5)
+
+        async def acquire_all():
+            for _ in range(15):
+                await sut.acquire()
+
+        start = time.monotonic()
+        asyncio.run(acquire_all())
+        self.assertGreaterEqual(time.monotonic() - start, 0.18)
+
+    def test_pause(self):
+        """Verifies no token is handed out during a pause."""
+        sut = rate_limiter.TokenBucket(1000, 1000)
+        sut.pause(0.2)
+        start = time.monotonic()
+        asyncio.run(sut.acquire())
+        self.assertGreaterEqual(time.monotonic() - start, 0.18)
+
+
+class ConcurrencyControllerTest(unittest.TestCase):
+    """Test class for the AIMD concurrency controller."""
+
+    def setUp(self):
+        """Sets up a basic sut."""
+        self.clock = FakeClock()
+        self.sut = rate_limiter.ConcurrencyController(4, 8, clock=self.clock)
+
+    def test_invalid_arguments(self):
+        """Verifies inconsistent bounds are rejected."""
+        self.assertRaises(ValueError, rate_limiter.ConcurrencyController, 0, 8)
+        self.assertRaises(ValueError, rate_limiter.ConcurrencyController, 9, 8)
+
+    def test_additive_increase(self):
+        """Verifies the limit grows by one per window of healthy responses, up to the maximum."""
+        for _ in range(4):
+            self.sut.increase()
+        self.assertEqual(self.sut.limit, 4)
+        self.sut.increase()
+        self.assertEqual(self.sut.limit, 5)
+        for _ in range(100):
+            self.sut.increase()
+        self.assertEqual(self.sut.limit, 8)
+
+    def test_multiplicative_decrease(self):
+        """Verifies the limit halves on throttling, once per cooldown, down to one."""
+        self.sut.decrease()
+        self.assertEqual(self.sut.limit, 2)
+        self.sut.decrease()
+        self.assertEqual(self.sut.limit, 2)
+        self.clock.now += rate_limiter.DECREASE_COOLDOWN_SECONDS
+        self.sut.decrease()
+        self.assertEqual(self.sut.limit, 1)
+        self.clock.now += rate_limiter.DECREASE_COOLDOWN_SECONDS
+        self.sut.decrease()
+        self.assertEqual(self.sut.limit, 1)
+
+    def test_in_flight_limit(self):
+        """Verifies no more than |limit| tasks run inside the controller at once."""
+        peak = 0
+
+        async def task():
+            nonlocal peak
+            async with self.sut:
+                peak = max(peak, self.sut.in_flight)
+                await asyncio.sleep(0.01)
+
+        async def run_all():
+            await asyncio.gather(*[task() for _ in range(20)])
+
+        asyncio.run(run_all())
+        self.assertEqual(peak, 4)
+        self.assertEqual(self.sut.in_flight, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
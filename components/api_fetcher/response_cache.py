@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+import re
+import tempfile
+import time
+
+# Time to live in seconds of cached responses, by regex on the request URL. First match wins.
+# Within their TTL, responses are served from disk. Past it, they are revalidated with Bungie.
+# Only clan member lists and accounts live: player data is always revalidated, so that syncs see
+# new activities. The memberships of an account rarely change, see Fetcher.fetch_primary_membership.
+DEFAULT_TTLS_BY_PATTERN = [
+    (r'/GroupV2/[0-9]+/members/', 3600),
+    (r'/User/GetMembershipsById/', 7 * 24 * 3600),
+]
+
+
+class CachedResponse:
+    """A response read from the cache."""
+
+    def __init__(self, content, etag, last_modified, fresh):
+        self.content = content
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fresh = fresh
+
+    def validators(self):
+        """:return: The HTTP headers that make a request for this response conditional."""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+    """
+    On-disk cache of Bungie responses, keyed by request URL, so that endpoints do not share
+    responses.
+    Safe to use from several threads: each write goes through its own temporary file.
+    """
+
+    def __init__(self, directory, ttls_by_pattern=None, clock=time.time):
+        """
+        :param directory: Where to store the responses. Created if needed.
+        :param ttls_by_pattern: A list of (URL regex, TTL in seconds) tuples. First match wins.
+        URLs with no match are always revalidated.
+        :param clock: Returns the current time in seconds.
+        """
+        try:
+            self.__directory = Path(directory)
+            self.__directory.mkdir(parents=True, exist_ok=True)
+        except:
+            raise IOError("Impossible d'initialiser le cache HTTP.")
+        if ttls_by_pattern is None:
+            ttls_by_pattern = DEFAULT_TTLS_BY_PATTERN
+        self.__ttls_by_pattern = [(re.compile(p), ttl) for p, ttl in ttls_by_pattern]
+        self.__clock = clock
+        self.__stats = {'hits': 0, 'misses': 0, 'revalidations': 0, 'not_modified': 0}
+
+    def get(self, url):
+        """
+        :param url: The request URL.
+        :return: The cached response for the URL, or None if there is none.
+        """
+        try:
+            entry = json.loads(self.filepath(url).read_bytes())
+        except (OSError, ValueError):
+            self.__stats['misses'] += 1
+            return None
+        fresh = self.__clock() - entry['stored_at'] < self.ttl(url)
+        self.__stats['hits' if fresh else 'revalidations'] += 1
+        return CachedResponse(entry['content'], entry['etag'], entry['last_modified'], fresh)
+
+    def put(self, url, content, etag, last_modified):
+        """
+        Stores a response. Replaces the previous one, if any.
+        :param url: The request URL.
+        :param content: The response, decoded from JSON.
+        :param etag: The ETag header of the response or None.
+        :param last_modified: The Last-Modified header of the response or None.
+        """
+        entry = {
+            'stored_at': self.__clock(),
+            'etag': etag,
+            'last_modified': last_modified,
+            'content': content,
+        }
+        filepath = self.filepath(url)
+        temporary_filepath = None
+        try:
+            with tempfile.NamedTemporaryFile(
+                    'w', encoding='utf-8', dir=self.__directory, suffix='.tmp',
+                    delete=False) as temporary_file:
+                temporary_filepath = temporary_file.name
+                temporary_file.write(json.dumps(entry))
+            os.replace(temporary_filepath, filepath)
+        except OSError:
+            if temporary_filepath is not None:
+                try:
+                    os.remove(temporary_filepath)
+                except OSError:
+                    pass
+            raise IOError("Impossible d'écrire dans le cache HTTP.")
+
+    def not_modified(self, url, cached_response):
+        """
+        Restarts the TTL of a cached response that Bungie reported as not modified.
+        :param url: The request URL.
+        :param cached_response: The response previously returned by |get|.
+        """
+        self.__stats['not_modified'] += 1
+        self.put(url, cached_response.content, cached_response.etag, cached_response.last_modified)
+
+    def stats(self):
+        """
+        :return: A dict with the number of lookups served from disk (hits), not found on disk
+        (misses), found expired and revalidated with Bungie (revalidations), and of those, the ones
+        that Bungie reported as unchanged (not_modified).
+        """
+        return dict(self.__stats)
+
+    def ttl(self, url):
+        """:return: The time to live in seconds of the responses for the given URL."""
+        for pattern, ttl in self.__ttls_by_pattern:
+            if pattern.search(url):
+                return ttl
+        return 0
+
+    def filepath(self, url):
+        """:return: Where the response for the given URL is stored."""
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return self.__directory.joinpath(key + '.json')
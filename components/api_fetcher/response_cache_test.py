@@ -0,0 +1,89 @@
+import os
+import tempfile
+import threading
+import unittest
+from components.api_fetcher import response_cache
+from components.api_fetcher.fake_clock import FakeClock
+
+MEMBERS_PATH = '/GroupV2/696852/members/'
+STATS_PATH = '/Destiny2/3/Account/1/Character/11/Stats/AggregateActivityStats/'
+PROFILE_PATH = '/Destiny2/3/Profile/1/?components=100,200'
+
+
+class ResponseCacheTest(unittest.TestCase):
+    """Test class for the on-disk HTTP response cache."""
+
+    def setUp(self):
+        """Sets up a basic sut."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.clock = FakeClock()
+        self.sut = response_cache.ResponseCache(self.directory.name, clock=self.clock)
+
+    def tearDown(self):
+        """Performs some cleanups at the end of each test."""
+        self.directory.cleanup()
+
+    def test_miss(self):
+        """Verifies unknown paths are misses."""
+        self.assertIsNone(self.sut.get(MEMBERS_PATH))
+        self.assertEqual(self.sut.stats()['misses'], 1)
+
+    def test_put_then_get(self):
+        """Verifies responses are served until their endpoint's TTL expires, then revalidated."""
+        content = {'Response': {'results': []}}
+        self.sut.put(MEMBERS_PATH, content, '"abc"', 'Wed, 12 Aug 2020 16:15:00 GMT')
+        cached = self.sut.get(MEMBERS_PATH)
+        self.assertTrue(cached.fresh)
+        self.assertEqual(cached.content, content)
+        self.clock.now += self.sut.ttl(MEMBERS_PATH)
+        cached = self.sut.get(MEMBERS_PATH)
+        self.assertFalse(cached.fresh)
+        self.assertEqual(cached.validators(), {
+            'If-None-Match': '"abc"',
+            'If-Modified-Since': 'Wed, 12 Aug 2020 16:15:00 GMT',
+        })
+        self.sut.not_modified(MEMBERS_PATH, cached)
+        self.assertTrue(self.sut.get(MEMBERS_PATH).fresh)
+        self.assertEqual(self.sut.stats(), {
+            'hits': 2, 'misses': 0, 'revalidations': 1, 'not_modified': 1
+        })
+
+    def test_ttls_by_endpoint(self):
+        """Verifies clan member lists and accounts live, but not player data nor unknown paths."""
+        self.assertGreater(self.sut.ttl('https://www.bungie.net/Platform' + MEMBERS_PATH), 0)
+        self.assertGreater(self.sut.ttl('/User/GetMembershipsById/12/2/'), 0)
+        self.assertEqual(self.sut.ttl(STATS_PATH), 0)
+        self.assertEqual(self.sut.ttl(PROFILE_PATH), 0)
+        self.assertEqual(self.sut.ttl('/Destiny2/Manifest/'), 0)
+
+    def test_persistence(self):
+        """Verifies responses survive a restart."""
+        self.sut.put(STATS_PATH, {'Response': {}}, None, None)
+        sut = response_cache.ResponseCache(self.directory.name, clock=self.clock)
+        cached = sut.get(STATS_PATH)
+        self.assertEqual(cached.content, {'Response': {}})
+        self.assertEqual(cached.validators(), {})
+
+    def test_concurrent_writers(self):
+        """Verifies concurrent writes of the same path do not fail nor leave temporary files."""
+        errors = []
+
+        def write(writer):
+            for i in range(50):
+                try:
+                    self.sut.put(STATS_PATH, {'Response': {'writer': writer, 'i': i}}, None, None)
+                except IOError as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=write, args=(writer,)) for writer in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(self.sut.get(STATS_PATH).content['Response']['i'], 49)
+        self.assertEqual(os.listdir(self.directory.name), [self.sut.filepath(STATS_PATH).name])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import asyncio
+import aiohttp
+
+KEEPALIVE_TIMEOUT_SECONDS = 120
+
+
+class SessionPool:
+    """
+    Persistent aiohttp sessions of a fetcher, so that keep-alive connections survive from one sync
+    to the next. Each event loop gets its own session, since sessions cannot be shared across
+    loops. Also owns the private event loop of the blocking calls of the fetcher.
+    """
+
+    def __init__(self, headers, max_connections):
+        """
+        :param headers: The headers of every request, e.g the Bungie API key.
+        :param max_connections: The size of the connection pool of each session.
+        """
+        self.__headers = headers
+        self.__max_connections = max_connections
+        self.__sessions_by_loop = {}
+        self.__blocking_loop = None
+        self.__stats = {'hits': 0, 'new_connections': 0, 'waits': 0}
+
+    def session(self):
+        """:return: The session of the running event loop. Created on first use."""
+        loop = asyncio.get_running_loop()
+        session = self.__sessions_by_loop.get(loop)
+        if session is None:
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_connection_reuseconn.append(self.on_connection_reused)
+            trace_config.on_connection_create_end.append(self.on_connection_created)
+            trace_config.on_connection_queued_start.append(self.on_connection_queued)
+            connector = aiohttp.TCPConnector(
+                limit=self.__max_connections,
+                keepalive_timeout=KEEPALIVE_TIMEOUT_SECONDS,
+            )
+            session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self.__headers,
+                trace_configs=[trace_config],
+            )
+            self.__sessions_by_loop[loop] = session
+        return session
+
+    def run_blocking(self, coroutine):
+        """
+        Runs |coroutine| on the private event loop of the blocking calls. The loop is kept across
+        calls so that its session is reused. Must not be called from a running event loop.
+        :return: The result of the coroutine.
+        """
+        if self.__blocking_loop is None:
+            self.__blocking_loop = asyncio.new_event_loop()
+        return self.__blocking_loop.run_until_complete(coroutine)
+
+    def stats(self):
+        """
+        :return: A dict with the number of requests that reused a pooled connection (hits),
+        had to open a new one (new_connections) or had to wait for a free one (waits).
+        """
+        return dict(self.__stats)
+
+    async def on_connection_reused(self, *_):
+        """aiohttp trace hook."""
+        self.__stats['hits'] += 1
+
+    async def on_connection_created(self, *_):
+        """aiohttp trace hook."""
+        self.__stats['new_connections'] += 1
+
+    async def on_connection_queued(self, *_):
+        """aiohttp trace hook."""
+        self.__stats['waits'] += 1
+
+    async def close_async(self):
+        """
+        Closes the session of the running event loop and releases its sockets.
+        Must be awaited on every event loop the pool was used on, except the private one of the
+        blocking calls that |close| takes care of.
+        """
+        session = self.__sessions_by_loop.pop(asyncio.get_running_loop(), None)
+        if session is not None:
+            await session.close()
+
+    def close(self):
+        """Closes the session of the private event loop of the blocking calls, then the loop."""
+        if self.__blocking_loop is None:
+            return
+        self.__blocking_loop.run_until_complete(self.close_async())
+        self.__blocking_loop.close()
+        self.__blocking_loop = None
@@ -0,0 +1,66 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Coalesces the syncs of the same clans: while a sync is in flight, new calls join it, and within
+    the freshness window of the previous complete sync, they get its result right away.
+    """
+
+    def __init__(self, freshness_seconds, clock):
+        """
+        :param freshness_seconds: How long the result of a complete sync stays fresh. 0 disables
+        the reuse of results.
+        :param clock: Returns the current time in seconds.
+        """
+        if freshness_seconds < 0:
+            raise ValueError("Durée de fraîcheur des synchros invalide")
+        self.__freshness_seconds = freshness_seconds
+        self.__clock = clock
+        self.__syncs_in_flight = {}
+        self.__last_syncs = {}
+
+    def __len__(self):
+        """:return: The number of syncs in flight."""
+        return len(self.__syncs_in_flight)
+
+    def fresh_result(self, key):
+        """
+        :param key: The clans of the sync.
+        :return: The SyncResult of the previous complete sync of the clans if it is still fresh,
+        or None.
+        """
+        last_sync = self.__last_syncs.get(key)
+        if last_sync is None or self.__clock() - last_sync[0] >= self.__freshness_seconds:
+            return None
+        return last_sync[1]
+
+    def sync_in_flight(self, key):
+        """
+        :param key: The clans of the sync.
+        :return: The task of the sync of the clans in flight on the running event loop, or None.
+        """
+        sync = self.__syncs_in_flight.get(key)
+        if sync is None or sync.get_loop() is not asyncio.get_running_loop():
+            return None
+        return sync
+
+    def start(self, key, sync):
+        """
+        Registers a sync in flight, until it ends.
+        :param key: The clans of the sync.
+        :param sync: The task of the sync.
+        """
+        sync.add_done_callback(lambda sync: self.on_sync_done(key, sync))
+        self.__syncs_in_flight[key] = sync
+
+    def on_sync_done(self, key, sync):
+        """
+        Called when a sync in flight ends. Complete results open the freshness window.
+        :param key: The clans of the sync.
+        :param sync: The task of the sync.
+        """
+        if self.__syncs_in_flight.get(key) is sync:
+            del self.__syncs_in_flight[key]
+        if not sync.cancelled() and sync.exception() is None and not sync.result().partial:
+            self.__last_syncs[key] = (self.__clock(), sync.result())
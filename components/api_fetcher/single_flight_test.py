@@ -0,0 +1,61 @@
+import asyncio
+import unittest
+from components.api_fetcher import single_flight
+from components.api_fetcher.fake_clock import FakeClock
+
+
+class FakeResult:
+    """Stand-in for a SyncResult."""
+
+    def __init__(self, partial):
+        self.partial = partial
+
+
+class SingleFlightTest(unittest.TestCase):
+    """Test class for the coalescing of syncs."""
+
+    def setUp(self):
+        """Sets up a basic sut."""
+        self.clock = FakeClock()
+        self.sut = single_flight.SingleFlight(60, self.clock)
+
+    def run_sync(self, key, result):
+        """Runs a sync of |key| that returns |result|, and checks it is in flight meanwhile."""
+        async def sync():
+            await asyncio.sleep(0)
+            return result
+
+        async def run():
+            task = asyncio.get_running_loop().create_task(sync())
+            self.sut.start(key, task)
+            self.assertIs(self.sut.sync_in_flight(key), task)
+            self.assertIsNone(self.sut.sync_in_flight((2,)))
+            self.assertEqual(len(self.sut), 1)
+            await task
+            await asyncio.sleep(0)
+
+        asyncio.run(run())
+        self.assertEqual(len(self.sut), 0)
+
+    def test_fresh_result(self):
+        """Verifies complete results are reused within the freshness window only."""
+        result = FakeResult(False)
+        self.run_sync((1,), result)
+        self.clock.now += 59
+        self.assertIs(self.sut.fresh_result((1,)), result)
+        self.assertIsNone(self.sut.fresh_result((2,)))
+        self.clock.now += 1
+        self.assertIsNone(self.sut.fresh_result((1,)))
+
+    def test_partial_result(self):
+        """Verifies partial results are not reused."""
+        self.run_sync((1,), FakeResult(True))
+        self.assertIsNone(self.sut.fresh_result((1,)))
+
+    def test_invalid_freshness(self):
+        """Verifies negative freshness windows are rejected."""
+        self.assertRaises(ValueError, single_flight.SingleFlight, -1, self.clock)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+Benchmark of full syncs against a local FakeBungieServer. No request reaches bungie.net.
+Reports the wall time, the request rate and the retries of each sync.
+Also reports the p99 latency of requests, and with --hedge-percentile, the duplicated requests.
+Without it, requests are measured by a hedger that never duplicates them, for comparison.
+Usage: sync_benchmark --clans 5 --roster-size 100 --latency-ms 50 --error-rate 0.01
+"""
+import argparse
+import asyncio
+from datetime import datetime
+import time
+from dateutil import tz
+from components.api_fetcher.api_fetcher import Fetcher
+from components.api_fetcher.api_fetcher import FetcherOptions
+from components.api_fetcher.api_fetcher import MAX_CONCURRENT_REQUESTS
+from components.api_fetcher.api_fetcher import MAX_REQUESTS_PER_SECOND
+from components.api_fetcher.fake_bungie_server import FakeBungieOptions
+from components.api_fetcher.fake_bungie_server import FakeBungieServer
+from components.api_fetcher.fake_bungie_server import LATENCY_DISTRIBUTIONS
+from components.api_fetcher.hedging import MAX_HEDGE_RATIO
+from components.api_fetcher.hedging import RequestHedger
+from protos.sync_state_pb2 import SyncState
+
+TIMEZONE = tz.gettz('Europe/Paris')
+
+
+def parse_arguments():
+    """:return: The parsed command line arguments."""
+    parser = argparse.ArgumentParser(description="Benchmark de synchronisation hors ligne.")
+    parser.add_argument('--clans', type=int, default=5)
+    parser.add_argument('--roster-size', type=int, default=100)
+    parser.add_argument('--characters', type=int, default=3)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--latency-distribution', choices=LATENCY_DISTRIBUTIONS,
+                        default='exponential')
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--throttle-rate', type=float, default=0)
+    parser.add_argument('--throttle-seconds', type=float, default=0)
+    parser.add_argument('--throttle-status', type=int, default=200)
+    parser.add_argument('--fixtures', help="Fichier JSON {chemin: réponse} de réponses réelles.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--destiny1-rate', type=float, default=0,
+                        help="Proportion des joueurs qui ont aussi des personnages Destiny 1.")
+    parser.add_argument('--syncs', type=int, default=2,
+                        help="Nombre de synchros successives. Les suivantes sont incrémentales.")
+    parser.add_argument('--max-concurrent-requests', type=int, default=MAX_CONCURRENT_REQUESTS)
+    parser.add_argument('--max-requests-per-second', type=float, default=MAX_REQUESTS_PER_SECOND)
+    parser.add_argument('--hedge-percentile', type=float,
+                        help="Duplique les requêtes plus lentes que ce percentile.")
+    parser.add_argument('--max-hedge-ratio', type=float, default=MAX_HEDGE_RATIO)
+    return parser.parse_args()
+
+
+async def run_syncs(fetcher, clan_ids, syncs):
+    """
+    Runs |syncs| successive syncs of |clan_ids| and prints a report line for each.
+    :param fetcher: The Fetcher, pointed at the fake server.
+    :param clan_ids: The clans to sync.
+    :param syncs: The number of syncs.
+    """
+    sync_states_by_clan = {clan_id: SyncState() for clan_id in clan_ids}
+    for sync in range(syncs):
+        stats_before = fetcher.request_stats()
+        start = time.perf_counter()
+        bundles_by_clan = await fetcher.fetch_clans_async(
+            datetime.now(TIMEZONE), sync_states_by_clan
+        )
+        wall_time = time.perf_counter() - start
+        stats_after = fetcher.request_stats()
+        requests = stats_after['requests'] - stats_before['requests']
+        players = sum(len(bundle.stats_by_player) for bundle in bundles_by_clan.values())
+        print(
+            f"Synchro {sync + 1}: {players} joueurs, {wall_time:.2f} s, "
+            f"{requests} requêtes ({requests / wall_time:.1f} req/s), "
+            f"{stats_after['retries'] - stats_before['retries']} réessais, "
+            f"{stats_after['throttles'] - stats_before['throttles']} limitations, "
+            f"concurrence {stats_after['concurrency']}"
+        )
+    print(f"Connexions: {fetcher.pool_stats()}")
+    print(f"Duplication: {fetcher.hedging_stats()}")
+    await fetcher.close_async()
+
+
+if __name__ == "__main__":
+    arguments = parse_arguments()
+    fixtures = None
+    if arguments.fixtures:
+        fixtures = FakeBungieServer.load_fixtures(arguments.fixtures)
+    server = FakeBungieServer(FakeBungieOptions(
+        clans=arguments.clans,
+        roster_size=arguments.roster_size,
+        characters_per_player=arguments.characters,
+        latency_seconds=arguments.latency_ms / 1000,
+        latency_distribution=arguments.latency_distribution,
+        error_rate=arguments.error_rate,
+        throttle_rate=arguments.throttle_rate,
+        throttle_seconds=arguments.throttle_seconds,
+        throttle_status=arguments.throttle_status,
+        seed=arguments.seed,
+        destiny1_rate=arguments.destiny1_rate,
+    ), fixtures)
+    if arguments.hedge_percentile is None:
+        hedger = RequestHedger(max_hedge_ratio=0)
+    else:
+        hedger = RequestHedger(arguments.hedge_percentile, arguments.max_hedge_ratio)
+    endpoint = server.start()
+    try:
+        benchmarked_fetcher = Fetcher('benchmark', FetcherOptions(
+            max_concurrent_requests=arguments.max_concurrent_requests,
+            max_requests_per_second=arguments.max_requests_per_second,
+            endpoint=endpoint,
+            hedger=hedger,
+        ))
+        asyncio.run(run_syncs(benchmarked_fetcher, server.clan_ids(), arguments.syncs))
+    finally:
+        server.stop()
+    print(f"Serveur: {server.stats()}")
@@ -0,0 +1,201 @@
+import asyncio
+from components.api_fetcher.activity_hashes import DESTINY_1_ACTIVITIES_BY_HASH
+from components.api_fetcher.activity_hashes import DESTINY_2_ACTIVITIES_BY_HASH
+from components.api_fetcher.completions_matrix import CompletionsMatrix
+from components.api_fetcher.completions_matrix import new_completions_row
+from protos.sync_state_pb2 import SyncCheckpoint
+from protos.sync_state_pb2 import SyncState
+
+
+class SyncContext:
+    """State shared by every request of a single sync."""
+
+    def __init__(
+            self, previous_sync_state, clan_ids, now=None, resumed_checkpoint=None,
+            on_checkpoint=None):
+        """
+        :param previous_sync_state: The SyncState of the previous sync or None.
+        :param clan_ids: The clans to sync.
+        :param now: Now as a datetime. Reported as the start of the sync by its checkpoint.
+        :param resumed_checkpoint: The SyncCheckpoint of an interrupted sync to resume or None.
+        :param on_checkpoint: Saves |checkpoint|, or None.
+        """
+        activity_types = list(DESTINY_2_ACTIVITIES_BY_HASH.values()) + \
+            list(DESTINY_1_ACTIVITIES_BY_HASH.values())
+        self.previous_sync_state = previous_sync_state
+        self.clan_ids = clan_ids
+        self.sync_state = SyncState()
+        self.completions = CompletionsMatrix(activity_types)
+        self.clan_sync_states = {clan_id: SyncState() for clan_id in clan_ids}
+        self.clan_completions = {clan_id: CompletionsMatrix(activity_types) for clan_id in clan_ids}
+        self.members_by_clan = {}
+        self.players_by_account_id = {}
+        self.rows_by_account_id = {}
+        self.stale_account_ids = set()
+        self.account_ids_by_clan = {clan_id: set() for clan_id in clan_ids}
+        self.partial = False
+        self.resumed_checkpoint = resumed_checkpoint
+        self.resumed_players = 0
+        self.on_checkpoint = on_checkpoint
+        self.last_checkpoint = None
+        self.checkpoint = SyncCheckpoint()
+        if resumed_checkpoint is not None:
+            self.checkpoint.started_datetime = resumed_checkpoint.started_datetime
+        elif now is not None:
+            self.checkpoint.started_datetime = now.isoformat()
+
+    def fetch_player_once(self, account_id, fetch_player):
+        """
+        Makes sure every account is fetched exactly once per sync, even if it is listed in several
+        clans of the sync. Players finished by the resumed checkpoint are not fetched at all.
+        :param account_id: The account ID of a player.
+        :param fetch_player: Returns the coroutine that fetches the player. Only called once.
+        :return: A future with the result of the coroutine.
+        """
+        if account_id in self.players_by_account_id:
+            return self.players_by_account_id[account_id]
+        if self.resumed_checkpoint is not None and \
+                account_id in self.resumed_checkpoint.sync_state.players_by_account_id:
+            self.add_saved_player(account_id, self.resumed_checkpoint.sync_state)
+            self.resumed_players += 1
+            player = asyncio.get_running_loop().create_future()
+            player.set_result(None)
+        else:
+            player = asyncio.ensure_future(fetch_player())
+        self.players_by_account_id[account_id] = player
+        return player
+
+    def add_player(self, player, completions, character_ids, stale=False):
+        """
+        Records the completions of a player, once per sync.
+        :param player: A (gamer_tag, membership_type, membership_id, account_id) tuple.
+        :param completions: The player's row of completions, indexed by ActivityID.Type.
+        :param character_ids: The IDs of the player's characters. Already in the sync state.
+        :param stale: Whether the completions are the ones of the previous sync. Otherwise, the
+        player is added to the checkpoint.
+        """
+        (gamer_tag, membership_type, membership_id, account_id) = player
+        self.rows_by_account_id[account_id] = completions
+        if stale:
+            self.stale_account_ids.add(account_id)
+        self.completions.add(gamer_tag, completions, stale)
+        saved_player = self.sync_state.players_by_account_id[account_id]
+        saved_player.gamer_tag = gamer_tag
+        saved_player.character_ids.extend(character_ids)
+        saved_player.membership_type = membership_type
+        saved_player.membership_id = membership_id
+        if not stale:
+            checkpoint_state = self.checkpoint.sync_state
+            checkpoint_state.players_by_account_id[account_id].CopyFrom(saved_player)
+            for character_id in character_ids:
+                if character_id in self.sync_state.characters_by_id:
+                    checkpoint_state.characters_by_id[character_id].CopyFrom(
+                        self.sync_state.characters_by_id[character_id]
+                    )
+
+    def add_clan_player(self, clan_id, account_id):
+        """
+        Adds a player recorded by |add_player| to a clan.
+        :param clan_id: The clan identifier in the form of an integer.
+        :param account_id: The account ID of the player.
+        """
+        self.account_ids_by_clan[clan_id].add(account_id)
+        player = self.sync_state.players_by_account_id[account_id]
+        self.clan_completions[clan_id].add(
+            player.gamer_tag,
+            self.rows_by_account_id[account_id],
+            account_id in self.stale_account_ids
+        )
+        self.sync_state.clans_by_id[clan_id].account_ids.append(account_id)
+        clan_sync_state = self.clan_sync_states[clan_id]
+        clan_sync_state.clans_by_id[clan_id].account_ids.append(account_id)
+        clan_sync_state.players_by_account_id[account_id].CopyFrom(player)
+        for character_id in player.character_ids:
+            clan_sync_state.characters_by_id[character_id].CopyFrom(
+                self.sync_state.characters_by_id[character_id]
+            )
+
+    def cancel_players(self):
+        """Cancels the fetch of the players that are still in flight."""
+        for player in self.players_by_account_id.values():
+            player.cancel()
+
+    def keep_stale_players(self):
+        """
+        Adds the players that the sync did not reach to their clans, with the completions of the
+        previous sync. Marks the result as partial.
+        Clans whose members page landed keep only their current members. Other clans keep their
+        previous members. Players that the previous sync did not know are left out.
+        """
+        self.partial = True
+        previous = self.previous_sync_state or SyncState()
+        for clan_id in self.clan_ids:
+            if clan_id in self.members_by_clan:
+                account_ids = [player[3] for player in self.members_by_clan[clan_id]]
+            elif clan_id in previous.clans_by_id:
+                account_ids = previous.clans_by_id[clan_id].account_ids
+            else:
+                account_ids = []
+            for account_id in account_ids:
+                if account_id in self.account_ids_by_clan[clan_id]:
+                    continue
+                if account_id not in self.rows_by_account_id:
+                    if account_id not in previous.players_by_account_id:
+                        continue
+                    self.add_saved_player(account_id, previous, stale=True)
+                self.add_clan_player(clan_id, account_id)
+
+    def add_saved_player(self, account_id, saved_state, stale=False):
+        """
+        Records a player with the completions saved by another sync.
+        :param account_id: The account ID of the player.
+        :param saved_state: The SyncState of the previous sync, or of a resumed checkpoint.
+        :param stale: Whether the completions are the ones of the previous sync.
+        """
+        saved_player = saved_state.players_by_account_id[account_id]
+        completions = new_completions_row()
+        for character_id in saved_player.character_ids:
+            if character_id not in saved_state.characters_by_id:
+                continue
+            saved = saved_state.characters_by_id[character_id]
+            for stat in saved.activity_stats:
+                completions[stat.activity_type] += stat.completions
+            if character_id not in self.sync_state.characters_by_id:
+                self.sync_state.characters_by_id[character_id].CopyFrom(saved)
+        player = (
+            saved_player.gamer_tag,
+            saved_player.membership_type,
+            saved_player.membership_id,
+            account_id,
+        )
+        self.add_player(player, completions, saved_player.character_ids, stale)
+
+    def saved_character(self, character_id):
+        """
+        :param character_id: The ID of a character.
+        :return: The character as saved by the previous sync, or None.
+        """
+        if self.previous_sync_state is None:
+            return None
+        if character_id not in self.previous_sync_state.characters_by_id:
+            return None
+        return self.previous_sync_state.characters_by_id[character_id]
+
+
+class SyncResult:
+    """The bundles and sync states of a single sync, as a whole and by clan."""
+
+    def __init__(self, now, context):
+        """
+        :param now: Now as a datetime.
+        :param context: The SyncContext of the sync, once done.
+        """
+        self.bundle = context.completions.to_api_bundle()
+        self.bundle.last_sync_datetime = now.isoformat()
+        self.sync_state = context.sync_state
+        self.clan_bundles = {}
+        for clan_id, completions in context.clan_completions.items():
+            self.clan_bundles[clan_id] = completions.to_api_bundle()
+            self.clan_bundles[clan_id].last_sync_datetime = now.isoformat()
+        self.clan_sync_states = context.clan_sync_states
+        self.partial = context.partial
@@ -0,0 +1,30 @@
+STATUS_TOO_MANY_REQUESTS = 429
+BUNGIE_THROTTLE_ERROR_CODES = (
+    36, # ThrottleLimitExceeded
+    37, # ThrottleLimitExceededMinutes
+    38, # ThrottleLimitExceededMomentarily
+    39, # ThrottleLimitExceededSeconds
+    51, # PerApplicationThrottleExceeded
+    52, # PerApplicationAnonymousThrottleExceeded
+    53, # PerApplicationAuthenticatedThrottleExceeded
+    54, # PerUserThrottleExceeded
+    1672, # DestinyThrottledByGameServer
+)
+
+
+def get_throttle_seconds(status, content):
+    """
+    :param status: The HTTP status of a Bungie response.
+    :param content: The Bungie response, decoded from JSON. None if it was not decoded.
+    :return: How many seconds Bungie asks to wait before the next request, or None if the response
+    was not throttled.
+    """
+    throttle_seconds = 0
+    error_code = None
+    if isinstance(content, dict):
+        throttle_seconds = content.get('ThrottleSeconds') or 0
+        error_code = content.get('ErrorCode')
+    if status == STATUS_TOO_MANY_REQUESTS or error_code in BUNGIE_THROTTLE_ERROR_CODES or \
+            throttle_seconds > 0:
+        return float(throttle_seconds)
+    return None
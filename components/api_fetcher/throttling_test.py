@@ -0,0 +1,24 @@
+import unittest
+from components.api_fetcher import throttling
+
+
+class ThrottlingTest(unittest.TestCase):
+    """Test class for the detection of Bungie throttling."""
+
+    def test_throttle_seconds(self):
+        """Verifies Bungie throttling is detected from HTTP statuses and response bodies."""
+        self.assertIsNone(throttling.get_throttle_seconds(200, {'ErrorCode': 1}))
+        self.assertIsNone(
+            throttling.get_throttle_seconds(200, {'ErrorCode': 1, 'ThrottleSeconds': 0})
+        )
+        self.assertEqual(throttling.get_throttle_seconds(429, None), 0)
+        self.assertEqual(
+            throttling.get_throttle_seconds(200, {'ErrorCode': 1, 'ThrottleSeconds': 3}), 3
+        )
+        self.assertEqual(
+            throttling.get_throttle_seconds(200, {'ErrorCode': 51, 'ThrottleSeconds': 0}), 0
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import asyncio
+from protos.sync_state_pb2 import SyncCheckpoint
+
+
+class CheckpointWriter:
+    """
+    Saves the checkpoints of a sync that runs on the event loop, without blocking the loop.
+    Checkpoints are written off the loop one at a time. A checkpoint made while the previous one
+    is being written replaces the pending one, so that only the latest is written.
+    """
+
+    def __init__(self, write_checkpoint, run_blocking):
+        """
+        :param write_checkpoint: Function (SyncCheckpoint) that saves a checkpoint, e.g.
+        Storage.write_sync_checkpoint.
+        :param run_blocking: Coroutine function (function, *args) that runs a call off the event
+        loop, e.g. AsyncStorage.mutate.
+        """
+        self.__write_checkpoint = write_checkpoint
+        self.__run_blocking = run_blocking
+        self.__pending = None
+        self.__writes = None
+        self.__stats = {'writes': 0, 'replaced': 0}
+
+    def stats(self):
+        """
+        :return: A dict with the number of checkpoints written (writes) and of checkpoints
+        replaced by a newer one before being written (replaced).
+        """
+        return dict(self.__stats)
+
+    def write(self, checkpoint):
+        """
+        Schedules the write of a checkpoint, without waiting for it. Called on the event loop,
+        e.g. as the on_checkpoint callback of Fetcher.fetch_async.
+        :param checkpoint: The SyncCheckpoint to save. Copied, the sync may keep updating it.
+        """
+        if self.__pending is not None:
+            self.__stats['replaced'] += 1
+        self.__pending = SyncCheckpoint()
+        self.__pending.CopyFrom(checkpoint)
+        if self.__writes is None or self.__writes.done():
+            self.__writes = asyncio.get_running_loop().create_task(self.__write_pending())
+
+    async def __write_pending(self):
+        """Writes the pending checkpoints until there is none. Failures are printed."""
+        while self.__pending is not None:
+            checkpoint = self.__pending
+            self.__pending = None
+            try:
+                await self.__run_blocking(self.__write_checkpoint, checkpoint)
+                self.__stats['writes'] += 1
+            except IOError as e:
+                print("Échec de l'écriture du point de reprise de la synchronisation: " + str(e))
+
+    async def flush(self):
+        """
+        Waits for the scheduled writes, e.g. before the checkpoint is deleted at the end of the
+        sync. The writes are not cancelled with the caller: a cancelled sync keeps its latest
+        checkpoint to resume from.
+        """
+        if self.__writes is not None:
+            await asyncio.shield(self.__writes)
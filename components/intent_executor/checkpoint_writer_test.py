@@ -0,0 +1,62 @@
+import asyncio
+import unittest
+from components.intent_executor import checkpoint_writer
+from protos.sync_state_pb2 import SyncCheckpoint
+
+
+class CheckpointWriterTest(unittest.TestCase):
+    """Test class for the writer of sync checkpoints."""
+
+    def setUp(self):
+        """Sets up a basic sut."""
+        self.written_checkpoints = []
+        self.sut = checkpoint_writer.CheckpointWriter(self.write_checkpoint, self.run_blocking)
+
+    def write_checkpoint(self, checkpoint):
+        """Test double of Storage.write_sync_checkpoint."""
+        if checkpoint.started_datetime == 'invalide':
+            raise IOError("Impossible d'écrire le point de reprise.")
+        self.written_checkpoints.append(checkpoint)
+
+    @staticmethod
+    async def run_blocking(function, *args):
+        """Test double of AsyncStorage.mutate."""
+        await asyncio.sleep(0)
+        return function(*args)
+
+    def test_latest_checkpoint_is_written(self):
+        """Verifies checkpoints made during a write are replaced by the latest one."""
+        async def run():
+            checkpoint = SyncCheckpoint()
+            checkpoint.started_datetime = '1'
+            self.sut.write(checkpoint)
+            await asyncio.sleep(0)
+            for started_datetime in ['2', '3']:
+                checkpoint.started_datetime = started_datetime
+                self.sut.write(checkpoint)
+            checkpoint.started_datetime = '4'
+            await self.sut.flush()
+            await self.sut.flush()
+        asyncio.run(run())
+        self.assertEqual(
+            [checkpoint.started_datetime for checkpoint in self.written_checkpoints], ['1', '3']
+        )
+        self.assertEqual(self.sut.stats(), {'writes': 2, 'replaced': 1})
+
+    def test_write_failures(self):
+        """Verifies a failed write does not stop the next ones."""
+        async def run():
+            checkpoint = SyncCheckpoint()
+            checkpoint.started_datetime = 'invalide'
+            self.sut.write(checkpoint)
+            await self.sut.flush()
+            checkpoint.started_datetime = '1'
+            self.sut.write(checkpoint)
+            await self.sut.flush()
+        asyncio.run(run())
+        self.assertEqual(len(self.written_checkpoints), 1)
+        self.assertEqual(self.sut.stats(), {'writes': 1, 'replaced': 0})
+
+
+if __name__ == '__main__':
+    unittest.main()
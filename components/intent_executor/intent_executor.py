@@ -1,14 +1,22 @@
+import asyncio
 from datetime import datetime
 from datetime import tzinfo
 from dateutil import tz
 import dateparser
+from components.api_fetcher.api_fetcher import DESTINY_2_CLANS_WATCHLIST
 from components.api_fetcher.api_fetcher import Fetcher
 from components.converters.when import to_datetime
+from components.intent_executor.checkpoint_writer import CheckpointWriter
 from components.img_generator.img_generator import Generator
+from components.storage.clan_cache import ClanCache
+from components.storage.sqlite_storage import SqliteStorage
 from components.storage.storage import Storage
 from protos.activity_pb2 import Activity
+from protos.api_bundle_pb2 import APIBundle
 from protos.intent_pb2 import Intent
 from protos.schedule_pb2 import Schedule
+from protos.sync_state_pb2 import PlayerLookups
+from protos.sync_state_pb2 import SyncState
 
 CLEARPAST_WEEKDAY = "Tuesday"
 CLEARPAST_HOUR = 19
@@ -17,18 +25,34 @@ MAX_SQUAD_SIZE_PLAYERS = 6
 MIN_SQUAD_SIZE_PLAYERS = 1
 MAX_SQUAD_SIZE_SUBSTITUTES = 2
 MIN_SQUAD_SIZE_SUBSTITUTES = 0
+# Bounds the wait of a message that names a player missing from the bundle.
+PLAYER_LOOKUP_TIMEOUT_SECONDS = 10
+# The number of leading words of a message that are tried as the name of a missing player.
+MAX_PLAYER_LOOKUP_WORDS = 3
+# Key of the player lookups in the sync states of |read_player_sync_states|.
+PLAYER_LOOKUPS_KEY = 'lookups'
 
 
 class Executor:
     """Executor for user input (intents)."""
 
-    def __init__(self, storage, api_fetcher, img_generator):
-        assert isinstance(storage, Storage), "Stockage non configuré"
+    def __init__(self, storage, api_fetcher, img_generator, clan_cache=None):
+        """
+        :param storage: The Storage of the guild.
+        :param api_fetcher: The Fetcher of Bungie stats.
+        :param img_generator: The Generator of activity images.
+        :param clan_cache: Optional process-wide ClanCache. When given, the guild bundle is a merged
+        view over the clans of the guild's watchlist, instead of a copy in the guild's storage.
+        """
+        assert isinstance(storage, (Storage, SqliteStorage)), "Stockage non configuré"
         assert isinstance(api_fetcher, Fetcher), "Connexion API non configurée"
         assert isinstance(img_generator, Generator), "Générateur d'images non configuré"
+        assert clan_cache is None or isinstance(clan_cache, ClanCache), \
+            "Cache des clans non configuré"
         self.__storage = storage
         self.__api_fetcher = api_fetcher
         self.__img_generator = img_generator
+        self.__clan_cache = clan_cache
 
     def execute(self, intent, now):
         """
@@ -46,6 +70,246 @@ class Executor:
             return self.execute_activity_intent(intent.activity_intent), None
         raise ValueError("Commande invalide")
 
+    async def execute_async(self, intent, now, run_blocking=None):
+        """
+        Same as |execute| but awaits syncs instead of blocking the event loop while they run.
+        Storage and disk accesses run off the event loop.
+        :param intent: The intent to execute
+        :param now: Now as a datetime.
+        :param run_blocking: Optional coroutine function (function, *args) that runs the storage
+        calls off the event loop, e.g. AsyncStorage.mutate. Defaults to |run_in_executor|.
+        :return: An (execution feedback message, generated BytesIO images or None) tuple.
+        :raises: If the intent could be executed for some reason.
+        """
+        assert isinstance(intent, Intent), "Commande invalide"
+        run_blocking = run_blocking or self.run_in_executor
+        if intent.HasField('global_intent') and intent.global_intent.HasField('sync_bundle'):
+            # !cortana sync
+            return await self.sync_async(now, run_blocking=run_blocking), None
+        if intent.HasField('global_intent') and intent.global_intent.HasField('sync_player'):
+            # !cortana sync [gamer_tag]
+            return await self.sync_player_async(
+                intent.global_intent.sync_player, run_blocking
+            ), None
+        if intent.HasField('global_intent') and \
+                intent.global_intent.HasField('set_clan_watchlist'):
+            # !cortana clans [clan_ids]
+            clan_watchlist = intent.global_intent.set_clan_watchlist
+            await run_blocking(self.write_clan_watchlist, clan_watchlist)
+            missing_clan_ids = await run_blocking(self.missing_clan_ids)
+            await self.sync_async(now, missing_clan_ids, run_blocking)
+            return await run_blocking(self.clan_watchlist_feedback), None
+        return await run_blocking(self.execute, intent, now)
+
+    @staticmethod
+    async def run_in_executor(function, *args):
+        """
+        Runs a blocking call in the default executor of the event loop.
+        :param function: The function to call, e.g. a method of the storage.
+        :return: What |function| returns.
+        :raises: What |function| raises.
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    def sync(self, now, clan_ids=None):
+        """
+        Syncs the stats of the players of the guild's clans with Bungie.
+        The sync is checkpointed to the storage as players are finished, so that an interrupted
+        sync resumes where it stopped.
+        :param now: Now as a datetime.
+        :param clan_ids: The clans to sync. Defaults to the guild's watchlist.
+        Ignored without a clan cache.
+        :return: The sync feedback message.
+        """
+        checkpoint = self.read_sync_checkpoint()
+        on_checkpoint = self.__storage.write_sync_checkpoint
+        if self.__clan_cache is None:
+            sync_state = self.read_sync_state()
+            bundle = self.__api_fetcher.fetch(now, sync_state, checkpoint, on_checkpoint)
+            return self.save_synced_bundle(bundle, sync_state)
+        sync_states_by_clan = self.read_clan_sync_states(clan_ids)
+        bundles_by_clan = {}
+        if sync_states_by_clan:
+            bundles_by_clan = self.__api_fetcher.fetch_clans(
+                now, sync_states_by_clan, checkpoint, on_checkpoint
+            )
+        return self.save_synced_clans(bundles_by_clan, sync_states_by_clan)
+
+    async def sync_async(self, now, clan_ids=None, run_blocking=None):
+        """
+        Same as |sync| but awaits the sync instead of blocking the event loop. Checkpoints are
+        written off the event loop by a CheckpointWriter.
+        :param run_blocking: Optional coroutine function (function, *args) that runs the storage
+        calls off the event loop, e.g. AsyncStorage.mutate. Defaults to |run_in_executor|.
+        """
+        run_blocking = run_blocking or self.run_in_executor
+        checkpoint = await run_blocking(self.read_sync_checkpoint)
+        checkpoint_writer = CheckpointWriter(self.__storage.write_sync_checkpoint, run_blocking)
+        try:
+            if self.__clan_cache is None:
+                sync_state = await run_blocking(self.read_sync_state)
+                bundle = await self.__api_fetcher.fetch_async(
+                    now, sync_state, checkpoint, checkpoint_writer.write
+                )
+                # The checkpoint is deleted once saved: no late write may bring it back.
+                await checkpoint_writer.flush()
+                return await run_blocking(self.save_synced_bundle, bundle, sync_state)
+            sync_states_by_clan = await run_blocking(self.read_clan_sync_states, clan_ids)
+            bundles_by_clan = {}
+            if sync_states_by_clan:
+                bundles_by_clan = await self.__api_fetcher.fetch_clans_async(
+                    now, sync_states_by_clan, checkpoint, checkpoint_writer.write
+                )
+            await checkpoint_writer.flush()
+            return await run_blocking(
+                self.save_synced_clans, bundles_by_clan, sync_states_by_clan
+            )
+        finally:
+            await checkpoint_writer.flush()
+
+    def sync_player(self, gamer_tag):
+        """
+        Refreshes the stats of a single player with Bungie, without syncing the clans.
+        :param gamer_tag: The gamer tag of the player, as in the API Bundle.
+        :return: The sync feedback message.
+        :raises: If no previous sync knows the player.
+        """
+        (account_id, sync_states) = self.read_player_sync_states(gamer_tag)
+        stats = self.__api_fetcher.fetch_player(account_id, sync_states.values())
+        return self.save_synced_player(gamer_tag, account_id, stats, sync_states)
+
+    async def sync_player_async(self, gamer_tag, run_blocking=None):
+        """
+        Same as |sync_player| but awaits the sync instead of blocking the event loop.
+        :param run_blocking: Optional coroutine function (function, *args) that runs the storage
+        calls off the event loop, e.g. AsyncStorage.mutate. Defaults to |run_in_executor|.
+        """
+        run_blocking = run_blocking or self.run_in_executor
+        (account_id, sync_states) = await run_blocking(self.read_player_sync_states, gamer_tag)
+        stats = await self.__api_fetcher.fetch_player_async(account_id, sync_states.values())
+        return await run_blocking(
+            self.save_synced_player, gamer_tag, account_id, stats, sync_states
+        )
+
+    async def lookup_player_async(self, words, run_blocking=None):
+        """
+        Looks up a player missing from the API Bundle by name on Bungie, and fetches their stats
+        only. The player is then part of the API Bundle of the guild, see |read_api_bundle|.
+        Gives up after PLAYER_LOOKUP_TIMEOUT_SECONDS.
+        :param words: The words of the message the gamer tag was expected to start from. Their
+        first MAX_PLAYER_LOOKUP_WORDS words are tried as a name, longest first.
+        :param run_blocking: Optional coroutine function (function, *args) that runs the storage
+        calls off the event loop, e.g. AsyncStorage.mutate. Defaults to |run_in_executor|.
+        :return: The gamer tag of the player, or None if no player was found in time.
+        """
+        display_names = [
+            " ".join(words[:count]).lstrip('+-')
+            for count in range(min(len(words), MAX_PLAYER_LOOKUP_WORDS), 0, -1)
+        ]
+        display_names = [display_name for display_name in display_names if display_name]
+        if not display_names:
+            return None
+        try:
+            return await asyncio.wait_for(
+                self.fetch_looked_up_player(display_names, run_blocking or self.run_in_executor),
+                PLAYER_LOOKUP_TIMEOUT_SECONDS
+            )
+        except asyncio.TimeoutError:
+            return None
+
+    async def fetch_looked_up_player(self, display_names, run_blocking):
+        """
+        :param display_names: The names to search, in order of preference.
+        :param run_blocking: Coroutine function (function, *args) that runs the storage calls off
+        the event loop.
+        :return: The gamer tag of the player, saved to the player lookups. None if not found.
+        """
+        player = await self.__api_fetcher.search_player_async(display_names)
+        if player is None:
+            return None
+        (gamer_tag, membership_type, membership_id, account_id) = player
+        lookups = await run_blocking(self.read_player_lookups)
+        player_state = lookups.sync_state.players_by_account_id[account_id]
+        player_state.gamer_tag = gamer_tag
+        player_state.membership_type = membership_type
+        player_state.membership_id = membership_id
+        stats = await self.__api_fetcher.fetch_player_async(account_id, [lookups.sync_state])
+        await run_blocking(
+            self.save_looked_up_player, gamer_tag, account_id, stats, lookups.sync_state
+        )
+        return gamer_tag
+
+    def save_looked_up_player(self, gamer_tag, account_id, stats, sync_state):
+        """
+        Adds a player to the player lookups, read again so that the players saved meanwhile by
+        other commands are kept.
+        :param gamer_tag: The gamer tag of the player.
+        :param account_id: The account ID of the player.
+        :param stats: The freshly fetched APIBundle.Stats of the player.
+        :param sync_state: The sync state updated by the fetch of the player.
+        """
+        lookups = self.read_player_lookups()
+        lookups.api_bundle.stats_by_player[gamer_tag].CopyFrom(stats)
+        self.merge_player_state(lookups.sync_state, account_id, sync_state)
+        self.__storage.write_player_lookups(lookups)
+
+    @staticmethod
+    def merge_player_state(sync_state, account_id, player_sync_state):
+        """
+        Replaces a player and their characters in |sync_state| with those of |player_sync_state|.
+        The other players of |sync_state| are left as they are.
+        :param sync_state: The SyncState to update in place.
+        :param account_id: The account ID of the player.
+        :param player_sync_state: The SyncState updated by the fetch of the player.
+        """
+        if account_id in sync_state.players_by_account_id:
+            for character_id in sync_state.players_by_account_id[account_id].character_ids:
+                if character_id in sync_state.characters_by_id:
+                    del sync_state.characters_by_id[character_id]
+        player = player_sync_state.players_by_account_id[account_id]
+        sync_state.players_by_account_id[account_id].CopyFrom(player)
+        for character_id in player.character_ids:
+            if character_id in player_sync_state.characters_by_id:
+                sync_state.characters_by_id[character_id].CopyFrom(
+                    player_sync_state.characters_by_id[character_id]
+                )
+
+    def read_api_bundle(self):
+        """
+        :return: The API Bundle of the guild, with the players looked up on demand.
+        :raises: IOError if it has never been synced.
+        """
+        if self.__clan_cache is None:
+            bundle = self.__storage.read_api_bundle()
+        else:
+            bundle = self.__clan_cache.read_merged_bundle(self.read_clan_ids())
+        lookups = self.read_player_lookups()
+        for gamer_tag, stats in lookups.api_bundle.stats_by_player.items():
+            if gamer_tag not in bundle.stats_by_player:
+                bundle.stats_by_player[gamer_tag].CopyFrom(stats)
+        return bundle
+
+    def read_player_lookups(self):
+        """:return: The players looked up on demand by the guild. Empty if none."""
+        try:
+            return self.__storage.read_player_lookups()
+        except IOError:
+            return PlayerLookups()
+
+    def read_clan_ids(self):
+        """:return: The clans watched by the guild. Defaults to DESTINY_2_CLANS_WATCHLIST."""
+        try:
+            clan_ids = list(self.__storage.read_clan_watchlist().clan_ids)
+        except IOError:
+            clan_ids = []
+        return clan_ids if clan_ids else list(DESTINY_2_CLANS_WATCHLIST)
+
+    def missing_clan_ids(self):
+        """:return: The clans watched by the guild that have never been synced."""
+        if self.__clan_cache is None:
+            return []
+        return self.__clan_cache.missing_clans(self.read_clan_ids())
+
     def execute_global_intent(self, global_intent, now):
         """
         :param global_intent: The global_intent to execute.
@@ -112,7 +376,10 @@ class Executor:
                 "sont pas directement reflétés dans les affiches. " \
                 "Ils seront appliqués à partir des prochaines commandes (nouvelle création " \
                 "d'activité ou mise à jour d'escouade).\n\n" \
+                "!cortana sync [gamer_tag] => Synchronise seulement les stats du joueur.\n\n" \
                 "!cortana lastsync => Affiche la dernière date de synchronisation.\n\n" \
+                "!cortana clans (identifiant1 ...) => Affiche ou remplace la liste des clans " \
+                "Destiny 2 suivis par ce serveur (identifiants de groupe Bungie).\n\n" \
                 "!cortana credits => Affiche les noms de mes créateurs."
             return help_str, None
 
@@ -126,15 +393,28 @@ class Executor:
 
         if global_intent.HasField('sync_bundle'):
             # !cortana sync
-            bundle = self.__api_fetcher.fetch(now)
-            self.__storage.write_api_bundle(bundle)
-            return "Joueurs et niveaux d'experiences synchronisés.", None
+            return self.sync(now), None
+
+        if global_intent.HasField('sync_player'):
+            # !cortana sync [gamer_tag]
+            return self.sync_player(global_intent.sync_player), None
 
         if global_intent.HasField('get_last_bundle_sync_datetime'):
             # !cortana lastsync
-            bundle = self.__storage.read_api_bundle()
+            bundle = self.read_api_bundle()
             return "Dernière synchronisation: " + bundle.last_sync_datetime, None
 
+        if global_intent.HasField('get_clan_watchlist'):
+            # !cortana clans
+            return self.clan_watchlist_feedback(), None
+
+        if global_intent.HasField('set_clan_watchlist'):
+            # !cortana clans [clan_ids]
+            clan_watchlist = global_intent.set_clan_watchlist
+            self.write_clan_watchlist(clan_watchlist)
+            self.sync(now, self.missing_clan_ids())
+            return self.clan_watchlist_feedback(), None
+
         if global_intent.HasField('clear_all'):
             # !cortana clearall
             schedule = Schedule()
@@ -176,87 +456,229 @@ class Executor:
         :raises: If the intent could be executed for some reason.
         """
         schedule = self.__storage.read_schedule()
+        (feedback, modified) = Executor.apply_activity_intent(schedule, activity_intent)
+        if not modified:
+            return feedback
+        if isinstance(self.__storage, Storage) and self.__storage.is_journaled():
+            self.__storage.append_activity_intent(activity_intent, schedule)
+        else:
+            self.__storage.write_schedule(schedule)
+        return feedback
+
+    @staticmethod
+    def apply_activity_intent(schedule, activity_intent):
+        """
+        Applies an activity intent to a schedule. Only |schedule| is modified: nothing is read
+        from or written to the storage, so that journaled intents can be replayed.
+        :param schedule: The schedule to modify in place.
+        :param activity_intent: The intent to apply.
+        :return: An (execution feedback message, whether |schedule| was modified) tuple.
+        :raises: If the intent could be applied for some reason.
+        """
         activity_id = activity_intent.activity_id
         if activity_intent.HasField('update_when'):
             # !cortana date
-            activity = self.find_activity_with_id(activity_id, schedule)
+            activity = Executor.find_activity_with_id(activity_id, schedule)
             activity.id.when.CopyFrom(activity_intent.update_when)
-            self.__storage.write_schedule(schedule)
-            return "Date mise à jour:\n" + str(activity.id)
+            return "Date mise à jour:\n" + str(activity.id), True
 
         if activity_intent.HasField('mark_finished'):
             # !cortana finish [activity] (date)
-            activity = self.find_activity_with_id(activity_id, schedule)
+            activity = Executor.find_activity_with_id(activity_id, schedule)
             activity.state = Activity.State.FINISHED
-            self.__storage.write_schedule(schedule)
-            return "Good job!\nActivité marquée comme terminée:\n" + str(activity.id)
+            return "Good job!\nActivité marquée comme terminée:\n" + str(activity.id), True
 
         if activity_intent.HasField('set_milestone'):
             # !cortana milestone [activity] (date)
-            activity = self.find_activity_with_id(activity_id, schedule)
+            activity = Executor.find_activity_with_id(activity_id, schedule)
             activity.state = Activity.State.MILESTONED
             activity.milestone = activity_intent.set_milestone
-            self.__storage.write_schedule(schedule)
-            return "Étape mise à jour (" + activity.milestone + "):\n" + str(activity.id)
+            return "Étape mise à jour (" + activity.milestone + "):\n" + str(activity.id), True
 
         if activity_intent.HasField('info'):
             # !cortana info
-            activity = self.find_activity_with_id(activity_id, schedule)
-            return str(activity)
+            activity = Executor.find_activity_with_id(activity_id, schedule)
+            return str(activity), False
 
         if activity_intent.HasField('clear'):
             # !cortana clear [activity] (date)
-            activity = self.find_activity_with_id(activity_id, schedule)
+            activity = Executor.find_activity_with_id(activity_id, schedule)
             schedule.activities.remove(activity)
-            self.__storage.write_schedule(schedule)
-            return "Activité supprimée:\n" + str(activity.id)
+            return "Activité supprimée:\n" + str(activity.id), True
 
         if activity_intent.HasField('upsert_squad'):
             # !cortana (backup) [activity] (date) [players]
             feedback = "Escouade mise à jour"
             try:
-                activity = self.find_activity_with_id(activity_id, schedule)
+                activity = Executor.find_activity_with_id(activity_id, schedule)
             except:
                 activity = schedule.activities.add()
                 activity.id.CopyFrom(activity_intent.activity_id)
                 activity.state = Activity.State.NOT_STARTED
                 feedback = "Activité créée"
-            self.merge_players(
+            Executor.merge_players(
                 activity.squad.players,
                 activity_intent.upsert_squad.added.players,
                 False
             )
-            self.merge_players(
+            Executor.merge_players(
                 activity.squad.players,
                 activity_intent.upsert_squad.removed.players,
                 True
             )
-            self.merge_players(
+            Executor.merge_players(
                 activity.squad.substitutes,
                 activity_intent.upsert_squad.added.substitutes,
                 False
             )
-            self.merge_players(
+            Executor.merge_players(
                 activity.squad.substitutes,
                 activity_intent.upsert_squad.removed.substitutes,
                 True
             )
-            self.assert_player_count_within_bound(
+            Executor.assert_player_count_within_bound(
                 activity.squad.players,
                 MIN_SQUAD_SIZE_PLAYERS,
                 MAX_SQUAD_SIZE_PLAYERS
             )
-            self.assert_player_count_within_bound(
+            Executor.assert_player_count_within_bound(
                 activity.squad.substitutes,
                 MIN_SQUAD_SIZE_SUBSTITUTES,
                 MAX_SQUAD_SIZE_SUBSTITUTES
             )
-            self.__storage.write_schedule(schedule)
-            return feedback + ":\n" + str(activity)
+            return feedback + ":\n" + str(activity), True
 
         raise ValueError("Commande invalide")
 
-    def find_activity_with_id(self, activity_id, schedule):
+    def read_sync_state(self):
+        """
+        :return: The state of the last sync, or an empty one for a full sync.
+        """
+        try:
+            return self.__storage.read_sync_state()
+        except IOError:
+            return SyncState()
+
+    def read_sync_checkpoint(self):
+        """:return: The checkpoint of the interrupted sync of the guild, or None."""
+        try:
+            return self.__storage.read_sync_checkpoint()
+        except IOError:
+            return None
+
+    def save_synced_bundle(self, bundle, sync_state):
+        """
+        :param bundle: The freshly fetched API Bundle.
+        :param sync_state: The state of the sync that fetched the bundle.
+        :return: The sync feedback message.
+        """
+        self.__storage.write_api_bundle(bundle)
+        self.__storage.write_sync_state(sync_state)
+        self.__storage.delete_sync_checkpoint()
+        return self.sync_feedback([bundle])
+
+    def read_clan_sync_states(self, clan_ids):
+        """
+        :param clan_ids: The clans to sync. Defaults to the guild's watchlist.
+        :return: A {clan ID: SyncState} dict with the state of the last sync of each clan, or an
+        empty one for a full sync.
+        """
+        if clan_ids is None:
+            clan_ids = self.read_clan_ids()
+        sync_states_by_clan = {}
+        for clan_id in clan_ids:
+            try:
+                sync_states_by_clan[clan_id] = self.__clan_cache.read_sync_state(clan_id)
+            except IOError:
+                sync_states_by_clan[clan_id] = SyncState()
+        return sync_states_by_clan
+
+    def read_player_sync_states(self, gamer_tag):
+        """
+        :param gamer_tag: The gamer tag of a player.
+        :return: An (account ID, {clan ID: SyncState}) tuple with the sync states of the last syncs
+        that know the player. Without clan cache, the guild's sync state is keyed by None. The sync
+        state of the players looked up on demand is keyed by PLAYER_LOOKUPS_KEY.
+        :raises: If no previous sync knows the player.
+        """
+        if self.__clan_cache is None:
+            sync_states = {None: self.read_sync_state()}
+        else:
+            sync_states = self.read_clan_sync_states(None)
+        sync_states[PLAYER_LOOKUPS_KEY] = self.read_player_lookups().sync_state
+        for sync_state in sync_states.values():
+            for account_id, player in sync_state.players_by_account_id.items():
+                if player.gamer_tag == gamer_tag and player.membership_id:
+                    return account_id, {
+                        clan_id: sync_state for clan_id, sync_state in sync_states.items()
+                        if account_id in sync_state.players_by_account_id
+                    }
+        raise ValueError(
+            "Impossible de synchroniser " + gamer_tag + " seul, faites d'abord un !cortana sync."
+        )
+
+    def save_synced_player(self, gamer_tag, account_id, stats, sync_states):
+        """
+        Patches the stats of a player in the API Bundles of the given sync states. The protos of
+        the guild are read again, so that the updates of other commands meanwhile are kept.
+        :param gamer_tag: The gamer tag of the player.
+        :param account_id: The account ID of the player.
+        :param stats: The freshly fetched APIBundle.Stats of the player.
+        :param sync_states: The updated sync states. See |read_player_sync_states|.
+        :return: The sync feedback message.
+        """
+        for clan_id, sync_state in sync_states.items():
+            bundle = APIBundle()
+            if clan_id == PLAYER_LOOKUPS_KEY:
+                self.save_looked_up_player(gamer_tag, account_id, stats, sync_state)
+            elif clan_id is None:
+                bundle.CopyFrom(self.__storage.read_api_bundle())
+                bundle.stats_by_player[gamer_tag].CopyFrom(stats)
+                self.__storage.write_api_bundle(bundle)
+                saved_sync_state = self.read_sync_state()
+                self.merge_player_state(saved_sync_state, account_id, sync_state)
+                self.__storage.write_sync_state(saved_sync_state)
+            else:
+                bundle.CopyFrom(self.__clan_cache.read_clan_bundle(clan_id))
+                bundle.stats_by_player[gamer_tag].CopyFrom(stats)
+                self.__clan_cache.write_clan(clan_id, bundle, sync_state)
+        return "Stats de " + gamer_tag + " synchronisées."
+
+    def save_synced_clans(self, bundles_by_clan, sync_states_by_clan):
+        """
+        :param bundles_by_clan: The freshly fetched API Bundle of each clan.
+        :param sync_states_by_clan: The state of the sync of each clan.
+        :return: The sync feedback message.
+        """
+        for clan_id, bundle in bundles_by_clan.items():
+            self.__clan_cache.write_clan(clan_id, bundle, sync_states_by_clan[clan_id])
+        self.__storage.delete_sync_checkpoint()
+        return self.sync_feedback(bundles_by_clan.values())
+
+    def create_schedule(self):
+        """Writes an empty schedule for the guild, unless another command did it meanwhile."""
+        try:
+            self.__storage.read_schedule()
+        except IOError:
+            self.__storage.write_schedule(Schedule())
+
+    def write_clan_watchlist(self, clan_watchlist):
+        """
+        :param clan_watchlist: The new clan watchlist of the guild.
+        :raises: If there is no clan cache or no clan in the watchlist.
+        """
+        if self.__clan_cache is None:
+            raise ValueError("La liste des clans n'est pas configurable sans cache des clans.")
+        if len(clan_watchlist.clan_ids) == 0:
+            raise ValueError("La liste des clans est vide.")
+        self.__storage.write_clan_watchlist(clan_watchlist)
+
+    def clan_watchlist_feedback(self):
+        """:return: The message listing the clans watched by the guild."""
+        return "Clans suivis: " + ", ".join(map(str, self.read_clan_ids()))
+
+    @staticmethod
+    def find_activity_with_id(activity_id, schedule):
         """
         Finds the activity that best matches the given ID.
         :param activity_id: The activity ID used for the search.
@@ -300,7 +722,8 @@ class Executor:
             return activities[0]
         raise ValueError("Critère de recherche trop large. Précisez une date et une heure.")
 
-    def merge_players(self, base, delta, subtract):
+    @staticmethod
+    def merge_players(base, delta, subtract):
         """
         :param base: The array of players the delta must be merged into.
         :param delta: The players to merge into the base.
@@ -324,7 +747,8 @@ class Executor:
                     player.rating = players_to_edit[player.gamer_tag].rating
             base.extend(players_to_add)
 
-    def assert_player_count_within_bound(self, players, min_capacity, max_capacity):
+    @staticmethod
+    def assert_player_count_within_bound(players, min_capacity, max_capacity):
         """
         :param min_capacity: Minimum expected size. Inclusive.
         :param max_capacity: Maximum expected size. Inclusive.
@@ -339,3 +763,21 @@ class Executor:
             raise ValueError(
                 "Il y a trop de joueurs %d/%d." % (count, max_capacity)
             )
+
+    def sync_feedback(self, bundles):
+        """
+        :param bundles: The freshly fetched API Bundles.
+        :return: The sync feedback message. Mentions the players that kept their previous stats
+        because the sync ran out of time.
+        """
+        stale_gamer_tags = {
+            gamer_tag
+            for bundle in bundles
+            for gamer_tag, stats in bundle.stats_by_player.items()
+            if stats.stale
+        }
+        feedback = "Joueurs et niveaux d'experiences synchronisés."
+        if stale_gamer_tags:
+            feedback += "\nDélai dépassé: " + str(len(stale_gamer_tags)) + \
+                " joueur(s) gardent leurs stats précédentes."
+        return feedback
@@ -1,20 +1,28 @@
+import asyncio
 from datetime import datetime
 import io
 import os
 from pathlib import Path
 import tempfile
+import time
 import unittest
+from unittest.mock import ANY
 from unittest.mock import MagicMock
 from dateutil import tz
 from components.intent_parser.intent_parser import Parser
 from components.intent_executor.intent_executor import Executor
 from components.api_fetcher.api_fetcher import Fetcher
 from components.img_generator.img_generator import Generator
+from components.storage.async_storage import AsyncStorage
+from components.storage.clan_cache import ClanCache
+from components.storage.sqlite_storage import SqliteStorage
 from components.storage.storage import Storage
 from protos.activity_id_pb2 import ActivityID
 from protos.activity_pb2 import Activity
 from protos.api_bundle_pb2 import APIBundle
 from protos.schedule_pb2 import Schedule
+from protos.sync_state_pb2 import SyncCheckpoint
+from protos.sync_state_pb2 import SyncState
 from protos.rated_player_pb2 import RatedPlayer
 
 TIMEZONE = tz.gettz('Europe/Paris')
@@ -174,11 +182,238 @@ class ExecutorTest(unittest.TestCase):
         self.api_fetcher.fetch = MagicMock(return_value=new_bundle)
         (feedback, images) = self.execute("!cortana sync")
 
-        self.api_fetcher.fetch.assert_called_with(NOW)
+        self.api_fetcher.fetch.assert_called_with(
+            NOW, SyncState(), None, self.storage.write_sync_checkpoint
+        )
+        self.assertEqual(self.storage.read_api_bundle(), new_bundle)
+        self.assertEqual(self.storage.read_sync_state(), SyncState())
+        self.assertEqual(feedback, "Joueurs et niveaux d'experiences synchronisés.")
+        self.assertIsNone(images)
+
+        new_bundle.stats_by_player['Walnut Waffle'].stale = True
+        (feedback, _) = self.execute("!cortana sync")
+        self.assertEqual(
+            feedback,
+            "Joueurs et niveaux d'experiences synchronisés.\n"
+            "Délai dépassé: 1 joueur(s) gardent leurs stats précédentes."
+        )
+
+    def test_sync_player(self):
+        """Verifies a single player sync patches their stats in the stored bundle."""
+        sync_state = SyncState()
+        player = sync_state.players_by_account_id['destiny:1']
+        player.gamer_tag = 'Walnut Waffle'
+        player.membership_type = '3'
+        player.membership_id = '1'
+        self.storage.write_sync_state(sync_state)
+        bundle = self.storage.read_api_bundle()
+        stats = APIBundle.Stats()
+        stat = stats.activity_stats.add()
+        stat.activity_type = ActivityID.Type.LAST_WISH
+        stat.completions = 42
+        self.api_fetcher.fetch_player = MagicMock(return_value=stats)
+        (feedback, images) = self.execute("!cortana sync walnut waffle")
+        self.assertEqual(feedback, "Stats de Walnut Waffle synchronisées.")
+        self.assertIsNone(images)
+        self.assertEqual(list(self.api_fetcher.fetch_player.call_args[0][1]), [sync_state])
+        bundle.stats_by_player['Walnut Waffle'].CopyFrom(stats)
+        self.assertEqual(self.storage.read_api_bundle(), bundle)
+        self.assertRaises(ValueError, self.execute, "!cortana sync Oby1Chick")
+
+    def test_lookup_player(self):
+        """Verifies players missing from the bundle are looked up, then merged into the bundle."""
+        stats = APIBundle.Stats()
+        stat = stats.activity_stats.add()
+        stat.activity_type = ActivityID.Type.LAST_WISH
+        stat.completions = 3
+
+        async def search_player(display_names):
+            if 'Zorglub Master' in display_names:
+                return ('Zorglub Master', '3', '7', 'destiny:7')
+            return None
+
+        async def fetch_player(account_id, sync_states):
+            self.assertEqual(sync_states[0].players_by_account_id[account_id].membership_id, '7')
+            return stats
+        self.api_fetcher.search_player_async = MagicMock(side_effect=search_player)
+        self.api_fetcher.fetch_player_async = MagicMock(side_effect=fetch_player)
+        self.assertRaises(ValueError, self.execute, "!cortana sync zorglub master")
+        gamer_tag = asyncio.run(self.sut.lookup_player_async(['+Zorglub', 'Master', 'jds', 'x']))
+        self.assertEqual(gamer_tag, 'Zorglub Master')
+        self.api_fetcher.search_player_async.assert_called_with(
+            ['Zorglub Master jds', 'Zorglub Master', 'Zorglub']
+        )
+        self.assertEqual(self.sut.read_api_bundle().stats_by_player['Zorglub Master'], stats)
+        self.assertIsNone(asyncio.run(self.sut.lookup_player_async(['Inconnu'])))
+
+        self.api_fetcher.fetch_player = MagicMock(return_value=APIBundle.Stats())
+        intent = self.parser.parse("!cortana sync zorglub master", self.sut.read_api_bundle(), NOW)
+        (feedback, _) = self.sut.execute(intent, NOW)
+        self.assertEqual(feedback, "Stats de Zorglub Master synchronisées.")
+        lookups = self.storage.read_player_lookups()
+        self.assertEqual(lookups.api_bundle.stats_by_player['Zorglub Master'], APIBundle.Stats())
+
+    def test_overlapping_lookups(self):
+        """Verifies lookups of a guild that overlap keep each other's players."""
+        players = {
+            'Zorglub': ('Zorglub', '3', '7', 'destiny:7'),
+            'Bidule': ('Bidule', '3', '8', 'destiny:8'),
+        }
+
+        async def search_player(display_names):
+            return players[display_names[0]]
+
+        async def fetch_player(account_id, sync_states):
+            sync_states[0].players_by_account_id[account_id].character_ids.append(account_id)
+            sync_states[0].characters_by_id[account_id].date_last_played = '2020-08-12'
+            await asyncio.sleep(0.01)
+            return APIBundle.Stats()
+        self.api_fetcher.search_player_async = MagicMock(side_effect=search_player)
+        self.api_fetcher.fetch_player_async = MagicMock(side_effect=fetch_player)
+        async_storage = AsyncStorage(self.storage)
+
+        async def run():
+            return await asyncio.gather(*(
+                self.sut.lookup_player_async([name], async_storage.mutate) for name in players
+            ))
+        self.assertEqual(asyncio.run(run()), list(players))
+        lookups = self.storage.read_player_lookups()
+        self.assertEqual(set(lookups.api_bundle.stats_by_player), set(players))
+        self.assertEqual(
+            set(lookups.sync_state.players_by_account_id), {'destiny:7', 'destiny:8'}
+        )
+        self.assertEqual(set(lookups.sync_state.characters_by_id), {'destiny:7', 'destiny:8'})
+
+    def test_sync_resumes_from_checkpoint(self):
+        """Verifies the checkpoint of an interrupted sync is resumed, then deleted."""
+        checkpoint = SyncCheckpoint()
+        checkpoint.started_datetime = NOW.isoformat()
+        checkpoint.sync_state.players_by_account_id['destiny:1'].gamer_tag = 'Walnut Waffle'
+        self.storage.write_sync_checkpoint(checkpoint)
+        self.api_fetcher.fetch = MagicMock(return_value=self.storage.read_api_bundle())
+        self.execute("!cortana sync")
+        self.api_fetcher.fetch.assert_called_with(
+            NOW, SyncState(), checkpoint, self.storage.write_sync_checkpoint
+        )
+        self.assertRaises(IOError, self.storage.read_sync_checkpoint)
+
+    def test_sync_does_not_block_other_commands(self):
+        """Verifies a help intent is answered while a slow sync is still running."""
+        new_bundle = self.storage.read_api_bundle()
+        new_bundle.last_sync_datetime = NOW.isoformat()
+        sync_may_finish = asyncio.Event()
+
+        async def slow_fetch(*_):
+            await sync_may_finish.wait()
+            return new_bundle
+        self.api_fetcher.fetch_async = MagicMock(side_effect=slow_fetch)
+
+        async def run():
+            bundle = self.storage.read_api_bundle()
+            sync_intent = self.parser.parse("!cortana sync", bundle, NOW)
+            help_intent = self.parser.parse("!cortana help", bundle, NOW)
+            sync = asyncio.ensure_future(self.sut.execute_async(sync_intent, NOW))
+            await asyncio.sleep(0)
+            (help_feedback, _) = await self.sut.execute_async(help_intent, NOW)
+            self.assertFalse(sync.done())
+            self.assertTrue(help_feedback.startswith("Guide d'utilisation:"))
+            sync_may_finish.set()
+            return await sync
+
+        (feedback, images) = asyncio.run(run())
+        self.api_fetcher.fetch_async.assert_called_with(NOW, SyncState(), None, ANY)
         self.assertEqual(self.storage.read_api_bundle(), new_bundle)
         self.assertEqual(feedback, "Joueurs et niveaux d'experiences synchronisés.")
         self.assertIsNone(images)
 
+    def test_checkpoints_do_not_block_the_event_loop(self):
+        """Verifies the loop keeps running while the checkpoints of a sync are written."""
+        new_bundle = self.storage.read_api_bundle()
+        checkpoints = []
+        for gamer_tag in ['Walnut Waffle', 'Oby1Chick', 'Omega Gips']:
+            checkpoint = SyncCheckpoint()
+            checkpoint.sync_state.players_by_account_id[gamer_tag].gamer_tag = gamer_tag
+            checkpoints.append(checkpoint)
+        written_checkpoints = []
+
+        def slow_write_sync_checkpoint(checkpoint):
+            time.sleep(0.2)
+            written_checkpoints.append(checkpoint)
+        self.storage.write_sync_checkpoint = slow_write_sync_checkpoint
+
+        async def checkpointed_fetch(*args):
+            on_checkpoint = args[3]
+            for checkpoint in checkpoints:
+                started = time.monotonic()
+                on_checkpoint(checkpoint)
+                self.assertLess(time.monotonic() - started, 0.1)
+                await asyncio.sleep(0)
+            return new_bundle
+        self.api_fetcher.fetch_async = MagicMock(side_effect=checkpointed_fetch)
+        ticks = []
+
+        async def tick():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        async def run():
+            ticker = asyncio.ensure_future(tick())
+            sync_intent = self.parser.parse("!cortana sync", new_bundle, NOW)
+            (feedback, _) = await self.sut.execute_async(sync_intent, NOW)
+            ticker.cancel()
+            return feedback
+
+        self.assertEqual(asyncio.run(run()), "Joueurs et niveaux d'experiences synchronisés.")
+        self.assertEqual(written_checkpoints, [checkpoints[0], checkpoints[2]])
+        self.assertGreater(len(ticks), 10)
+        self.assertLess(max(b - a for (a, b) in zip(ticks, ticks[1:])), 0.1)
+        self.assertRaises(IOError, self.storage.read_sync_checkpoint)
+
+    def test_clan_watchlist(self):
+        """Verifies guild bundles are merged views over a shared cache of clans."""
+        bundle = self.storage.read_api_bundle()
+        gamer_tags = sorted(bundle.stats_by_player.keys())
+        bundles_by_clan = {1: APIBundle(), 2: APIBundle()}
+        for index, gamer_tag in enumerate(gamer_tags):
+            clan_bundle = bundles_by_clan[1 + index % 2]
+            clan_bundle.stats_by_player[gamer_tag].CopyFrom(bundle.stats_by_player[gamer_tag])
+            clan_bundle.last_sync_datetime = NOW.isoformat()
+        self.api_fetcher.fetch_clans = MagicMock(return_value=bundles_by_clan)
+        clan_cache = ClanCache(Path(self.storage_directory.name).joinpath('clans'))
+        self.sut = Executor(self.storage, self.api_fetcher, self.img_generator, clan_cache)
+
+        (feedback, _) = self.execute("!cortana clans")
+        self.assertEqual(feedback, "Clans suivis: 696852, 4220683, 379807, 1890420, 1907122")
+        (feedback, images) = self.execute("!cortana clans 1 2")
+        self.assertEqual(feedback, "Clans suivis: 1, 2")
+        self.assertIsNone(images)
+        self.api_fetcher.fetch_clans.assert_called_with(
+            NOW, {1: SyncState(), 2: SyncState()}, None, self.storage.write_sync_checkpoint
+        )
+        merged_bundle = self.sut.read_api_bundle()
+        self.assertEqual(sorted(merged_bundle.stats_by_player.keys()), gamer_tags)
+        self.assertEqual(merged_bundle.last_sync_datetime, NOW.isoformat())
+
+        # Another guild watching a tracked clan costs no sync.
+        other_storage = Storage(Path(self.storage_directory.name).joinpath('other'))
+        other_sut = Executor(other_storage, self.api_fetcher, self.img_generator, clan_cache)
+        self.api_fetcher.fetch_clans.reset_mock()
+        other_sut.execute(self.parser.parse("!cortana clans 2", bundle, NOW), NOW)
+        self.api_fetcher.fetch_clans.assert_not_called()
+        self.assertEqual(other_sut.read_api_bundle().stats_by_player,
+                         bundles_by_clan[2].stats_by_player)
+
+        (feedback, _) = self.execute("!cortana sync")
+        self.assertEqual(feedback, "Joueurs et niveaux d'experiences synchronisés.")
+        self.api_fetcher.fetch_clans.assert_called_with(
+            NOW, {1: SyncState(), 2: SyncState()}, None, self.storage.write_sync_checkpoint
+        )
+
+    def test_clan_watchlist_needs_clan_cache(self):
+        """Verifies the clan watchlist cannot be changed without a clan cache."""
+        self.assertRaises(ValueError, self.execute, "!cortana clans 1")
+
     def test_lastsync(self):
         """Verifies lastsync intents are properly executed."""
         (feedback, images) = self.execute("!cortana lastsync")
@@ -447,6 +682,44 @@ class ExecutorTest(unittest.TestCase):
         self.assertTrue(feedback.startswith("Activité créée"))
         self.assertIsNone(images)
 
+    def test_sqlite_storage(self):
+        """Verifies intents are executed the same way with the SQLite storage."""
+        schedule = self.storage.read_schedule()
+        database_path = Path(self.storage_directory.name).joinpath('storage.sqlite')
+        self.storage = SqliteStorage(database_path, 1)
+        self.storage.import_storage(Storage(self.storage_directory.name))
+        self.sut = Executor(self.storage, self.api_fetcher, self.img_generator)
+        self.execute("!cortana finish jds 25/08")
+        self.execute("!cortana clear calus")
+        schedule.activities[4].state = Activity.State.FINISHED
+        schedule.activities.pop(0)
+        self.storage.close()
+        self.assertEqual(SqliteStorage(database_path, 1).read_schedule(), schedule)
+
+    def test_execute_off_the_event_loop(self):
+        """Verifies intents without sync run with the given runner, e.g. an AsyncStorage."""
+        schedule = self.storage.read_schedule()
+        async_storage = AsyncStorage(self.storage)
+        bundle = self.storage.read_api_bundle()
+        intent = self.parser.parse("!cortana clear calus", bundle, NOW)
+        asyncio.run(self.sut.execute_async(intent, NOW, async_storage.mutate))
+        schedule.activities.pop(0)
+        self.assertEqual(self.storage.read_schedule(), schedule)
+
+    def test_journaled_storage(self):
+        """Verifies intents are appended to the journal, and replayed by a new storage."""
+        schedule = self.storage.read_schedule()
+        self.storage = Storage(self.storage_directory.name, Executor.apply_activity_intent)
+        self.sut = Executor(self.storage, self.api_fetcher, self.img_generator)
+        self.execute("!cortana finish jds 25/08")
+        self.execute("!cortana clear calus")
+        schedule.activities[4].state = Activity.State.FINISHED
+        schedule.activities.pop(0)
+        self.assertEqual(self.storage.journal_stats()['appends'], 2)
+        other_storage = Storage(self.storage_directory.name, Executor.apply_activity_intent)
+        self.assertEqual(other_storage.read_schedule(), schedule)
+        self.assertEqual(other_storage.journal_stats()['replays'], 2)
+
     def execute(self, message):
         """
         Helper that executes an intent from the given message, BUNDLE and NOW.
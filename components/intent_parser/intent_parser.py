@@ -53,6 +53,18 @@ INTERMEDIATE_MIN_COMPLETIONS = 6
 EXPERIENCED_MIN_COMPLETIONS = 12
 
 
+class UnknownGamerTagError(ValueError):
+    """Raised when no gamer tag of the bundle matches the words of a message."""
+
+    def __init__(self, message, words):
+        """
+        :param message: The error message.
+        :param words: The words the gamer tag was expected to start from.
+        """
+        super().__init__(message)
+        self.words = words
+
+
 class Parser:
     """Parser for user input (intents)."""
 
@@ -88,9 +100,11 @@ class Parser:
         if next_word == "infoall":
             return self.parse_infoall_intent(words)
         if next_word == "sync":
-            return self.parse_sync_intent(words)
+            return self.parse_sync_intent(words, api_bundle)
         if next_word == "lastsync":
             return self.parse_lastsync_intent(words)
+        if next_word == "clans":
+            return self.parse_clans_intent(words)
         if next_word == "images":
             return self.parse_images_intent(words)
         if next_word == "clearpast":
@@ -166,15 +180,21 @@ class Parser:
         intent.global_intent.clear_past = True
         return intent
 
-    def parse_sync_intent(self, initial_words):
+    def parse_sync_intent(self, initial_words, api_bundle):
         """
         :param initial_words: The words after !cortana sync.
-        :return: A sync intent.
-        :raises: If the words are not empty.
+        :param api_bundle: The API Bundle used to resolve gamer tags.
+        :return: A sync intent. Syncs a single player if the words are a gamer tag.
+        :raises: If the words are neither empty nor a gamer tag.
         """
-        self.assert_words_empty(initial_words)
         intent = Intent()
-        intent.global_intent.sync_bundle = True
+        words = [word for word in initial_words if word]
+        if len(words) == 0:
+            intent.global_intent.sync_bundle = True
+            return intent
+        (gamer_tag, _, words) = self.parse_gamer_tag(words, api_bundle)
+        self.assert_words_empty(words)
+        intent.global_intent.sync_player = gamer_tag
         return intent
 
     def parse_lastsync_intent(self, initial_words):
@@ -188,6 +208,23 @@ class Parser:
         intent.global_intent.get_last_bundle_sync_datetime = True
         return intent
 
+    def parse_clans_intent(self, initial_words):
+        """
+        :param initial_words: The words after !cortana clans.
+        :return: A clan watchlist intent. Updates the watchlist if the words list clan IDs.
+        :raises: If one of the words is not a clan ID.
+        """
+        intent = Intent()
+        words = [word for word in initial_words if word]
+        if len(words) == 0:
+            intent.global_intent.get_clan_watchlist = True
+            return intent
+        for word in words:
+            if not word.isdigit():
+                raise ValueError("Identifiant de clan invalide: " + word)
+            intent.global_intent.set_clan_watchlist.clan_ids.append(int(word))
+        return intent
+
     def parse_images_intent(self, initial_words):
         """
         :param initial_words: The words after !cortana images.
@@ -533,17 +570,19 @@ class Parser:
         :param initial_words: A word array
         :param api_bundle: The API Bundle used to resolve gamer tags.
         :return: (best matching gamer tag or None, add? or remove bool, the rightmost unused words).
-        :raises: If the are not in the format [gamer_tag] (noise)
+        :raises: If the are not in the format [gamer_tag] (noise). UnknownGamerTagError if no gamer
+        tag of the bundle matches the words.
         """
         if len(initial_words) == 0:
             raise ValueError("Il manque un gamer tag")
 
         query = ""
         words = initial_words.copy()
-        error = ValueError(
+        error = UnknownGamerTagError(
             "Un gamer tag aurait dû être présent à partir de \"" +
             " ".join(initial_words) +
-            "\""
+            "\"",
+            initial_words
         )
         is_add = words[0][0] != '-'
         best_gamer_tag_so_far = None
@@ -178,6 +178,18 @@ class ParserTest(unittest.TestCase):
             noise_array = list(filter(len, re.split(r"\s+", noise)))
             self.assertRaises(ValueError, self.sut.parse_gamer_tag, noise_array, SUT_BUNDLE)
 
+    def test_parse_unknown_gamer_tag(self):
+        """Verifies unknown gamer tags report the words they were expected from."""
+        with self.assertRaises(intent_parser.UnknownGamerTagError) as context:
+            self.sut.parse("!cortana sync Gardien42 demain", SUT_BUNDLE, SUT_NOW)
+        self.assertEqual(context.exception.words, ['Gardien42', 'demain'])
+        bundle = APIBundle()
+        bundle.stats_by_player['Oscar1'].stale = False
+        bundle.stats_by_player['Oscar2'].stale = False
+        with self.assertRaises(ValueError) as context:
+            self.sut.parse_gamer_tag(['Oscar'], bundle)
+        self.assertNotIsInstance(context.exception, intent_parser.UnknownGamerTagError)
+
     def test_parse_credits_intent(self):
         """Verifies credits intents can properly be parsed."""
         intent = self.sut.parse("!cortana credits", SUT_BUNDLE, SUT_NOW)
@@ -220,6 +232,14 @@ class ParserTest(unittest.TestCase):
         expectation.global_intent.sync_bundle = True
         self.assertEqual(intent, expectation)
 
+        intent = self.sut.parse("!cortana sync rayden drak", SUT_BUNDLE, SUT_NOW)
+        expectation = Intent()
+        expectation.global_intent.sync_player = 'Rayden Drakk'
+        self.assertEqual(intent, expectation)
+        self.assertRaises(
+            ValueError, self.sut.parse, "!cortana sync Rayden Drakk demain", SUT_BUNDLE, SUT_NOW
+        )
+
     def test_parse_lastsync_intent(self):
         """Verifies last sync get intents can properly be parsed."""
         intent = self.sut.parse("!cortana lastsync", SUT_BUNDLE, SUT_NOW)
@@ -227,6 +247,20 @@ class ParserTest(unittest.TestCase):
         expectation.global_intent.get_last_bundle_sync_datetime = True
         self.assertEqual(intent, expectation)
 
+    def test_parse_clans_intent(self):
+        """Verifies clan watchlist intents can properly be parsed."""
+        intent = self.sut.parse("!cortana clans", SUT_BUNDLE, SUT_NOW)
+        expectation = Intent()
+        expectation.global_intent.get_clan_watchlist = True
+        self.assertEqual(intent, expectation)
+
+        intent = self.sut.parse("!cortana clans 696852  4220683", SUT_BUNDLE, SUT_NOW)
+        expectation = Intent()
+        expectation.global_intent.set_clan_watchlist.clan_ids.extend([696852, 4220683])
+        self.assertEqual(intent, expectation)
+
+        self.assertRaises(ValueError, self.sut.parse, "!cortana clans fe11", SUT_BUNDLE, SUT_NOW)
+
     def test_parse_images_intent(self):
         """Verifies image generation intents can properly be parsed."""
         intent = self.sut.parse("!cortana images", SUT_BUNDLE, SUT_NOW)
@@ -0,0 +1,115 @@
+import asyncio
+from protos.schedule_pb2 import Schedule
+
+
+class AsyncStorage:
+    """
+    Asynchronous facade over the Storage of a guild, for the event loop of the bot.
+    Storage calls run in a thread pool instead of blocking the loop, one at a time per guild, while
+    other guilds progress in parallel. Calls wait for their turn on the event loop, not in a pool
+    thread. A command that updates the guild's protos does its whole read-modify-write in a single
+    |mutate| call, so that overlapping commands of the guild cannot lose each other's updates.
+    The schedule is read as a snapshot shared by every reader until it is written.
+    """
+
+    def __init__(self, storage, thread_pool=None):
+        """
+        :param storage: The Storage or SqliteStorage of the guild.
+        :param thread_pool: The concurrent.futures executor of the storage calls. Defaults to the
+        one of the event loop.
+        """
+        self.__storage = storage
+        self.__thread_pool = thread_pool
+        # Storages are not thread-safe: calls of the guild are run one at a time.
+        self.__lock = asyncio.Lock()
+        # Incremented by each write, so that older snapshots and reads are not kept.
+        self.__version = 0
+        # (version, schedule) of the last read or written schedule, and (version, task) of the
+        # read in flight, or None.
+        self.__snapshot = None
+        self.__snapshot_read = None
+        self.__stats = {'reads': 0, 'shared_reads': 0}
+
+    def storage(self):
+        """:return: The wrapped storage. Calls on it block the event loop."""
+        return self.__storage
+
+    def stats(self):
+        """
+        :return: A dict with the number of schedules read from the storage (reads) and of reads
+        served by a snapshot or by a read already in flight (shared_reads).
+        """
+        return dict(self.__stats)
+
+    async def run(self, function, *args):
+        """
+        Runs a call that only reads the storage in the thread pool.
+        :param function: The function to call, e.g. a method of the storage.
+        :return: What |function| returns.
+        :raises: What |function| raises.
+        """
+        async with self.__lock:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.__thread_pool, function, *args
+            )
+
+    async def mutate(self, function, *args):
+        """
+        Runs a call that may write the storage in the thread pool, and drops the shared snapshot.
+        No other call of the guild runs meanwhile, so |function| may read then write the storage.
+        :param function: The function to call, e.g. Executor.execute.
+        :return: What |function| returns.
+        :raises: What |function| raises.
+        """
+        async with self.__lock:
+            self.__version += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(
+                    self.__thread_pool, function, *args
+                )
+            finally:
+                # Reads started while the call was running may have seen the previous schedule.
+                self.__version += 1
+
+    async def read_schedule(self):
+        """
+        Reads the schedule, or reuses the snapshot of the previous read if it was not written
+        since. Concurrent reads share the same storage read.
+        :return: The schedule. Shared, must not be modified.
+        :raises: IOError if there is no schedule.
+        """
+        if self.__snapshot is not None and self.__snapshot[0] == self.__version:
+            self.__stats['shared_reads'] += 1
+            return self.__snapshot[1]
+        loop = asyncio.get_running_loop()
+        if self.__snapshot_read is not None and self.__snapshot_read[0] == self.__version and \
+                self.__snapshot_read[1].get_loop() is loop:
+            self.__stats['shared_reads'] += 1
+            read = self.__snapshot_read[1]
+        else:
+            self.__stats['reads'] += 1
+            read = loop.create_task(self.run(self.__storage.read_schedule))
+            self.__snapshot_read = (self.__version, read)
+            read.add_done_callback(self.on_snapshot_read_done)
+        return await asyncio.shield(read)
+
+    def on_snapshot_read_done(self, read):
+        """Keeps the schedule read by |read| as the snapshot, unless written meanwhile."""
+        if self.__snapshot_read is None or self.__snapshot_read[1] is not read:
+            return
+        version = self.__snapshot_read[0]
+        self.__snapshot_read = None
+        if read.cancelled() or read.exception() is not None or version != self.__version:
+            return
+        self.__snapshot = (version, read.result())
+
+    async def write_schedule(self, schedule):
+        """
+        Writes the schedule, and keeps a copy as the snapshot.
+        :param schedule: The schedule to write.
+        :raises: IOError if the schedule cannot be written.
+        """
+        await self.mutate(self.__storage.write_schedule, schedule)
+        snapshot = Schedule()
+        snapshot.CopyFrom(schedule)
+        self.__snapshot = (self.__version, snapshot)
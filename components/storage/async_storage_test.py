@@ -0,0 +1,93 @@
+import asyncio
+import tempfile
+import threading
+import time
+import unittest
+from components.storage import async_storage
+from components.storage.storage import Storage
+from protos.activity_id_pb2 import ActivityID
+from protos.schedule_pb2 import Schedule
+
+
+class AsyncStorageTest(unittest.TestCase):
+    """Test class for the asynchronous storage facade."""
+
+    def setUp(self):
+        """Sets up a basic sut."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.storage = Storage(self.directory.name)
+        self.sut = async_storage.AsyncStorage(self.storage)
+
+    def tearDown(self):
+        """Performs some cleanups at the end of each test."""
+        self.directory.cleanup()
+
+    def test_calls_run_off_the_event_loop(self):
+        """Verifies storage calls run in another thread, and their errors are raised."""
+        async def run():
+            self.assertNotEqual(await self.sut.run(threading.get_ident), threading.get_ident())
+            with self.assertRaises(IOError):
+                await self.sut.run(self.storage.read_api_bundle)
+        asyncio.run(run())
+
+    def test_shared_snapshots(self):
+        """Verifies reads of an unchanged schedule share a single storage read."""
+        async def run():
+            with self.assertRaises(IOError):
+                await self.sut.read_schedule()
+            await self.sut.write_schedule(Schedule())
+            self.assertIs(await self.sut.read_schedule(), await self.sut.read_schedule())
+            schedule = Schedule()
+            schedule.activities.add().id.type = ActivityID.Type.LAST_WISH
+            await self.sut.mutate(self.storage.write_schedule, schedule)
+            schedules = await asyncio.gather(*(self.sut.read_schedule() for _ in range(3)))
+            self.assertEqual(schedules, [schedule] * 3)
+            self.assertIs(schedules[0], schedules[2])
+            self.assertIs(await self.sut.read_schedule(), schedules[0])
+        asyncio.run(run())
+        self.assertEqual(self.sut.stats(), {'reads': 2, 'shared_reads': 5})
+
+    def test_reads_during_writes(self):
+        """Verifies reads that overlap a write are followed by reads of the written schedule."""
+        async def run():
+            await self.sut.write_schedule(Schedule())
+            schedule = Schedule()
+            schedule.activities.add().id.type = ActivityID.Type.LAST_WISH
+            written = threading.Event()
+
+            def write_schedule():
+                written.wait()
+                self.storage.write_schedule(schedule)
+
+            write = asyncio.ensure_future(self.sut.mutate(write_schedule))
+            await asyncio.sleep(0)
+            read = asyncio.ensure_future(self.sut.read_schedule())
+            await asyncio.sleep(0)
+            written.set()
+            await write
+            await read
+            self.assertEqual(await self.sut.read_schedule(), schedule)
+        asyncio.run(run())
+
+    def test_mutations_are_serialized(self):
+        """Verifies overlapping read-modify-write calls of a guild do not lose updates."""
+        def add_activity(activity_type):
+            schedule = self.storage.read_schedule()
+            time.sleep(0.01)
+            schedule.activities.add().id.type = activity_type
+            self.storage.write_schedule(schedule)
+
+        async def run():
+            await self.sut.write_schedule(Schedule())
+            await asyncio.gather(
+                self.sut.mutate(add_activity, ActivityID.Type.LAST_WISH),
+                self.sut.mutate(add_activity, ActivityID.Type.LEVIATHAN),
+                self.sut.read_schedule(),
+            )
+            self.assertEqual(len((await self.sut.read_schedule()).activities), 2)
+        asyncio.run(run())
+        self.assertEqual(len(Storage(self.directory.name).read_schedule().activities), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
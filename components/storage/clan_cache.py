@@ -0,0 +1,135 @@
+from pathlib import Path
+import threading
+from google.protobuf.message import DecodeError
+from components.storage.columnar_bundle import ColumnarBundle
+from components.storage.storage import API_BUNDLE_FILE
+from components.storage.storage import Storage
+from protos.api_bundle_pb2 import APIBundle
+
+COLUMNAR_BUNDLE_FILE = 'api_bundle.cols'
+
+
+class ClanCache:
+    """
+    Process-wide cache of the stats of each clan, shared by every guild that watches it.
+    Each clan is stored once, in its own Storage. Guild bundles are merged views over their clans.
+    Each clan is kept in memory as a ColumnarBundle mapped from a file written next to its API
+    Bundle, instead of a parsed proto, so that watching many clans costs little resident memory.
+    Guild bundles are parsed from the API Bundles of their clans on each read.
+    Called from the thread pool of the storage calls of every guild: clans are written one at a
+    time.
+    """
+
+    def __init__(self, root_directory):
+        try:
+            self.__root_path = Path(root_directory)
+            self.__root_path.mkdir(parents=True, exist_ok=True)
+        except:
+            raise IOError("Impossible d'initialiser le cache des clans.")
+        self.__bundles_by_clan = {}
+        self.__writes_lock = threading.Lock()
+
+    def storage(self, clan_id):
+        """:return: The Storage of the given clan."""
+        return Storage(self.__root_path.joinpath(str(clan_id)))
+
+    def read_clan_bundle(self, clan_id):
+        """
+        Reads the API Bundle of a clan from disk. See |read_columnar_bundle| to keep it in memory.
+        :param clan_id: The clan identifier in the form of an integer.
+        :return: The read API Bundle. A new copy, that can be modified.
+        """
+        return self.storage(clan_id).read_api_bundle()
+
+    def read_columnar_bundle(self, clan_id):
+        """
+        Maps the API Bundle of a clan, in columns. Kept mapped after the first read. Clans synced
+        before columns were written are converted from their API Bundle on their first read.
+        :param clan_id: The clan identifier in the form of an integer.
+        :return: The ColumnarBundle of the clan. Shared, must not be closed.
+        """
+        bundle = self.__bundles_by_clan.get(clan_id)
+        if bundle is not None:
+            return bundle
+        filepath = self.__root_path.joinpath(str(clan_id), COLUMNAR_BUNDLE_FILE)
+        with self.__writes_lock:
+            try:
+                bundle = ColumnarBundle(filepath)
+            except IOError:
+                ColumnarBundle.write(filepath, self.storage(clan_id).read_api_bundle())
+                bundle = ColumnarBundle(filepath)
+            return self.__bundles_by_clan.setdefault(clan_id, bundle)
+
+    def read_sync_state(self, clan_id):
+        """
+        Reads the state of the last sync of a clan.
+        :param clan_id: The clan identifier in the form of an integer.
+        :return: The read sync state.
+        """
+        return self.storage(clan_id).read_sync_state()
+
+    def write_clan(self, clan_id, api_bundle, sync_state):
+        """
+        Writes the API Bundle and the sync state of a clan.
+        :param clan_id: The clan identifier in the form of an integer.
+        :param api_bundle: The bundle to write.
+        :param sync_state: The sync state to write.
+        """
+        with self.__writes_lock:
+            storage = self.storage(clan_id)
+            storage.write_api_bundle(api_bundle)
+            filepath = self.__root_path.joinpath(str(clan_id), COLUMNAR_BUNDLE_FILE)
+            ColumnarBundle.write(filepath, api_bundle)
+            # The previous bundle stays mapped for the readers that still use it.
+            self.__bundles_by_clan[clan_id] = ColumnarBundle(filepath)
+            storage.write_sync_state(sync_state)
+
+    def missing_clans(self, clan_ids):
+        """
+        :param clan_ids: Clan identifiers in the form of integers.
+        :return: The clans among |clan_ids| that have never been synced.
+        """
+        missing_clans = []
+        for clan_id in clan_ids:
+            try:
+                self.read_columnar_bundle(clan_id)
+            except IOError:
+                missing_clans.append(clan_id)
+        return missing_clans
+
+    def synced_clans(self):
+        """:return: The clans that have been synced at least once, sorted."""
+        try:
+            clan_ids = [
+                int(path.name) for path in self.__root_path.iterdir()
+                if path.is_dir() and path.name.lstrip('-').isdigit()
+            ]
+        except OSError:
+            raise IOError("Impossible de lister le cache des clans.")
+        return sorted(set(clan_ids) - set(self.missing_clans(clan_ids)))
+
+    def read_merged_bundle(self, clan_ids):
+        """
+        Merges the API Bundles of the given clans. No Bungie request, no disk write.
+        Players listed in several clans are reported once. The sync datetime is the oldest one.
+        :param clan_ids: Clan identifiers in the form of integers.
+        :return: The merged API Bundle.
+        :raises: IOError if one of the clans has never been synced.
+        """
+        clan_ids = list(clan_ids)
+        last_sync_datetimes = [
+            self.read_columnar_bundle(clan_id).last_sync_datetime() for clan_id in clan_ids
+        ]
+        merged_bundle = APIBundle()
+        # Parsed straight into the merged bundle. Merged entries replace the previous ones: the
+        # first clan of a player is merged last.
+        for clan_id in reversed(clan_ids):
+            try:
+                merged_bundle.MergeFromString(
+                    self.__root_path.joinpath(str(clan_id), API_BUNDLE_FILE).read_bytes()
+                )
+            except (OSError, DecodeError):
+                raise IOError("Impossible de lire l'API Bundle du clan " + str(clan_id) + ".")
+        if last_sync_datetimes:
+            merged_bundle.last_sync_datetime = min(last_sync_datetimes)
+        return merged_bundle
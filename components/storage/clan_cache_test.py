@@ -0,0 +1,89 @@
+from pathlib import Path
+import tempfile
+import unittest
+from components.storage import clan_cache
+from protos.activity_id_pb2 import ActivityID
+from protos.api_bundle_pb2 import APIBundle
+from protos.sync_state_pb2 import SyncState
+
+
+def make_bundle(last_sync_datetime, completions_by_player):
+    """
+    :param last_sync_datetime: The sync datetime of the bundle.
+    :param completions_by_player: A {gamer_tag: Last Wish completions} dict.
+    :return: An API Bundle.
+    """
+    bundle = APIBundle()
+    bundle.last_sync_datetime = last_sync_datetime
+    for gamer_tag, completions in completions_by_player.items():
+        stat = bundle.stats_by_player[gamer_tag].activity_stats.add()
+        stat.activity_type = ActivityID.Type.LAST_WISH
+        stat.completions = completions
+    return bundle
+
+
+class ClanCacheTest(unittest.TestCase):
+    """Test class for the shared cache of clans."""
+
+    def setUp(self):
+        """Sets up a basic sut."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.sut = clan_cache.ClanCache(self.directory.name)
+
+    def tearDown(self):
+        """Performs some cleanups at the end of each test."""
+        self.directory.cleanup()
+
+    def test_write_then_read(self):
+        """Verifies clans are persisted across instances."""
+        bundle = make_bundle('2020-08-12T18:15:00+02:00', {'Oby1Chick': 4})
+        sync_state = SyncState()
+        sync_state.characters_by_id['21'].date_last_played = '2020-08-01T20:00:00Z'
+        self.assertEqual(self.sut.missing_clans([1, 2]), [1, 2])
+        self.assertRaises(IOError, self.sut.read_clan_bundle, 1)
+        self.sut.write_clan(1, bundle, sync_state)
+        self.assertEqual(self.sut.missing_clans([1, 2]), [2])
+        other_sut = clan_cache.ClanCache(self.directory.name)
+        self.assertEqual(other_sut.read_clan_bundle(1), bundle)
+        self.assertEqual(other_sut.read_sync_state(1), sync_state)
+        self.assertRaises(IOError, other_sut.read_sync_state, 2)
+        self.assertEqual(other_sut.synced_clans(), [1])
+        other_sut.read_clan_bundle(1).stats_by_player['croptus'].stale = True
+        self.assertEqual(other_sut.read_clan_bundle(1), bundle)
+
+    def test_clans_synced_without_columns(self):
+        """Verifies clans that only have an API Bundle are converted to columns on first read."""
+        bundle = make_bundle('2020-08-12T18:15:00+02:00', {'Oby1Chick': 4, 'croptus': 7})
+        self.sut.storage(1).write_api_bundle(bundle)
+        columns_path = Path(self.directory.name).joinpath('1', clan_cache.COLUMNAR_BUNDLE_FILE)
+        self.assertFalse(columns_path.exists())
+        columnar_bundle = self.sut.read_columnar_bundle(1)
+        self.assertEqual(columnar_bundle.completions('croptus', ActivityID.Type.LAST_WISH), 7)
+        self.assertTrue(columns_path.exists())
+        self.assertEqual(self.sut.read_merged_bundle([1]), bundle)
+        self.assertEqual(clan_cache.ClanCache(self.directory.name).read_clan_bundle(1), bundle)
+
+    def test_merged_bundle(self):
+        """Verifies merged bundles list every player once, with the oldest sync datetime."""
+        self.sut.write_clan(
+            1, make_bundle('2020-08-12T18:15:00+02:00', {'Oby1Chick': 4, 'Walnut Waffle': 2}),
+            SyncState()
+        )
+        self.sut.write_clan(
+            2, make_bundle('2020-08-11T10:00:00+02:00', {'Walnut Waffle': 1, 'croptus': 7}),
+            SyncState()
+        )
+        expectation = make_bundle(
+            '2020-08-11T10:00:00+02:00', {'Oby1Chick': 4, 'Walnut Waffle': 2, 'croptus': 7}
+        )
+        self.assertEqual(self.sut.read_merged_bundle([1, 2]), expectation)
+        self.assertEqual(
+            self.sut.read_merged_bundle([2, 1]).stats_by_player['Walnut Waffle'].activity_stats[0]
+            .completions,
+            1
+        )
+        self.assertRaises(IOError, self.sut.read_merged_bundle, [1, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,247 @@
+from array import array
+from collections import Counter
+import mmap
+import os
+from pathlib import Path
+import struct
+import sys
+from protos.api_bundle_pb2 import APIBundle
+
+MAGIC = b'CCBN'
+FORMAT_VERSION = 1
+# Magic, format version, number of players in the matrix, number of activity types (columns),
+# length of the gamer tag table, length of the serialized remainder.
+HEADER = struct.Struct('<4sIIIII')
+ALIGNMENT = 4
+
+
+def padding(length):
+    """:return: The number of bytes that align a section of |length| bytes."""
+    return -length % ALIGNMENT
+
+
+def to_little_endian(values):
+    """:return: The bytes of an array, in little-endian order."""
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class ColumnarBundle:
+    """
+    On-disk APIBundle memory-mapped for constant-time loading, instead of parsing a proto that
+    repeats every activity type of every player.
+    The bundle is stored as columns: the activity types shared by the players, a sorted table of
+    their gamer tags, their stale flags and a players × activity types matrix of completions.
+    Players whose stats do not have the shared activity types, in the shared order, are stored as
+    a serialized APIBundle remainder with the sync datetime, so that conversions are lossless.
+    """
+
+    def __init__(self, filepath):
+        """
+        :param filepath: The bundle, as written by |write|.
+        :raises: IOError if the bundle cannot be read or is not a valid bundle.
+        """
+        try:
+            with open(filepath, 'rb') as bundle_file:
+                self.__map = mmap.mmap(bundle_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            raise IOError("Impossible de lire l'API Bundle en colonnes.")
+        try:
+            (magic, format_version, players, columns, tags_length, remainder_length) = \
+                HEADER.unpack_from(self.__map, 0)
+        except struct.error:
+            (magic, format_version, players, columns, tags_length, remainder_length) = \
+                (None, 0, 0, 0, 0, 0)
+        # Activity types, gamer tag offsets, gamer tags, stale flags and completions.
+        section_sizes = [4 * columns, 4 * (players + 1), tags_length, players + padding(players),
+                         4 * players * columns]
+        section_offsets = [HEADER.size]
+        for size in section_sizes:
+            section_offsets.append(section_offsets[-1] + size)
+        if magic != MAGIC or format_version != FORMAT_VERSION or tags_length % ALIGNMENT or \
+                len(self.__map) != section_offsets[-1] + remainder_length:
+            self.__map.close()
+            raise IOError("API Bundle en colonnes invalide.")
+        self.__activity_types = self.__section(section_offsets[0], columns, 'I')
+        self.__tag_offsets = self.__section(section_offsets[1], players + 1, 'I')
+        self.__tags = self.__section(section_offsets[2], tags_length, 'B')
+        self.__stale = self.__section(section_offsets[3], players, 'B')
+        self.__completions = self.__section(section_offsets[4], players * columns, 'i')
+        # Usually empty: bundles written by the fetcher have the same activity types everywhere.
+        self.__remainder = APIBundle()
+        try:
+            self.__remainder.ParseFromString(self.__map[section_offsets[-1]:])
+        except Exception:
+            self.close()
+            raise IOError("API Bundle en colonnes invalide.")
+
+    def __section(self, offset, count, typecode):
+        """
+        :return: The |count| integers of the given array typecode at |offset|, read in place on
+        little-endian hosts.
+        """
+        view = memoryview(self.__map)[offset:offset + count * array(typecode).itemsize]
+        view = view.cast(typecode)
+        if sys.byteorder == 'little' or typecode == 'B':
+            return view
+        values = array(typecode, view)
+        values.byteswap()
+        view.release()
+        return values
+
+    @staticmethod
+    def write(filepath, api_bundle):
+        """
+        Converts an APIBundle and writes it atomically, so that readers see the old or new bundle
+        only.
+        :param filepath: Where to write the bundle.
+        :param api_bundle: The APIBundle to write.
+        :raises: IOError if the bundle cannot be written.
+        """
+        if not isinstance(api_bundle, APIBundle):
+            raise ValueError("L'API Bundle à écrire est invalide.")
+        layouts = Counter(
+            tuple(stat.activity_type for stat in stats.activity_stats)
+            for stats in api_bundle.stats_by_player.values()
+        )
+        activity_types = layouts.most_common(1)[0][0] if layouts else ()
+        if len(set(activity_types)) != len(activity_types):
+            activity_types = ()
+        remainder = APIBundle()
+        remainder.last_sync_datetime = api_bundle.last_sync_datetime
+        gamer_tags = []
+        for gamer_tag, stats in api_bundle.stats_by_player.items():
+            layout = tuple(stat.activity_type for stat in stats.activity_stats)
+            if layout == activity_types:
+                gamer_tags.append(gamer_tag.encode('utf-8'))
+            else:
+                remainder.stats_by_player[gamer_tag].CopyFrom(stats)
+        gamer_tags.sort()
+        tag_offsets = array('I', [0])
+        stale = bytearray()
+        completions = array('i')
+        for gamer_tag in gamer_tags:
+            tag_offsets.append(tag_offsets[-1] + len(gamer_tag))
+            stats = api_bundle.stats_by_player[gamer_tag.decode('utf-8')]
+            stale.append(stats.stale)
+            completions.extend(stat.completions for stat in stats.activity_stats)
+        tags = b''.join(gamer_tags)
+        tags += b'\0' * padding(len(tags))
+        stale += b'\0' * padding(len(stale))
+        serialized_remainder = remainder.SerializeToString()
+        header = HEADER.pack(MAGIC, FORMAT_VERSION, len(gamer_tags), len(activity_types),
+                             len(tags), len(serialized_remainder))
+        filepath = Path(filepath)
+        temporary_filepath = filepath.with_name(filepath.name + '.tmp')
+        try:
+            filepath.parent.mkdir(parents=True, exist_ok=True)
+            temporary_filepath.write_bytes(b''.join([
+                header, to_little_endian(array('I', activity_types)),
+                to_little_endian(tag_offsets), tags, bytes(stale), to_little_endian(completions),
+                serialized_remainder,
+            ]))
+            os.replace(temporary_filepath, filepath)
+        except OSError:
+            raise IOError("Impossible d'écrire l'API Bundle en colonnes.")
+
+    def __len__(self):
+        return len(self.__stale) + len(self.__remainder.stats_by_player)
+
+    def __contains__(self, gamer_tag):
+        return self.__row(gamer_tag) is not None or gamer_tag in self.__remainder.stats_by_player
+
+    def __gamer_tag_bytes(self, row):
+        """:return: The encoded gamer tag of a row of the matrix."""
+        return self.__tags[self.__tag_offsets[row]:self.__tag_offsets[row + 1]].tobytes()
+
+    def __row(self, gamer_tag):
+        """:return: The row of the player in the matrix, or None. A binary search on the tags."""
+        encoded_gamer_tag = gamer_tag.encode('utf-8')
+        (low, high) = (0, len(self.__stale))
+        while low < high:
+            middle = (low + high) // 2
+            if self.__gamer_tag_bytes(middle) < encoded_gamer_tag:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.__stale) and self.__gamer_tag_bytes(low) == encoded_gamer_tag:
+            return low
+        return None
+
+    def last_sync_datetime(self):
+        """:return: The datetime of the sync of the bundle, in ISO format."""
+        return self.__remainder.last_sync_datetime
+
+    def gamer_tags(self):
+        """:return: An iterator on the gamer tags of every player."""
+        for row in range(len(self.__stale)):
+            yield self.__gamer_tag_bytes(row).decode('utf-8')
+        yield from self.__remainder.stats_by_player.keys()
+
+
+    def completions(self, gamer_tag, activity_type, default=None):
+        """
+        :param gamer_tag: The gamer tag of a player.
+        :param activity_type: An ActivityID.Type.
+        :param default: Returned for unknown players or activity types.
+        :return: The completions of the activity by the player.
+        """
+        row = self.__row(gamer_tag)
+        if row is None:
+            stats = self.__remainder.stats_by_player.get(gamer_tag)
+            if stats is None:
+                return default
+            return next((stat.completions for stat in stats.activity_stats
+                         if stat.activity_type == activity_type), default)
+        columns = len(self.__activity_types)
+        for column in range(columns):
+            if self.__activity_types[column] == activity_type:
+                return self.__completions[row * columns + column]
+        return default
+
+    def get(self, gamer_tag, default=None):
+        """
+        :param gamer_tag: The gamer tag of a player.
+        :param default: Returned for unknown players.
+        :return: The APIBundle.Stats of the player.
+        """
+        row = self.__row(gamer_tag)
+        if row is None:
+            stats = self.__remainder.stats_by_player.get(gamer_tag)
+            if stats is None:
+                return default
+            copy = APIBundle.Stats()
+            copy.CopyFrom(stats)
+            return copy
+        stats = APIBundle.Stats()
+        self.__fill_stats(stats, row)
+        return stats
+
+    def __fill_stats(self, stats, row):
+        """Sets the stats of a row of the matrix to |stats|."""
+        stats.stale = bool(self.__stale[row])
+        columns = len(self.__activity_types)
+        offset = row * columns
+        for column in range(columns):
+            stat = stats.activity_stats.add()
+            stat.activity_type = self.__activity_types[column]
+            stat.completions = self.__completions[offset + column]
+
+    def to_api_bundle(self):
+        """:return: The APIBundle the bundle was written from."""
+        bundle = APIBundle()
+        bundle.CopyFrom(self.__remainder)
+        for row in range(len(self.__stale)):
+            gamer_tag = self.__gamer_tag_bytes(row).decode('utf-8')
+            self.__fill_stats(bundle.stats_by_player[gamer_tag], row)
+        return bundle
+
+    def close(self):
+        """Unmaps the bundle."""
+        for section in [self.__activity_types, self.__tag_offsets, self.__tags, self.__stale,
+                        self.__completions]:
+            if isinstance(section, memoryview):
+                section.release()
+        self.__map.close()
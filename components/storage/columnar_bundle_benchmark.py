@@ -0,0 +1,127 @@
+"""
+Benchmark of the reads of the clan cache: the API Bundle of a clan parsed from its proto and kept
+in memory, as the clan cache used to, against the memory-mapped columnar bundle it keeps now.
+Reports the time to load a clan into the cache, to look up a player and to merge the clan into a
+guild bundle, and the resident memory added by the load.
+Usage: columnar_bundle_benchmark [players] [repetitions]
+"""
+import gc
+import os
+from pathlib import Path
+import random
+import sys
+import tempfile
+import time
+from components.api_fetcher.completions_matrix import CompletionsMatrix
+from components.api_fetcher.completions_matrix import new_completions_row
+from components.storage.clan_cache import ClanCache
+from protos.activity_id_pb2 import ActivityID
+from protos.api_bundle_pb2 import APIBundle
+from protos.sync_state_pb2 import SyncState
+
+DEFAULT_PLAYERS = 5000
+DEFAULT_REPETITIONS = 5
+CLAN_ID = 1
+
+
+def generate_bundle(player_count):
+    """:return: An APIBundle shaped like the fetcher's, with every activity type per player."""
+    generator = random.Random(42)
+    activity_types = [t for t in ActivityID.Type.values() if t != ActivityID.Type.UNKNOWN]
+    matrix = CompletionsMatrix(activity_types)
+    for player in range(player_count):
+        completions = new_completions_row()
+        for activity_type in generator.sample(activity_types, generator.randint(0, 5)):
+            completions[activity_type] = generator.randint(1, 200)
+        matrix.add('Player#' + str(player), completions, stale=generator.random() < 0.05)
+    api_bundle = matrix.to_api_bundle()
+    api_bundle.last_sync_datetime = '2020-08-12T18:15:00+02:00'
+    return api_bundle
+
+
+def resident_bytes():
+    """:return: The resident memory of the process, in bytes. Linux only, 0 elsewhere."""
+    try:
+        statm = Path('/proc/self/statm').read_text(encoding='ascii')
+        return int(statm.split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def load_proto(directory):
+    """:return: The API Bundle of the clan, parsed from its proto like the clan cache used to."""
+    return ClanCache(directory).storage(CLAN_ID).read_api_bundle()
+
+
+def load_columns(directory):
+    """:return: A new clan cache, with the clan mapped."""
+    clan_cache = ClanCache(directory)
+    clan_cache.read_columnar_bundle(CLAN_ID)
+    return clan_cache
+
+
+def merge_proto(api_bundle):
+    """Merges the clan into a guild bundle, like the clan cache used to."""
+    merged_bundle = APIBundle()
+    for gamer_tag, stats in api_bundle.stats_by_player.items():
+        merged_bundle.stats_by_player[gamer_tag].CopyFrom(stats)
+
+
+def measure(load, lookup, merge, directory, repetitions):
+    """
+    :return: A (best load time, best lookup time, best merge time, most resident bytes added by a
+    load) tuple, in seconds and bytes.
+    """
+    timings = ([], [], [])
+    resident = 0
+    for _ in range(repetitions):
+        gc.collect()
+        resident_before = resident_bytes()
+        start = time.perf_counter()
+        loaded_bundle = load(directory)
+        timings[0].append(time.perf_counter() - start)
+        resident = max(resident, resident_bytes() - resident_before)
+        start = time.perf_counter()
+        lookup(loaded_bundle)
+        timings[1].append(time.perf_counter() - start)
+        start = time.perf_counter()
+        merge(loaded_bundle)
+        timings[2].append(time.perf_counter() - start)
+        del loaded_bundle
+    return tuple(min(timing) for timing in timings) + (resident,)
+
+
+def report(name, measures):
+    """Prints the measures of a way to read the clan cache."""
+    (load, lookup, merge, resident) = measures
+    print(f"{name} : chargement {load * 1000:.2f} ms, recherche {lookup * 1000:.3f} ms, "
+          f"fusion {merge * 1000:.1f} ms, RSS +{resident // 1024} Ko")
+
+
+def main():
+    """Runs the benchmark with the players and repetitions given on the command line."""
+    player_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PLAYERS
+    repetitions = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_REPETITIONS
+    api_bundle = generate_bundle(player_count)
+    gamer_tag = 'Player#' + str(player_count // 2)
+    with tempfile.TemporaryDirectory() as directory:
+        ClanCache(directory).write_clan(CLAN_ID, api_bundle, SyncState())
+        columns = load_columns(directory)
+        if columns.read_columnar_bundle(CLAN_ID).to_api_bundle() != api_bundle or \
+                columns.read_merged_bundle([CLAN_ID]) != api_bundle:
+            raise AssertionError("La conversion en colonnes n'est pas sans perte.")
+        proto = measure(
+            load_proto, lambda b: b.stats_by_player[gamer_tag], merge_proto, directory,
+            repetitions
+        )
+        columns = measure(
+            load_columns, lambda c: c.read_columnar_bundle(CLAN_ID).get(gamer_tag),
+            lambda c: c.read_merged_bundle([CLAN_ID]), directory, repetitions
+        )
+    print(f"{player_count} joueurs")
+    report("proto", proto)
+    report("colonnes", columns)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+from pathlib import Path
+import tempfile
+import unittest
+from components.storage import columnar_bundle
+from protos.activity_id_pb2 import ActivityID
+from protos.api_bundle_pb2 import APIBundle
+
+ACTIVITY_TYPES = (
+    ActivityID.Type.LEVIATHAN, ActivityID.Type.LAST_WISH, ActivityID.Type.GARDEN_OF_SALVATION
+)
+
+
+def add_player(bundle, gamer_tag, completions, activity_types=ACTIVITY_TYPES, stale=False):
+    """Adds the stats of a player to |bundle|, like the fetcher does."""
+    stats = bundle.stats_by_player[gamer_tag]
+    stats.stale = stale
+    for activity_type, activity_completions in zip(activity_types, completions):
+        stat = stats.activity_stats.add()
+        stat.activity_type = activity_type
+        stat.completions = activity_completions
+
+
+class ColumnarBundleTest(unittest.TestCase):
+    """Test class for the memory-mapped columnar API Bundle."""
+
+    def setUp(self):
+        """Sets up a directory for the bundle."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.filepath = Path(self.directory.name).joinpath('api_bundle.cols')
+
+    def tearDown(self):
+        """Performs some cleanups at the end of each test."""
+        self.directory.cleanup()
+
+    def test_write_then_read(self):
+        """Verifies the stats of every player are read back, and unknown ones are not."""
+        bundle = APIBundle()
+        bundle.last_sync_datetime = '2020-08-12T18:15:00+02:00'
+        add_player(bundle, 'Oby1Chick', [12, 0, 3])
+        add_player(bundle, 'Walnut Waffle', [0, 42, 7], stale=True)
+        add_player(bundle, 'Élodie', [1, 2, 2**31 - 1])
+        for player in range(100):
+            add_player(bundle, 'Player' + str(player), [player, 2 * player, 0])
+        columnar_bundle.ColumnarBundle.write(self.filepath, bundle)
+        sut = columnar_bundle.ColumnarBundle(self.filepath)
+        self.assertEqual(len(sut), 103)
+        self.assertEqual(sut.last_sync_datetime(), '2020-08-12T18:15:00+02:00')
+        self.assertEqual(sorted(sut.gamer_tags()), sorted(bundle.stats_by_player.keys()))
+        for gamer_tag, stats in bundle.stats_by_player.items():
+            self.assertIn(gamer_tag, sut)
+            self.assertEqual(sut.get(gamer_tag), stats)
+        self.assertEqual(sut.completions('Walnut Waffle', ActivityID.Type.LAST_WISH), 42)
+        self.assertEqual(sut.completions('Élodie', ActivityID.Type.GARDEN_OF_SALVATION), 2**31 - 1)
+        self.assertIsNone(sut.completions('Oby1Chick', ActivityID.Type.CROWN_OF_SORROW))
+        self.assertNotIn('croptus', sut)
+        self.assertNotIn('Player', sut)
+        self.assertIsNone(sut.get('croptus'))
+        self.assertEqual(sut.completions('croptus', ActivityID.Type.LAST_WISH, 0), 0)
+        self.assertEqual(sut.to_api_bundle(), bundle)
+        sut.close()
+
+    def test_irregular_players(self):
+        """Verifies players without the shared activity types are converted losslessly."""
+        bundle = APIBundle()
+        add_player(bundle, 'Oby1Chick', [12, 0, 3])
+        add_player(bundle, 'Walnut Waffle', [0, 42, 7])
+        add_player(bundle, 'croptus', [5], [ActivityID.Type.LAST_WISH], stale=True)
+        add_player(bundle, 'Cosa58', [1, 2, 3], list(reversed(ACTIVITY_TYPES)))
+        add_player(bundle, 'Hartog31', [1, 2], [ActivityID.Type.LAST_WISH] * 2)
+        add_player(bundle, 'Batman', [], [])
+        columnar_bundle.ColumnarBundle.write(self.filepath, bundle)
+        sut = columnar_bundle.ColumnarBundle(self.filepath)
+        self.assertEqual(len(sut), 6)
+        for gamer_tag, stats in bundle.stats_by_player.items():
+            self.assertEqual(sut.get(gamer_tag), stats)
+        self.assertEqual(sut.completions('croptus', ActivityID.Type.LAST_WISH), 5)
+        self.assertEqual(sut.completions('Cosa58', ActivityID.Type.LEVIATHAN), 3)
+        self.assertEqual(sut.to_api_bundle(), bundle)
+        sut.close()
+
+    def test_empty_bundle(self):
+        """Verifies an empty bundle is valid."""
+        columnar_bundle.ColumnarBundle.write(self.filepath, APIBundle())
+        sut = columnar_bundle.ColumnarBundle(self.filepath)
+        self.assertEqual(len(sut), 0)
+        self.assertEqual(list(sut.gamer_tags()), [])
+        self.assertEqual(sut.to_api_bundle(), APIBundle())
+        sut.close()
+
+    def test_rewrite(self):
+        """Verifies a bundle can be replaced while the previous one is mapped."""
+        bundle = APIBundle()
+        add_player(bundle, 'Oby1Chick', [12, 0, 3])
+        columnar_bundle.ColumnarBundle.write(self.filepath, bundle)
+        previous = columnar_bundle.ColumnarBundle(self.filepath)
+        columnar_bundle.ColumnarBundle.write(self.filepath, APIBundle())
+        sut = columnar_bundle.ColumnarBundle(self.filepath)
+        self.assertEqual(previous.to_api_bundle(), bundle)
+        self.assertEqual(len(sut), 0)
+        previous.close()
+        sut.close()
+
+    def test_invalid_bundle(self):
+        """Verifies missing and corrupted bundles are rejected."""
+        self.assertRaises(IOError, columnar_bundle.ColumnarBundle, self.filepath)
+        self.filepath.write_bytes(b'')
+        self.assertRaises(IOError, columnar_bundle.ColumnarBundle, self.filepath)
+        bundle = APIBundle()
+        add_player(bundle, 'Oby1Chick', [12, 0, 3])
+        columnar_bundle.ColumnarBundle.write(self.filepath, bundle)
+        data = self.filepath.read_bytes()
+        self.filepath.write_bytes(data[:-4])
+        self.assertRaises(IOError, columnar_bundle.ColumnarBundle, self.filepath)
+        self.filepath.write_bytes(b'XXXX' + data[4:])
+        self.assertRaises(IOError, columnar_bundle.ColumnarBundle, self.filepath)
+        self.assertRaises(ValueError, columnar_bundle.ColumnarBundle.write, self.filepath, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
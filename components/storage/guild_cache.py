@@ -0,0 +1,158 @@
+from collections import OrderedDict
+from pathlib import Path
+import weakref
+from components.storage.async_storage import AsyncStorage
+from components.storage.sqlite_storage import read_clan_watchlists
+from components.storage.sqlite_storage import SqliteStorage
+from components.storage.storage import Storage
+
+# Guilds whose Storage is kept in memory. The least recently used ones are evicted first.
+MAX_CACHED_GUILDS = 64
+
+
+class StorageBackend:
+    """Where and how the storages of the guilds are opened: as files, or in a SQLite database."""
+
+    def __init__(self, root_directory, database_path=None, apply_intent=None, journaled=True):
+        """
+        :param root_directory: The directory of the guild storages, one subdirectory per guild.
+        :param database_path: Optional SQLite database. If set, guilds are stored in it with a
+        SqliteStorage instead of files.
+        :param apply_intent: Optional function that applies an ActivityIntent to a schedule. If
+        set, the schedules of file storages are journaled. See Storage.
+        :param journaled: If false, |apply_intent| is only used to fold the journals left by a
+        previous run into the schedule files. See Storage.
+        """
+        self.__root_path = Path(root_directory)
+        self.__database_path = database_path
+        self.__apply_intent = apply_intent
+        self.__journaled = journaled
+
+    def open(self, guild_id):
+        """
+        :param guild_id: The Discord identifier of the guild.
+        :return: A new Storage or SqliteStorage of the guild.
+        """
+        if self.__database_path is not None:
+            return SqliteStorage(self.__database_path, guild_id)
+        return Storage(
+            self.__root_path.joinpath(str(guild_id)), self.__apply_intent, self.__journaled
+        )
+
+    def clan_watchlists(self):
+        """
+        Reads the clan watchlists of every guild. Safe to call from any thread.
+        :return: The ClanWatchlist of each guild, or None for the guilds without one.
+        :raises: IOError if the guilds cannot be listed.
+        """
+        if self.__database_path is not None:
+            return list(read_clan_watchlists(self.__database_path).values())
+        try:
+            guild_paths = [
+                path for path in self.__root_path.iterdir()
+                if path.is_dir() and path.name.isdigit()
+            ]
+        except OSError:
+            raise IOError("Impossible de lister les serveurs.")
+        clan_watchlists = []
+        for guild_path in guild_paths:
+            try:
+                clan_watchlists.append(Storage(guild_path).read_clan_watchlist())
+            except IOError:
+                clan_watchlists.append(None)
+        return clan_watchlists
+
+
+class GuildCache:
+    """
+    Process-wide cache of the Storage of each guild, so that the protos parsed for a command are
+    reused by the next ones. Idle guilds are evicted and read from disk again when they come back.
+    Also the registry of the AsyncStorage of each guild, with its asyncio.Lock.
+    A guild evicted while a command still uses its storages gets them back on its next call: there
+    is never more than one Storage, journal or lock per guild.
+    """
+
+    def __init__(self, backend, max_guilds=MAX_CACHED_GUILDS):
+        """
+        :param backend: The StorageBackend that opens the storages of the guilds.
+        :param max_guilds: The number of guilds to keep in memory.
+        """
+        if not isinstance(backend, StorageBackend):
+            raise ValueError("Stockage des serveurs invalide")
+        if max_guilds <= 0:
+            raise ValueError("Nombre de serveurs en cache invalide")
+        self.__backend = backend
+        self.__max_guilds = max_guilds
+        self.__storages_by_guild = OrderedDict()
+        self.__async_storages_by_guild = {}
+        # Every storage still referenced, cached or not, so that evicted guilds in use are revived
+        # instead of being opened a second time.
+        self.__live_storages_by_guild = weakref.WeakValueDictionary()
+        self.__live_async_storages_by_guild = weakref.WeakValueDictionary()
+        self.__evictions = 0
+
+    def storage(self, guild_id):
+        """
+        :param guild_id: The Discord identifier of the guild.
+        :return: The Storage of the guild.
+        """
+        storage = self.__storages_by_guild.get(guild_id)
+        if storage is not None:
+            self.__storages_by_guild.move_to_end(guild_id)
+            return storage
+        storage = self.__live_storages_by_guild.get(guild_id)
+        if storage is None:
+            storage = self.__backend.open(guild_id)
+            self.__live_storages_by_guild[guild_id] = storage
+        self.__storages_by_guild[guild_id] = storage
+        if len(self.__storages_by_guild) > self.__max_guilds:
+            # Not closed: a running command may still use it. Connections close once unreferenced.
+            (evicted_guild_id, _) = self.__storages_by_guild.popitem(last=False)
+            self.__async_storages_by_guild.pop(evicted_guild_id, None)
+            self.__evictions += 1
+        return storage
+
+    def async_storage(self, guild_id):
+        """
+        :param guild_id: The Discord identifier of the guild.
+        :return: The AsyncStorage of the guild, over its cached Storage.
+        """
+        storage = self.storage(guild_id)
+        async_storage = self.__async_storages_by_guild.get(guild_id)
+        if async_storage is not None:
+            return async_storage
+        async_storage = self.__live_async_storages_by_guild.get(guild_id)
+        if async_storage is None:
+            async_storage = AsyncStorage(storage)
+            self.__live_async_storages_by_guild[guild_id] = async_storage
+        self.__async_storages_by_guild[guild_id] = async_storage
+        return async_storage
+
+    def watched_clan_ids(self, default_clan_ids):
+        """
+        Reads the clan watchlists of every guild, cached or not, from the storage. Safe to call
+        from another thread than the cached storages.
+        :param default_clan_ids: The clans watched by the guilds without a watchlist.
+        :return: The set of the clans on the watchlist of at least one guild.
+        :raises: IOError if the guilds cannot be listed.
+        """
+        clan_ids = set()
+        for clan_watchlist in self.__backend.clan_watchlists():
+            if clan_watchlist is None or not clan_watchlist.clan_ids:
+                clan_ids.update(default_clan_ids)
+            else:
+                clan_ids.update(clan_watchlist.clan_ids)
+        return clan_ids
+
+    def stats(self):
+        """
+        :return: A dict with the number of cached guilds (guilds), of evicted ones (evictions), and
+        the cumulated reads served from memory (hits) and files parsed (parses) of cached guilds.
+        """
+        stats = {'guilds': len(self.__storages_by_guild), 'evictions': self.__evictions,
+                 'hits': 0, 'parses': 0}
+        for storage in self.__storages_by_guild.values():
+            storage_stats = storage.stats()
+            stats['hits'] += storage_stats['hits']
+            stats['parses'] += storage_stats['parses']
+        return stats
@@ -0,0 +1,85 @@
+import gc
+from pathlib import Path
+import tempfile
+import unittest
+import weakref
+from components.storage import guild_cache
+from protos.clan_watchlist_pb2 import ClanWatchlist
+from protos.schedule_pb2 import Schedule
+
+
+class GuildCacheTest(unittest.TestCase):
+    """Test class for the shared cache of guild storages."""
+
+    def setUp(self):
+        """Sets up a basic sut."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.backend = guild_cache.StorageBackend(self.directory.name)
+        self.sut = guild_cache.GuildCache(self.backend, max_guilds=2)
+
+    def tearDown(self):
+        """Performs some cleanups at the end of each test."""
+        self.directory.cleanup()
+
+    def test_least_recently_used_guilds_are_evicted(self):
+        """Verifies storages are reused until their guild is the least recently used one."""
+        storage1 = self.sut.storage(1)
+        storage1.write_schedule(Schedule())
+        storage2 = weakref.ref(self.sut.storage(2))
+        self.assertIs(self.sut.storage(1), storage1)
+        self.sut.storage(1).read_schedule()
+        self.sut.storage(3)
+        self.assertIs(self.sut.storage(1), storage1)
+        gc.collect()
+        self.assertIsNone(storage2())
+        self.sut.storage(2)
+        self.assertEqual(
+            self.sut.stats(), {'guilds': 2, 'evictions': 2, 'hits': 1, 'parses': 0}
+        )
+        self.assertEqual(guild_cache.GuildCache(self.backend).storage(1).read_schedule(),
+                         Schedule())
+
+    def test_guild_locks(self):
+        """Verifies a guild keeps its storages and lock across evictions while a command runs."""
+        async_storage1 = self.sut.async_storage(1)
+        self.assertIs(self.sut.async_storage(1), async_storage1)
+        self.assertIs(async_storage1.storage(), self.sut.storage(1))
+        self.assertIsNot(self.sut.async_storage(2), async_storage1)
+        self.sut.storage(3)
+        self.sut.storage(4)
+        self.assertEqual(self.sut.stats()['guilds'], 2)
+        self.assertIs(self.sut.async_storage(1), async_storage1)
+        self.assertIs(self.sut.storage(1), async_storage1.storage())
+
+    def test_evicted_storages_in_use_are_not_duplicated(self):
+        """Verifies a guild evicted while its storage is in use gets it back, and only then."""
+        storage1 = self.sut.storage(1)
+        storage2 = weakref.ref(self.sut.storage(2))
+        self.sut.storage(3)
+        self.sut.storage(4)
+        gc.collect()
+        self.assertIsNone(storage2())
+        self.assertIs(self.sut.storage(1), storage1)
+        self.assertEqual(self.sut.stats()['guilds'], 2)
+
+    def test_watched_clan_ids(self):
+        """Verifies the clans watched by every guild are listed, with defaults, in both backends."""
+        clan_watchlist = ClanWatchlist()
+        clan_watchlist.clan_ids.extend([1, 2])
+        database_path = Path(self.directory.name).joinpath('storage.sqlite')
+        sqlite_backend = guild_cache.StorageBackend(self.directory.name, database_path)
+        for sut in [self.sut, guild_cache.GuildCache(sqlite_backend)]:
+            self.assertEqual(sut.watched_clan_ids([7]), set())
+            sut.storage(10).write_clan_watchlist(clan_watchlist)
+            self.assertEqual(sut.watched_clan_ids([7]), {1, 2})
+            sut.storage(11).write_schedule(Schedule())
+            self.assertEqual(sut.watched_clan_ids([7]), {1, 2, 7})
+
+    def test_invalid_configuration(self):
+        """Verifies invalid configurations are rejected."""
+        self.assertRaises(ValueError, guild_cache.GuildCache, self.backend, 0)
+        self.assertRaises(ValueError, guild_cache.GuildCache, self.directory.name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,353 @@
+import os
+from pathlib import Path
+import struct
+import threading
+import zlib
+from protos.intent_pb2 import ActivityIntent
+from protos.schedule_pb2 import Schedule
+
+SNAPSHOT_FILE = Path('schedule.snapshot')
+JOURNAL_FILE_PREFIX = 'schedule.journal.'
+SNAPSHOT_MAGIC = b'CSNP'
+# Magic, first journal generation not included in the snapshot.
+SNAPSHOT_HEADER = struct.Struct('<4sI')
+# Length and CRC32 of the serialized ActivityIntent that follows.
+RECORD_HEADER = struct.Struct('<II')
+# The journal is compacted into a new snapshot once it is larger than that.
+COMPACTION_THRESHOLD_BYTES = 16 * 1024
+
+
+def fsync_directory(directory):
+    """Makes the renames and deletions in |directory| durable, where the platform allows it."""
+    try:
+        descriptor = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(descriptor)
+    except OSError:
+        pass
+    finally:
+        os.close(descriptor)
+
+
+class JournalFiles:
+    """
+    Files of a journaled schedule in the directory of a guild: the snapshot, the journals numbered
+    by generation and the optional legacy schedule file. Also tracks the generation of appended
+    intents, the first generation not included in the snapshot, and the state of the files when
+    last read, to detect outside writes. Not thread-safe: ScheduleJournal calls it with its lock.
+    """
+
+    def __init__(self, root_directory, legacy_schedule_file=None):
+        """
+        :param root_directory: The directory of the guild.
+        :param legacy_schedule_file: Optional schedule written as a whole, used as the first
+        snapshot when there is none yet.
+        """
+        self.root_path = Path(root_directory)
+        self.__legacy_schedule_file = legacy_schedule_file
+        self.generation = 0
+        self.snapshot_generation = 0
+        self.__state = None
+
+    def snapshot_path(self):
+        """:return: The path of the snapshot."""
+        return self.root_path.joinpath(SNAPSHOT_FILE)
+
+    def legacy_path(self):
+        """:return: The path of the legacy schedule file, or None if there is none."""
+        if self.__legacy_schedule_file is None:
+            return None
+        return self.root_path.joinpath(self.__legacy_schedule_file)
+
+    def journal_path(self, generation):
+        """:return: The path of the journal of the given generation."""
+        return self.root_path.joinpath(JOURNAL_FILE_PREFIX + str(generation))
+
+    def journal_generations(self):
+        """:return: The generations of the journals on disk, sorted."""
+        return sorted(
+            int(path.name[len(JOURNAL_FILE_PREFIX):]) for path in self.root_path.iterdir()
+            if path.name.startswith(JOURNAL_FILE_PREFIX)
+            and path.name[len(JOURNAL_FILE_PREFIX):].isdigit()
+        )
+
+    def __read_state(self):
+        """:return: The sizes and modification times of the files."""
+        paths = [self.snapshot_path()]
+        if self.legacy_path() is not None:
+            paths.append(self.legacy_path())
+        paths.extend(map(self.journal_path, self.journal_generations()))
+        state = []
+        for path in paths:
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            state.append((path.name, stat.st_mtime_ns, stat.st_size))
+        return tuple(state)
+
+    def remember_state(self):
+        """Records the current state of the files, after reading or writing them."""
+        self.__state = self.__read_state()
+
+    def changed(self):
+        """:return: Whether the files were written elsewhere since |remember_state|."""
+        return self.__state != self.__read_state()
+
+    def read_snapshot(self):
+        """
+        :return: A (schedule, first generation not included) tuple.
+        :raises: IOError if there is no snapshot nor legacy schedule.
+        """
+        snapshot_path = self.snapshot_path()
+        schedule = Schedule()
+        if snapshot_path.exists():
+            data = snapshot_path.read_bytes()
+            (magic, generation) = SNAPSHOT_HEADER.unpack_from(data)
+            if magic != SNAPSHOT_MAGIC:
+                raise IOError("Instantané du planning invalide.")
+            schedule.ParseFromString(data[SNAPSHOT_HEADER.size:])
+            return schedule, generation
+        if self.legacy_path() is None:
+            raise IOError("Aucun planning.")
+        schedule.ParseFromString(self.legacy_path().read_bytes())
+        return schedule, 0
+
+
+class ScheduleJournal:
+    """
+    Schedule of a guild stored as a snapshot plus an append-only journal of the ActivityIntents
+    applied since. A change costs a small append and an fsync instead of rewriting the schedule.
+    Journals are numbered by generation. A snapshot records the first generation it does not
+    include, and is written to a temporary file then renamed, so that a crash at any point leaves
+    either the old or the new snapshot with the journals it needs: no intent is lost or replayed
+    twice. A torn record at the end of the journal is an interrupted append, and is dropped.
+    Once the journal passes a size threshold, new appends go to the next generation while the
+    snapshot is written in a background thread.
+    """
+
+    def __init__(self, root_directory, apply_intent, legacy_schedule_file=None,
+                 compaction_threshold_bytes=COMPACTION_THRESHOLD_BYTES):
+        """
+        :param root_directory: The directory of the guild.
+        :param apply_intent: Function (schedule, ActivityIntent) that applies an intent to a
+        schedule in place, without side effect. Used to replay the journal.
+        :param legacy_schedule_file: Optional schedule written as a whole, used as the first
+        snapshot when there is none yet.
+        :param compaction_threshold_bytes: The journal size that triggers a compaction.
+        """
+        self.__files = JournalFiles(root_directory, legacy_schedule_file)
+        self.__apply_intent = apply_intent
+        self.__compaction_threshold_bytes = compaction_threshold_bytes
+        self.__lock = threading.Lock()
+        self.__compaction = None
+        # The current schedule, None until loaded.
+        self.__schedule = None
+        self.__stats = {'appends': 0, 'replays': 0, 'compactions': 0}
+
+    def stats(self):
+        """
+        :return: A dict with the number of appended intents (appends), of intents replayed when
+        loading the journal (replays) and of snapshots written by compactions (compactions).
+        """
+        return dict(self.__stats)
+
+    def __replay(self, schedule, generation, is_last):
+        """
+        Applies the intents of a journal to |schedule|. A torn record at the end of the last
+        journal is truncated, so that the next appends follow the last complete one.
+        :raises: IOError if the journal is corrupted.
+        """
+        path = self.__files.journal_path(generation)
+        data = path.read_bytes()
+        offset = 0
+        while offset < len(data):
+            if offset + RECORD_HEADER.size <= len(data):
+                (length, checksum) = RECORD_HEADER.unpack_from(data, offset)
+                record = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+                if len(record) == length and zlib.crc32(record) == checksum:
+                    activity_intent = ActivityIntent()
+                    activity_intent.ParseFromString(record)
+                    self.__apply_intent(schedule, activity_intent)
+                    self.__stats['replays'] += 1
+                    offset += RECORD_HEADER.size + length
+                    continue
+            if not is_last:
+                raise IOError("Journal du planning corrompu.")
+            with open(path, 'r+b') as journal_file:
+                journal_file.truncate(offset)
+                os.fsync(journal_file.fileno())
+            break
+
+    def __load(self):
+        """Reads the snapshot and replays the journals written since. Called with the lock."""
+        (schedule, snapshot_generation) = self.__files.read_snapshot()
+        generations = [g for g in self.__files.journal_generations() if g >= snapshot_generation]
+        for (index, generation) in enumerate(generations):
+            self.__replay(schedule, generation, index == len(generations) - 1)
+        self.__schedule = schedule
+        self.__files.snapshot_generation = snapshot_generation
+        self.__files.generation = max(
+            generations + [snapshot_generation, self.__files.generation]
+        )
+        self.__files.remember_state()
+
+    def __loaded_schedule(self):
+        """:return: The current schedule, read again if modified elsewhere. Called with the lock."""
+        if self.__schedule is None or self.__files.changed():
+            self.__load()
+        return self.__schedule
+
+    def read_schedule(self):
+        """
+        :return: A copy of the current schedule, that the caller may modify.
+        :raises: IOError if there is no schedule, or if it cannot be read.
+        """
+        with self.__lock:
+            schedule = Schedule()
+            schedule.CopyFrom(self.__loaded_schedule())
+        return schedule
+
+    def append(self, activity_intent, schedule):
+        """
+        Appends an intent to the journal, and starts a compaction if the journal is too large.
+        :param activity_intent: The ActivityIntent that was applied.
+        :param schedule: The schedule with the intent applied, kept as the current schedule.
+        :raises: IOError if the journal cannot be written.
+        """
+        record = activity_intent.SerializeToString()
+        with self.__lock:
+            self.__loaded_schedule()
+            path = self.__files.journal_path(self.__files.generation)
+            with open(path, 'ab') as journal_file:
+                journal_file.write(RECORD_HEADER.pack(len(record), zlib.crc32(record)) + record)
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+                journal_size = journal_file.tell()
+            self.__schedule = Schedule()
+            self.__schedule.CopyFrom(schedule)
+            self.__files.remember_state()
+            self.__stats['appends'] += 1
+            if journal_size > self.__compaction_threshold_bytes and \
+                    (self.__compaction is None or not self.__compaction.is_alive()):
+                self.__start_compaction()
+
+    def __start_compaction(self):
+        """
+        Moves the appends to the next generation, and writes the current schedule as the snapshot
+        of the previous ones in a background thread. Called with the lock.
+        """
+        self.__files.generation += 1
+        schedule = Schedule()
+        schedule.CopyFrom(self.__schedule)
+        self.__compaction = threading.Thread(
+            target=self.__compact, args=(schedule, self.__files.generation), daemon=True
+        )
+        self.__compaction.start()
+
+    def __compact(self, schedule, generation):
+        """Background part of |__start_compaction|. Failures are retried at the next append."""
+        try:
+            self.write_snapshot(schedule, generation)
+            self.__stats['compactions'] += 1
+        except (IOError, OSError) as e:
+            print("Échec de la compaction du journal du planning: " + str(e))
+
+    def write_snapshot(self, schedule, generation):
+        """
+        Writes |schedule| as the snapshot of the journals older than |generation|, then deletes
+        them. Ignored if a newer snapshot was written meanwhile.
+        :raises: IOError if the snapshot cannot be written.
+        """
+        temporary_path = self.__files.root_path.joinpath(f'{SNAPSHOT_FILE}.{generation}.tmp')
+        try:
+            with open(temporary_path, 'wb') as snapshot_file:
+                snapshot_file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, generation))
+                snapshot_file.write(schedule.SerializeToString())
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            with self.__lock:
+                if generation <= self.__files.snapshot_generation:
+                    temporary_path.unlink()
+                    return
+                os.replace(temporary_path, self.__files.snapshot_path())
+                fsync_directory(self.__files.root_path)
+                self.__files.snapshot_generation = generation
+                for old_generation in self.__files.journal_generations():
+                    if old_generation < generation:
+                        self.__files.journal_path(old_generation).unlink()
+                self.__files.remember_state()
+        except OSError:
+            raise IOError("Impossible d'écrire l'instantané du planning.")
+
+    def write_schedule(self, schedule):
+        """
+        Replaces the whole schedule, e.g. when clearing it, with a new snapshot.
+        :param schedule: The new schedule.
+        :raises: IOError if the snapshot cannot be written.
+        """
+        with self.__lock:
+            try:
+                self.__loaded_schedule()
+            except (IOError, OSError, ValueError):
+                # No schedule yet, or an unreadable one that is replaced.
+                self.__files.generation = max(
+                    [self.__files.generation] + self.__files.journal_generations()
+                )
+            self.__files.generation += 1
+            generation = self.__files.generation
+        self.write_snapshot(schedule, generation)
+        with self.__lock:
+            self.__schedule = Schedule()
+            self.__schedule.CopyFrom(schedule)
+            self.__files.remember_state()
+
+    def has_files(self):
+        """:return: Whether a snapshot or a journal of the schedule is on disk."""
+        return self.__files.snapshot_path().exists() or \
+            bool(self.__files.journal_generations())
+
+    def fold(self):
+        """
+        Writes the current schedule to the legacy schedule file as a whole, then deletes the
+        snapshot and the journals, e.g. when the schedule stops being journaled. The legacy file
+        is replaced atomically before any deletion, so that a crash at any point loses nothing.
+        :raises: IOError if there is no legacy schedule file, or if the schedule cannot be read or
+        written.
+        """
+        legacy_path = self.__files.legacy_path()
+        if legacy_path is None:
+            raise IOError("Aucun fichier de planning où replier le journal.")
+        self.wait_for_compaction()
+        with self.__lock:
+            schedule = self.__loaded_schedule()
+            temporary_path = legacy_path.with_name(legacy_path.name + '.tmp')
+            try:
+                with open(temporary_path, 'wb') as schedule_file:
+                    schedule_file.write(schedule.SerializeToString())
+                    schedule_file.flush()
+                    os.fsync(schedule_file.fileno())
+                os.replace(temporary_path, legacy_path)
+                fsync_directory(self.__files.root_path)
+                self.__files.snapshot_path().unlink(missing_ok=True)
+                for generation in self.__files.journal_generations():
+                    self.__files.journal_path(generation).unlink()
+                fsync_directory(self.__files.root_path)
+            except OSError:
+                raise IOError("Impossible de replier le journal du planning.")
+            finally:
+                self.__schedule = None
+
+    def wait_for_compaction(self):
+        """Waits for the running compaction, if any."""
+        compaction = self.__compaction
+        if compaction is not None:
+            compaction.join()
+
+    def forget(self):
+        """Waits for the running compaction and drops the schedule kept in memory."""
+        self.wait_for_compaction()
+        with self.__lock:
+            self.__schedule = None
@@ -0,0 +1,144 @@
+from pathlib import Path
+import tempfile
+import unittest
+from components.storage import schedule_journal
+from protos.activity_id_pb2 import ActivityID
+from protos.intent_pb2 import ActivityIntent
+from protos.schedule_pb2 import Schedule
+
+
+def apply_intent(schedule, activity_intent):
+    """Test double of Executor.apply_activity_intent: adds or clears an activity by type."""
+    if activity_intent.clear:
+        activity = next(a for a in schedule.activities if a.id == activity_intent.activity_id)
+        schedule.activities.remove(activity)
+    else:
+        schedule.activities.add().id.CopyFrom(activity_intent.activity_id)
+
+
+def make_intent(activity_type, clear=False):
+    """:return: An ActivityIntent that adds or clears an activity of the given type."""
+    activity_intent = ActivityIntent()
+    activity_intent.activity_id.type = activity_type
+    if clear:
+        activity_intent.clear = True
+    else:
+        activity_intent.upsert_squad.SetInParent()
+    return activity_intent
+
+
+class ScheduleJournalTest(unittest.TestCase):
+    """Test class for the journaled schedule."""
+
+    def setUp(self):
+        """Sets up a basic sut."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.root_path = Path(self.directory.name)
+        self.sut = self.make_sut()
+
+    def tearDown(self):
+        """Performs some cleanups at the end of each test."""
+        self.sut.wait_for_compaction()
+        self.directory.cleanup()
+
+    def make_sut(self, compaction_threshold_bytes=schedule_journal.COMPACTION_THRESHOLD_BYTES):
+        """:return: A journal over the test directory."""
+        return schedule_journal.ScheduleJournal(
+            self.root_path, apply_intent, Path('schedule.dat'), compaction_threshold_bytes
+        )
+
+    def append(self, sut, activity_intent):
+        """Applies then appends |activity_intent|, like the executor does."""
+        schedule = sut.read_schedule()
+        apply_intent(schedule, activity_intent)
+        sut.append(activity_intent, schedule)
+        return schedule
+
+    def test_append_then_replay(self):
+        """Verifies appended intents are replayed on top of the snapshot."""
+        self.assertRaises(IOError, self.sut.read_schedule)
+        self.sut.write_schedule(Schedule())
+        self.append(self.sut, make_intent(ActivityID.Type.LAST_WISH))
+        self.append(self.sut, make_intent(ActivityID.Type.LEVIATHAN))
+        schedule = self.append(self.sut, make_intent(ActivityID.Type.LAST_WISH, clear=True))
+        self.assertEqual(self.sut.read_schedule(), schedule)
+        other_sut = self.make_sut()
+        self.assertEqual(other_sut.read_schedule(), schedule)
+        self.assertEqual(other_sut.stats()['replays'], 3)
+        other_sut.write_schedule(Schedule())
+        self.assertEqual(self.make_sut().read_schedule(), Schedule())
+        self.assertEqual(self.sut.read_schedule(), Schedule())
+
+    def test_legacy_schedule(self):
+        """Verifies a schedule written as a whole is the first snapshot."""
+        schedule = Schedule()
+        schedule.activities.add().id.type = ActivityID.Type.GARDEN_OF_SALVATION
+        self.root_path.joinpath('schedule.dat').write_bytes(schedule.SerializeToString())
+        self.assertEqual(self.sut.read_schedule(), schedule)
+        schedule = self.append(self.sut, make_intent(ActivityID.Type.LAST_WISH))
+        self.assertEqual(self.make_sut().read_schedule(), schedule)
+
+    def test_fold(self):
+        """Verifies folding writes the schedule file as a whole and deletes the journal files."""
+        self.assertFalse(self.sut.has_files())
+        self.sut.write_schedule(Schedule())
+        schedule = self.append(self.sut, make_intent(ActivityID.Type.LAST_WISH))
+        self.assertTrue(self.sut.has_files())
+        self.sut.fold()
+        self.assertFalse(self.sut.has_files())
+        self.assertEqual([path.name for path in self.root_path.iterdir()], ['schedule.dat'])
+        read_schedule = Schedule()
+        read_schedule.ParseFromString(self.root_path.joinpath('schedule.dat').read_bytes())
+        self.assertEqual(read_schedule, schedule)
+        self.assertEqual(self.sut.read_schedule(), schedule)
+        without_legacy_file = schedule_journal.ScheduleJournal(self.root_path, apply_intent)
+        self.assertRaises(IOError, without_legacy_file.fold)
+
+    def test_torn_record(self):
+        """Verifies an interrupted append is dropped, and the next appends are kept."""
+        self.sut.write_schedule(Schedule())
+        schedule = self.append(self.sut, make_intent(ActivityID.Type.LAST_WISH))
+        journal_path = next(self.root_path.glob(schedule_journal.JOURNAL_FILE_PREFIX + '*'))
+        with open(journal_path, 'ab') as journal_file:
+            journal_file.write(schedule_journal.RECORD_HEADER.pack(100, 0) + b'torn')
+        other_sut = self.make_sut()
+        self.assertEqual(other_sut.read_schedule(), schedule)
+        schedule = self.append(other_sut, make_intent(ActivityID.Type.LEVIATHAN))
+        self.assertEqual(self.make_sut().read_schedule(), schedule)
+
+    def test_compaction(self):
+        """Verifies large journals are compacted in the background, without losing intents."""
+        self.sut = self.make_sut(compaction_threshold_bytes=50)
+        self.sut.write_schedule(Schedule())
+        for _ in range(20):
+            schedule = self.append(self.sut, make_intent(ActivityID.Type.LAST_WISH))
+            self.sut.wait_for_compaction()
+        self.assertGreater(self.sut.stats()['compactions'], 0)
+        self.assertLessEqual(
+            len(list(self.root_path.glob(schedule_journal.JOURNAL_FILE_PREFIX + '*'))), 1
+        )
+        other_sut = self.make_sut()
+        self.assertEqual(other_sut.read_schedule(), schedule)
+        self.assertLess(other_sut.stats()['replays'], 5)
+
+    def test_crash_before_journal_deletion(self):
+        """Verifies journals included in the snapshot are not replayed twice."""
+        # Past the threshold on the second append only.
+        self.sut = self.make_sut(compaction_threshold_bytes=20)
+        self.sut.write_schedule(Schedule())
+        self.append(self.sut, make_intent(ActivityID.Type.LAST_WISH))
+        self.assertEqual(self.sut.stats()['compactions'], 0)
+        journals = {
+            path: path.read_bytes()
+            for path in self.root_path.glob(schedule_journal.JOURNAL_FILE_PREFIX + '*')
+        }
+        schedule = self.append(self.sut, make_intent(ActivityID.Type.LEVIATHAN))
+        self.sut.wait_for_compaction()
+        self.assertEqual(self.sut.stats()['compactions'], 1)
+        for (path, data) in journals.items():
+            path.write_bytes(data)
+        self.assertEqual(self.make_sut().read_schedule(), schedule)
+
+
+if __name__ == '__main__':
+    unittest.main()
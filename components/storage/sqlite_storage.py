@@ -0,0 +1,608 @@
+from contextlib import contextmanager
+from difflib import SequenceMatcher
+from pathlib import Path
+import sqlite3
+from components.storage.storage import Storage
+from protos.activity_pb2 import Activity
+from protos.api_bundle_pb2 import APIBundle
+from protos.clan_watchlist_pb2 import ClanWatchlist
+from protos.schedule_pb2 import Schedule
+from protos.sync_state_pb2 import PlayerLookups
+from protos.sync_state_pb2 import SyncCheckpoint
+from protos.sync_state_pb2 import SyncState
+
+API_BUNDLE_NAME = 'api_bundle'
+SYNC_STATE_NAME = 'sync_state'
+SYNC_CHECKPOINT_NAME = 'sync_checkpoint'
+PLAYER_LOOKUPS_NAME = 'player_lookups'
+CLAN_WATCHLIST_NAME = 'clan_watchlist'
+SCHEDULE_NAME = 'schedule'
+# Seconds to wait for a write lock held by another connection.
+LOCK_TIMEOUT_SECONDS = 10
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS guild_versions (
+    guild_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS protos (
+    guild_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (guild_id, name)
+);
+CREATE TABLE IF NOT EXISTS schedules (
+    guild_id INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS activities (
+    activity_id INTEGER PRIMARY KEY,
+    guild_id INTEGER NOT NULL,
+    position REAL NOT NULL,
+    type INTEGER NOT NULL,
+    datetime TEXT NOT NULL,
+    time_specified INTEGER NOT NULL,
+    state INTEGER NOT NULL,
+    milestone TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS activities_by_guild ON activities (guild_id, position);
+CREATE TABLE IF NOT EXISTS squad_members (
+    activity_id INTEGER NOT NULL REFERENCES activities (activity_id) ON DELETE CASCADE,
+    substitute INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    gamer_tag TEXT NOT NULL,
+    rating INTEGER NOT NULL,
+    PRIMARY KEY (activity_id, substitute, position)
+);
+"""
+
+
+def activity_values(activity):
+    """
+    :param activity: An Activity.
+    :return: An (activity columns, squad member rows) tuple with the values stored for
+    |activity|. Equal values mean equal activities.
+    """
+    columns = (activity.id.type, activity.id.when.datetime, int(activity.id.when.time_specified),
+               activity.state, activity.milestone)
+    members = tuple(
+        (substitute, position, player.gamer_tag, player.rating)
+        for (substitute, players) in enumerate((activity.squad.players,
+                                                activity.squad.substitutes))
+        for (position, player) in enumerate(players)
+    )
+    return columns, members
+
+
+def activity_from_values(values):
+    """
+    :param values: The stored values of an activity. See |activity_values|.
+    :return: The Activity.
+    """
+    ((activity_type, datetime, time_specified, state, milestone), members) = values
+    activity = Activity()
+    activity.id.type = activity_type
+    if datetime or time_specified:
+        activity.id.when.datetime = datetime
+        activity.id.when.time_specified = bool(time_specified)
+    activity.state = state
+    activity.milestone = milestone
+    for (substitute, _, gamer_tag, rating) in members:
+        player = activity.squad.substitutes.add() if substitute else activity.squad.players.add()
+        player.gamer_tag = gamer_tag
+        player.rating = rating
+    return activity
+
+
+class SqliteStorage:
+    """
+    Storage of the protos of a guild in a SQLite database shared by every guild.
+    Schedules are stored as indexed rows, one per activity and per squad member, so that writing
+    a schedule only touches the activities that changed, in a single transaction.
+    Other protos are stored serialized, one row each.
+    Read protos and the activity rows of the schedule are kept in memory until another connection
+    modifies the guild: each write bumps the version of its guild, so that writes to other guilds
+    of the database keep the cache.
+    """
+
+    def __init__(self, database_path, guild_id):
+        """
+        :param database_path: The SQLite database, created if missing.
+        :param guild_id: The Discord identifier of the guild.
+        """
+        try:
+            Path(database_path).parent.mkdir(parents=True, exist_ok=True)
+            # Used from the thread pool of AsyncStorage, one call at a time.
+            self.__connection = sqlite3.connect(
+                database_path, timeout=LOCK_TIMEOUT_SECONDS, isolation_level=None,
+                check_same_thread=False
+            )
+            # Commits stay atomic, but the last ones may be lost on power failure, like the
+            # unsynced writes of the file storage.
+            self.__connection.execute('PRAGMA journal_mode = WAL')
+            self.__connection.execute('PRAGMA synchronous = NORMAL')
+            self.__connection.execute('PRAGMA foreign_keys = ON')
+            self.__connection.executescript(SCHEMA)
+            self.__guild_id = int(guild_id)
+            self.__data_version = self.__read_data_version()
+            self.__guild_version = self.__read_guild_version()
+        except (OSError, sqlite3.Error):
+            raise IOError("Impossible d'initialiser le stockage.")
+        # {name: parsed proto}, valid while the version of the guild is unchanged.
+        self.__messages_by_name = {}
+        # The [(activity row ID, position, stored values)] rows of the schedule, in order, or None
+        # if they must be read again. Valid while the version of the guild is unchanged.
+        self.__activity_rows = None
+        self.__stats = {'hits': 0, 'parses': 0}
+
+    def stats(self):
+        """
+        :return: A dict with the number of reads served from memory (hits), of protos read from
+        the database (parses) and of rows changed through this storage (row_changes).
+        """
+        return dict(self.__stats, row_changes=self.__connection.total_changes)
+
+    def close(self):
+        """Closes the connection to the database."""
+        self.__connection.close()
+
+    @contextmanager
+    def __transaction(self):
+        """
+        Runs the block in a write transaction of the guild, rolled back on error. The transaction
+        bumps the version of the guild.
+        """
+        self.__connection.execute('BEGIN IMMEDIATE')
+        try:
+            self.__check_cache()
+            self.__connection.execute(
+                'INSERT INTO guild_versions (guild_id, version) VALUES (?, 1) '
+                'ON CONFLICT (guild_id) DO UPDATE SET version = version + 1',
+                (self.__guild_id,)
+            )
+            yield self.__connection
+            guild_version = self.__read_guild_version()
+        except:
+            self.__connection.execute('ROLLBACK')
+            raise
+        self.__connection.execute('COMMIT')
+        self.__guild_version = guild_version
+
+    def __read_data_version(self):
+        """:return: The data version of the database, changed by commits of other connections."""
+        return self.__connection.execute('PRAGMA data_version').fetchone()[0]
+
+    def __read_guild_version(self):
+        """:return: The version of the guild, bumped by each write to the guild."""
+        row = self.__connection.execute(
+            'SELECT version FROM guild_versions WHERE guild_id = ?', (self.__guild_id,)
+        ).fetchone()
+        return row[0] if row is not None else 0
+
+    def __check_cache(self):
+        """Drops what is kept in memory if another connection modified the guild."""
+        data_version = self.__read_data_version()
+        if data_version == self.__data_version:
+            return
+        # Another connection modified the database, maybe another guild only.
+        self.__data_version = data_version
+        guild_version = self.__read_guild_version()
+        if guild_version != self.__guild_version:
+            self.__messages_by_name.clear()
+            self.__activity_rows = None
+            self.__guild_version = guild_version
+
+    def __cached_message(self, name):
+        """
+        :param name: The name of a proto.
+        :return: A copy of the proto kept in memory, or None if it must be read again.
+        """
+        self.__check_cache()
+        cached_message = self.__messages_by_name.get(name)
+        if cached_message is None:
+            return None
+        self.__stats['hits'] += 1
+        message = type(cached_message)()
+        message.CopyFrom(cached_message)
+        return message
+
+    def __cache_message(self, name, message):
+        """Keeps a copy of |message| in memory."""
+        cached_message = type(message)()
+        cached_message.CopyFrom(message)
+        self.__messages_by_name[name] = cached_message
+
+    def __read_message(self, name, message_class, error_message):
+        """
+        Reads a serialized proto from the database, or from memory.
+        :param name: The name of the proto.
+        :param message_class: The class of the proto.
+        :param error_message: The message of the IOError raised on failure.
+        :return: A copy of the read proto, that the caller may modify.
+        """
+        try:
+            message = self.__cached_message(name)
+            if message is not None:
+                return message
+            row = self.__connection.execute(
+                'SELECT data FROM protos WHERE guild_id = ? AND name = ?', (self.__guild_id, name)
+            ).fetchone()
+            message = message_class()
+            message.ParseFromString(row[0])
+            self.__stats['parses'] += 1
+            self.__cache_message(name, message)
+        except:
+            self.__messages_by_name.pop(name, None)
+            raise IOError(error_message)
+        return message
+
+    def __write_message(self, name, message, error_message):
+        """
+        Writes a serialized proto to the database and keeps a copy in memory.
+        :param name: The name of the proto.
+        :param message: The proto to write.
+        :param error_message: The message of the IOError raised on failure.
+        """
+        try:
+            with self.__transaction() as connection:
+                connection.execute(
+                    'INSERT OR REPLACE INTO protos (guild_id, name, data) VALUES (?, ?, ?)',
+                    (self.__guild_id, name, message.SerializeToString())
+                )
+            self.__cache_message(name, message)
+        except:
+            self.__messages_by_name.pop(name, None)
+            raise IOError(error_message)
+
+    def is_empty(self):
+        """:return: Whether nothing has been written for the guild."""
+        try:
+            row = self.__connection.execute(
+                'SELECT EXISTS (SELECT 1 FROM protos WHERE guild_id = ?) '
+                'OR EXISTS (SELECT 1 FROM schedules WHERE guild_id = ?)',
+                (self.__guild_id, self.__guild_id)
+            ).fetchone()
+        except sqlite3.Error:
+            raise IOError("Impossible de lire le stockage.")
+        return not row[0]
+
+    def clear(self):
+        """Deletes everything written for the guild."""
+        try:
+            with self.__transaction() as connection:
+                for table in ('protos', 'schedules', 'activities'):
+                    connection.execute(
+                        f'DELETE FROM {table} WHERE guild_id = ?', (self.__guild_id,)
+                    )
+            self.__messages_by_name.clear()
+            self.__activity_rows = None
+        except sqlite3.Error:
+            raise IOError("Impossible d'effacer le stockage.")
+
+    def import_storage(self, storage):
+        """
+        Copies every proto of a file Storage, e.g. to migrate a guild from its .dat files.
+        :param storage: The Storage of the guild.
+        """
+        assert isinstance(storage, Storage), "Stockage non configuré"
+        for name in (API_BUNDLE_NAME, SYNC_STATE_NAME, SYNC_CHECKPOINT_NAME, PLAYER_LOOKUPS_NAME,
+                     CLAN_WATCHLIST_NAME, SCHEDULE_NAME):
+            try:
+                message = getattr(storage, 'read_' + name)()
+            except IOError:
+                continue
+            getattr(self, 'write_' + name)(message)
+
+    def read_api_bundle(self):
+        """
+        Reads the API Bundle that is saved to the storage.
+        :return: The read API Bundle.
+        """
+        return self.__read_message(
+            API_BUNDLE_NAME, APIBundle, "Impossible de lire l'API Bundle du stockage."
+        )
+
+    def write_api_bundle(self, api_bundle):
+        """
+        Writes the given API Bundle to the storage.
+        :param api_bundle: The bundle to write.
+        """
+        if not isinstance(api_bundle, APIBundle):
+            raise ValueError("L'API Bundle à écrire est invalide.")
+        self.__write_message(
+            API_BUNDLE_NAME, api_bundle, "Impossible d'écrire l'API Bundle dans le stockage."
+        )
+
+    def read_sync_state(self):
+        """
+        Reads the state of the last sync that is saved to the storage.
+        :return: The read sync state.
+        """
+        return self.__read_message(
+            SYNC_STATE_NAME, SyncState, "Impossible de lire l'état de synchronisation du stockage."
+        )
+
+    def write_sync_state(self, sync_state):
+        """
+        Writes the given sync state to the storage.
+        :param sync_state: The sync state to write.
+        """
+        if not isinstance(sync_state, SyncState):
+            raise ValueError("L'état de synchronisation à écrire est invalide.")
+        self.__write_message(
+            SYNC_STATE_NAME, sync_state,
+            "Impossible d'écrire l'état de synchronisation dans le stockage."
+        )
+
+    def read_sync_checkpoint(self):
+        """
+        Reads the checkpoint of the interrupted sync that is saved to the storage.
+        :return: The read sync checkpoint.
+        """
+        return self.__read_message(
+            SYNC_CHECKPOINT_NAME, SyncCheckpoint,
+            "Impossible de lire le point de reprise de synchronisation du stockage."
+        )
+
+    def write_sync_checkpoint(self, checkpoint):
+        """
+        Writes the given sync checkpoint to the storage.
+        :param checkpoint: The sync checkpoint to write.
+        """
+        if not isinstance(checkpoint, SyncCheckpoint):
+            raise ValueError("Le point de reprise de synchronisation à écrire est invalide.")
+        self.__write_message(
+            SYNC_CHECKPOINT_NAME, checkpoint,
+            "Impossible d'écrire le point de reprise de synchronisation dans le stockage."
+        )
+
+    def delete_sync_checkpoint(self):
+        """Deletes the sync checkpoint from the storage, if any."""
+        try:
+            self.__messages_by_name.pop(SYNC_CHECKPOINT_NAME, None)
+            with self.__transaction() as connection:
+                connection.execute(
+                    'DELETE FROM protos WHERE guild_id = ? AND name = ?',
+                    (self.__guild_id, SYNC_CHECKPOINT_NAME)
+                )
+        except sqlite3.Error:
+            raise IOError(
+                "Impossible d'effacer le point de reprise de synchronisation du stockage."
+            )
+
+    def read_player_lookups(self):
+        """
+        Reads the players looked up on demand that are saved to the storage.
+        :return: The read player lookups.
+        """
+        return self.__read_message(
+            PLAYER_LOOKUPS_NAME, PlayerLookups,
+            "Impossible de lire les joueurs recherchés du stockage."
+        )
+
+    def write_player_lookups(self, lookups):
+        """
+        Writes the given player lookups to the storage.
+        :param lookups: The player lookups to write.
+        """
+        if not isinstance(lookups, PlayerLookups):
+            raise ValueError("Les joueurs recherchés à écrire sont invalides.")
+        self.__write_message(
+            PLAYER_LOOKUPS_NAME, lookups,
+            "Impossible d'écrire les joueurs recherchés dans le stockage."
+        )
+
+    def read_clan_watchlist(self):
+        """
+        Reads the clan watchlist that is saved to the storage.
+        :return: The read clan watchlist.
+        """
+        return self.__read_message(
+            CLAN_WATCHLIST_NAME, ClanWatchlist, "Impossible de lire la liste des clans du stockage."
+        )
+
+    def write_clan_watchlist(self, clan_watchlist):
+        """
+        Writes the given clan watchlist to the storage.
+        :param clan_watchlist: The clan watchlist to write.
+        """
+        if not isinstance(clan_watchlist, ClanWatchlist):
+            raise ValueError("La liste des clans à écrire est invalide.")
+        self.__write_message(
+            CLAN_WATCHLIST_NAME, clan_watchlist,
+            "Impossible d'écrire la liste des clans dans le stockage."
+        )
+
+    def __read_activity_rows(self, connection):
+        """
+        :param connection: The connection to read with.
+        :return: A [(activity row ID, position, stored values)] list of the schedule, in order.
+        See |activity_values|. Kept in memory until the guild is modified by another connection.
+        """
+        if self.__activity_rows is not None:
+            return self.__activity_rows
+        members_by_activity = {}
+        for (activity_id, *member) in connection.execute(
+                'SELECT m.activity_id, m.substitute, m.position, m.gamer_tag, m.rating '
+                'FROM squad_members m JOIN activities a USING (activity_id) '
+                'WHERE a.guild_id = ? ORDER BY m.activity_id, m.substitute, m.position',
+                (self.__guild_id,)):
+            members_by_activity.setdefault(activity_id, []).append(tuple(member))
+        self.__activity_rows = [
+            (activity_id, position,
+             (tuple(columns), tuple(members_by_activity.get(activity_id, ()))))
+            for (activity_id, position, *columns) in connection.execute(
+                'SELECT activity_id, position, type, datetime, time_specified, state, milestone '
+                'FROM activities WHERE guild_id = ? ORDER BY position',
+                (self.__guild_id,))
+        ]
+        return self.__activity_rows
+
+    def __insert_activity(self, connection, position, values):
+        """
+        Inserts the rows of an activity and of its squad members at |position|.
+        :return: The row ID of the activity.
+        """
+        (columns, members) = values
+        activity_id = connection.execute(
+            'INSERT INTO activities '
+            '(guild_id, position, type, datetime, time_specified, state, milestone) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (self.__guild_id, position, *columns)
+        ).lastrowid
+        self.__insert_members(connection, activity_id, members)
+        return activity_id
+
+    def __insert_members(self, connection, activity_id, members):
+        """Inserts the squad member rows of an activity."""
+        connection.executemany(
+            'INSERT INTO squad_members (activity_id, substitute, position, gamer_tag, rating) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [(activity_id, *member) for member in members]
+        )
+
+    def __update_activity(self, connection, activity_id, previous_values, values):
+        """Updates the row of an activity, and its squad member rows if the squad changed."""
+        (columns, members) = values
+        if columns != previous_values[0]:
+            connection.execute(
+                'UPDATE activities SET type = ?, datetime = ?, time_specified = ?, state = ?, '
+                'milestone = ? WHERE activity_id = ?',
+                (*columns, activity_id)
+            )
+        if members != previous_values[1]:
+            connection.execute('DELETE FROM squad_members WHERE activity_id = ?', (activity_id,))
+            self.__insert_members(connection, activity_id, members)
+
+    def read_schedule(self):
+        """
+        Reads the schedule that is saved to the storage.
+        :return: The read schedule.
+        """
+        try:
+            schedule = self.__cached_message(SCHEDULE_NAME)
+            if schedule is not None:
+                return schedule
+            if self.__connection.execute(
+                    'SELECT 1 FROM schedules WHERE guild_id = ?', (self.__guild_id,)
+            ).fetchone() is None:
+                raise IOError()
+            schedule = Schedule()
+            schedule.activities.extend(
+                activity_from_values(values)
+                for (_, _, values) in self.__read_activity_rows(self.__connection)
+            )
+            self.__stats['parses'] += 1
+            self.__cache_message(SCHEDULE_NAME, schedule)
+        except:
+            self.__messages_by_name.pop(SCHEDULE_NAME, None)
+            self.__activity_rows = None
+            raise IOError("Impossible de lire le planning du stockage.")
+        return schedule
+
+    def write_schedule(self, schedule):
+        """
+        Writes the given schedule to the storage. Only the activities that differ from the saved
+        schedule are written: finishing or clearing an activity touches a single row. The saved
+        schedule is the one kept in memory, unless another connection modified the guild.
+        :param schedule: The schedule to write.
+        """
+        if not isinstance(schedule, Schedule):
+            raise ValueError("Le planning à écrire est invalide.")
+        try:
+            with self.__transaction() as connection:
+                connection.execute(
+                    'INSERT OR IGNORE INTO schedules (guild_id) VALUES (?)', (self.__guild_id,)
+                )
+                rows = self.__read_activity_rows(connection)
+                new_values = [activity_values(activity) for activity in schedule.activities]
+                new_rows = []
+                matcher = SequenceMatcher(
+                    None, [values for (_, _, values) in rows], new_values, autojunk=False
+                )
+                for (tag, i1, i2, j1, j2) in matcher.get_opcodes():
+                    if tag == 'equal':
+                        new_rows.extend(rows[i1:i2])
+                        continue
+                    updates = min(i2 - i1, j2 - j1) if tag == 'replace' else 0
+                    for k in range(updates):
+                        (activity_id, position, previous_values) = rows[i1 + k]
+                        self.__update_activity(
+                            connection, activity_id, previous_values, new_values[j1 + k]
+                        )
+                        new_rows.append((activity_id, position, new_values[j1 + k]))
+                    connection.executemany(
+                        'DELETE FROM activities WHERE activity_id = ?',
+                        [(rows[i][0],) for i in range(i1 + updates, i2)]
+                    )
+                    # New activities are placed between their neighbours.
+                    insertions = new_values[j1 + updates:j2]
+                    low = rows[i1 + updates - 1][1] if i1 + updates > 0 else 0.0
+                    high = rows[i2][1] if i2 < len(rows) else low + len(insertions) + 1
+                    for (k, values) in enumerate(insertions):
+                        position = low + (high - low) * (k + 1) / (len(insertions) + 1)
+                        activity_id = self.__insert_activity(connection, position, values)
+                        new_rows.append((activity_id, position, values))
+            self.__activity_rows = new_rows
+            self.__cache_message(SCHEDULE_NAME, schedule)
+        except:
+            self.__messages_by_name.pop(SCHEDULE_NAME, None)
+            self.__activity_rows = None
+            raise IOError("Impossible d'écrire le planning dans le stockage.")
+
+
+def read_clan_watchlists(database_path):
+    """
+    :param database_path: The SQLite database.
+    :return: A {guild ID: ClanWatchlist} dict with every guild of the database. The watchlist is
+    None for guilds that never wrote one.
+    """
+    try:
+        connection = sqlite3.connect(database_path, timeout=LOCK_TIMEOUT_SECONDS)
+        try:
+            connection.executescript(SCHEMA)
+            rows = connection.execute(
+                'SELECT guild_versions.guild_id, protos.data FROM guild_versions '
+                'LEFT JOIN protos ON protos.guild_id = guild_versions.guild_id AND protos.name = ?',
+                (CLAN_WATCHLIST_NAME,)
+            ).fetchall()
+        finally:
+            connection.close()
+    except sqlite3.Error:
+        raise IOError("Impossible de lire les listes des clans du stockage.")
+    clan_watchlists = {}
+    for (guild_id, data) in rows:
+        clan_watchlists[guild_id] = None
+        if data is not None:
+            clan_watchlists[guild_id] = ClanWatchlist()
+            clan_watchlists[guild_id].ParseFromString(data)
+    return clan_watchlists
+
+
+def migrate_guilds(root_directory, database_path, apply_intent=None):
+    """
+    Imports the .dat files of every guild into a SQLite database. Guilds that already have data
+    in the database are left untouched, so the migration can be run again safely. The files are
+    kept, to go back to the file storage if needed.
+    :param root_directory: The directory of the guild storages, one subdirectory per guild.
+    :param database_path: The SQLite database.
+    :param apply_intent: Optional function that applies an ActivityIntent to a schedule. If set,
+    the schedules journaled by a previous run are replayed, instead of only reading the schedule
+    files. See Storage.
+    :return: The identifiers of the migrated guilds.
+    """
+    try:
+        guild_ids = sorted(
+            int(path.name) for path in Path(root_directory).iterdir()
+            if path.is_dir() and path.name.isdigit()
+        )
+    except OSError:
+        raise IOError("Impossible de lister les serveurs à migrer.")
+    migrated_guild_ids = []
+    for guild_id in guild_ids:
+        sqlite_storage = SqliteStorage(database_path, guild_id)
+        if sqlite_storage.is_empty():
+            sqlite_storage.import_storage(
+                Storage(Path(root_directory).joinpath(str(guild_id)), apply_intent)
+            )
+            migrated_guild_ids.append(guild_id)
+        sqlite_storage.close()
+    return migrated_guild_ids
@@ -0,0 +1,231 @@
+from pathlib import Path
+import tempfile
+import unittest
+from components.storage import sqlite_storage
+from components.storage.storage import Storage
+from protos.activity_pb2 import Activity
+from protos.activity_id_pb2 import ActivityID
+from protos.api_bundle_pb2 import APIBundle
+from protos.clan_watchlist_pb2 import ClanWatchlist
+from protos.intent_pb2 import ActivityIntent
+from protos.rated_player_pb2 import RatedPlayer
+from protos.schedule_pb2 import Schedule
+from protos.sync_state_pb2 import PlayerLookups
+from protos.sync_state_pb2 import SyncCheckpoint
+from protos.sync_state_pb2 import SyncState
+
+
+def make_schedule(activities):
+    """
+    :param activities: A [(ActivityID.Type, datetime, [gamer_tag])] list.
+    :return: A schedule with the given activities and squads.
+    """
+    schedule = Schedule()
+    for (activity_type, datetime, gamer_tags) in activities:
+        activity = schedule.activities.add()
+        activity.id.type = activity_type
+        if datetime:
+            activity.id.when.datetime = datetime
+            activity.id.when.time_specified = True
+        for gamer_tag in gamer_tags:
+            player = activity.squad.players.add()
+            player.gamer_tag = gamer_tag
+            player.rating = RatedPlayer.Rating.EXPERIENCED
+    return schedule
+
+
+class SqliteStorageTest(unittest.TestCase):
+    """Test class for the SQLite storage."""
+
+    def setUp(self):
+        """Sets up a basic sut."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.database_path = Path(self.directory.name).joinpath('storage.sqlite')
+        self.sut = sqlite_storage.SqliteStorage(self.database_path, 1)
+
+    def tearDown(self):
+        """Performs some cleanups at the end of each test."""
+        self.sut.close()
+        self.directory.cleanup()
+
+    def test_protos_write_then_read(self):
+        """Writes then reads every serialized proto to/from the storage."""
+        bundle = APIBundle()
+        bundle.last_sync_datetime = '2020-08-12T18:15:00+02:00'
+        bundle.stats_by_player['Oby1Chick'].activity_stats.add().completions = 4
+        sync_state = SyncState()
+        sync_state.characters_by_id['21'].date_last_played = '2020-08-01T20:00:00Z'
+        checkpoint = SyncCheckpoint()
+        checkpoint.started_datetime = '2020-08-12T18:15:00+02:00'
+        lookups = PlayerLookups()
+        lookups.sync_state.players_by_account_id['destiny:1'].gamer_tag = 'Walnut Waffle'
+        clan_watchlist = ClanWatchlist()
+        clan_watchlist.clan_ids.extend([696852, 4220683])
+        self.assertTrue(self.sut.is_empty())
+        self.assertRaises(IOError, self.sut.read_api_bundle)
+        self.sut.write_api_bundle(bundle)
+        self.sut.write_sync_state(sync_state)
+        self.sut.write_sync_checkpoint(checkpoint)
+        self.sut.write_player_lookups(lookups)
+        self.sut.write_clan_watchlist(clan_watchlist)
+        self.assertFalse(self.sut.is_empty())
+        other_sut = sqlite_storage.SqliteStorage(self.database_path, 1)
+        self.assertEqual(other_sut.read_api_bundle(), bundle)
+        self.assertEqual(other_sut.read_sync_state(), sync_state)
+        self.assertEqual(other_sut.read_sync_checkpoint(), checkpoint)
+        self.assertEqual(other_sut.read_player_lookups(), lookups)
+        self.assertEqual(other_sut.read_clan_watchlist(), clan_watchlist)
+        other_sut.delete_sync_checkpoint()
+        self.assertRaises(IOError, self.sut.read_sync_checkpoint)
+        other_guild_sut = sqlite_storage.SqliteStorage(self.database_path, 2)
+        self.assertRaises(IOError, other_guild_sut.read_api_bundle)
+        other_guild_sut.close()
+        self.assertRaises(ValueError, self.sut.write_api_bundle, SyncState())
+        other_sut.close()
+
+    def test_schedule_write_then_read(self):
+        """Writes then reads schedules, including rewrites of every kind."""
+        self.assertRaises(IOError, self.sut.read_schedule)
+        self.sut.write_schedule(Schedule())
+        self.assertEqual(self.sut.read_schedule(), Schedule())
+        schedules = [
+            make_schedule([
+                (ActivityID.Type.LAST_WISH, '2020-9-1 21:00', ['Oby1Chick', 'Walnut Waffle']),
+                (ActivityID.Type.LEVIATHAN, '', []),
+                (ActivityID.Type.GARDEN_OF_SALVATION, '2020-9-2 21:00', ['croptus']),
+            ]),
+            make_schedule([
+                (ActivityID.Type.SPIRE_OF_STARS, '', ['Batman']),
+                (ActivityID.Type.LAST_WISH, '2020-9-1 21:00', ['Oby1Chick']),
+                (ActivityID.Type.GARDEN_OF_SALVATION, '2020-9-2 21:00', ['croptus']),
+                (ActivityID.Type.CROWN_OF_SORROW, '', []),
+            ]),
+            make_schedule([
+                (ActivityID.Type.GARDEN_OF_SALVATION, '2020-9-2 21:00', ['croptus']),
+            ]),
+            Schedule(),
+        ]
+        schedules[1].activities[0].squad.substitutes.add().gamer_tag = 'Robin'
+        for schedule in schedules:
+            self.sut.write_schedule(schedule)
+            other_sut = sqlite_storage.SqliteStorage(self.database_path, 1)
+            self.assertEqual(other_sut.read_schedule(), schedule)
+            other_sut.close()
+        self.assertRaises(ValueError, self.sut.write_schedule, APIBundle())
+
+    def test_row_level_schedule_updates(self):
+        """Verifies changing, clearing or adding one activity only touches its rows."""
+        schedule = make_schedule([
+            (ActivityID.Type.LAST_WISH, f'2020-9-{day} 21:00', ['Oby1Chick', 'Walnut Waffle'])
+            for day in range(1, 11)
+        ])
+        self.sut.write_schedule(schedule)
+        row_changes = self.sut.stats()['row_changes']
+        # Each write also bumps the version row of the guild.
+        schedule.activities[4].state = Activity.State.FINISHED
+        self.sut.write_schedule(schedule)
+        self.assertEqual(self.sut.stats()['row_changes'], row_changes + 2)
+        del schedule.activities[2]
+        self.sut.write_schedule(schedule)
+        # The activity row and its 2 squad member rows.
+        self.assertEqual(self.sut.stats()['row_changes'], row_changes + 6)
+        schedule.activities.add().id.type = ActivityID.Type.LEVIATHAN
+        self.sut.write_schedule(schedule)
+        self.assertEqual(self.sut.stats()['row_changes'], row_changes + 8)
+        other_sut = sqlite_storage.SqliteStorage(self.database_path, 1)
+        self.assertEqual(other_sut.read_schedule(), schedule)
+        other_sut.close()
+
+    def test_cached_reads(self):
+        """Verifies reads are served from memory until another connection writes."""
+        other_sut = sqlite_storage.SqliteStorage(self.database_path, 1)
+        schedule = make_schedule([(ActivityID.Type.LAST_WISH, '', [])])
+        self.sut.write_schedule(schedule)
+        self.sut.read_schedule().activities.add()
+        self.assertEqual(self.sut.read_schedule(), schedule)
+        self.assertEqual(self.sut.stats()['hits'], 2)
+        self.assertEqual(self.sut.stats()['parses'], 0)
+        schedule.activities.add().id.type = ActivityID.Type.LEVIATHAN
+        other_sut.write_schedule(schedule)
+        self.assertEqual(self.sut.read_schedule(), schedule)
+        self.assertEqual(self.sut.stats()['parses'], 1)
+        other_sut.clear()
+        self.assertRaises(IOError, self.sut.read_schedule)
+        self.assertTrue(self.sut.is_empty())
+        other_sut.close()
+
+    def test_writes_to_other_guilds_keep_the_cache(self):
+        """Verifies writes to another guild of the database neither drop nor stale the cache."""
+        other_guild_sut = sqlite_storage.SqliteStorage(self.database_path, 2)
+        other_sut = sqlite_storage.SqliteStorage(self.database_path, 1)
+        schedule = make_schedule([(ActivityID.Type.LAST_WISH, '', ['Oby1Chick'])])
+        self.sut.write_schedule(schedule)
+        other_guild_sut.write_schedule(make_schedule([(ActivityID.Type.LEVIATHAN, '', [])]))
+        other_guild_sut.write_api_bundle(APIBundle())
+        self.assertEqual(self.sut.read_schedule(), schedule)
+        self.assertEqual(self.sut.stats()['parses'], 0)
+
+        # The next write is diffed against the rows kept in memory.
+        row_changes = self.sut.stats()['row_changes']
+        schedule.activities[0].state = Activity.State.FINISHED
+        self.sut.write_schedule(schedule)
+        self.assertEqual(self.sut.stats()['row_changes'], row_changes + 2)
+
+        # Until another connection writes the guild.
+        del schedule.activities[0]
+        other_sut.write_schedule(schedule)
+        schedule.activities.add().id.type = ActivityID.Type.CROWN_OF_SORROW
+        self.sut.write_schedule(schedule)
+        self.assertEqual(other_sut.read_schedule(), schedule)
+        self.assertEqual(self.sut.read_schedule(), schedule)
+        other_sut.close()
+        other_guild_sut.close()
+
+    def test_migrate_guilds(self):
+        """Verifies the .dat files of each guild are imported once."""
+        schedule = make_schedule([(ActivityID.Type.LAST_WISH, '2020-9-1 21:00', ['Oby1Chick'])])
+        clan_watchlist = ClanWatchlist()
+        clan_watchlist.clan_ids.append(696852)
+        storage = Storage(Path(self.directory.name).joinpath('42'))
+        storage.write_schedule(schedule)
+        storage.write_clan_watchlist(clan_watchlist)
+        Path(self.directory.name).joinpath('clans').mkdir()
+        self.assertEqual(sqlite_storage.migrate_guilds(self.directory.name, self.database_path),
+                         [42])
+        self.assertEqual(sqlite_storage.migrate_guilds(self.directory.name, self.database_path),
+                         [])
+        sut = sqlite_storage.SqliteStorage(self.database_path, 42)
+        self.assertEqual(sut.read_schedule(), schedule)
+        self.assertEqual(sut.read_clan_watchlist(), clan_watchlist)
+        self.assertRaises(IOError, sut.read_api_bundle)
+        sut.close()
+
+    def test_migrate_journaled_guilds(self):
+        """Verifies the intents journaled since the last snapshot are migrated."""
+        def apply_intent(schedule, activity_intent):
+            schedule.activities.add().id.CopyFrom(activity_intent.activity_id)
+
+        storage = Storage(Path(self.directory.name).joinpath('42'), apply_intent)
+        storage.write_schedule(Schedule())
+        schedule = storage.read_schedule()
+        activity_intent = ActivityIntent()
+        activity_intent.activity_id.type = ActivityID.Type.LAST_WISH
+        activity_intent.upsert_squad.SetInParent()
+        apply_intent(schedule, activity_intent)
+        storage.append_activity_intent(activity_intent, schedule)
+        self.assertEqual(
+            sqlite_storage.migrate_guilds(self.directory.name, self.database_path, apply_intent),
+            [42]
+        )
+        sut = sqlite_storage.SqliteStorage(self.database_path, 42)
+        self.assertEqual(sut.read_schedule(), schedule)
+        sut.close()
+        self.assertEqual(
+            Storage(Path(self.directory.name).joinpath('42'), apply_intent, journaled=False)
+            .read_schedule(),
+            schedule
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,24 +1,120 @@
+import os
 from pathlib import Path
 import shutil
+from components.storage.schedule_journal import ScheduleJournal
 from protos.api_bundle_pb2 import APIBundle
+from protos.clan_watchlist_pb2 import ClanWatchlist
+from protos.intent_pb2 import ActivityIntent
 from protos.schedule_pb2 import Schedule
+from protos.sync_state_pb2 import PlayerLookups
+from protos.sync_state_pb2 import SyncCheckpoint
+from protos.sync_state_pb2 import SyncState
 
 API_BUNDLE_FILE = Path('api_bundle.dat')
 PLANNING_FILE = Path('schedule.dat')
+SYNC_STATE_FILE = Path('sync_state.dat')
+SYNC_CHECKPOINT_FILE = Path('sync_checkpoint.dat')
+PLAYER_LOOKUPS_FILE = Path('player_lookups.dat')
+CLAN_WATCHLIST_FILE = Path('clan_watchlist.dat')
 
 class Storage:
-    """Parser for user input (intents)."""
+    """
+    Storage of the protos of a guild, one file per proto.
+    Parsed protos are kept in memory: reading a file that has not been modified since the last
+    read or write costs a stat and a copy, without disk read nor parse.
+    The schedule can be journaled instead of rewritten, see ScheduleJournal.
+    """
 
-    def __init__(self, root_directory):
+    def __init__(self, root_directory, apply_intent=None, journaled=True):
+        """
+        :param root_directory: The directory of the guild.
+        :param apply_intent: Optional function (schedule, ActivityIntent) that applies an intent
+        to a schedule in place. If given, the schedule is journaled: executed intents are
+        appended with |append_activity_intent| and replayed on reads.
+        :param journaled: If false, |apply_intent| is only used to fold the journal left by a
+        journaled storage of the guild into the schedule file, which is then written as a whole.
+        """
         try:
             self.__root_path = Path(root_directory)
             self.__root_path.mkdir(parents=True, exist_ok=True)
         except:
             raise IOError("Impossible d'initialiser le stockage.")
+        # {filename: ((modification time, size) of the file, parsed proto)}
+        self.__messages_by_file = {}
+        self.__stats = {'hits': 0, 'parses': 0}
+        self.__journal = None
+        if apply_intent is not None:
+            journal = ScheduleJournal(self.__root_path, apply_intent, PLANNING_FILE)
+            if journaled:
+                self.__journal = journal
+            elif journal.has_files():
+                journal.fold()
+
+    def stats(self):
+        """
+        :return: A dict with the number of reads served from memory (hits) and of files parsed
+        (parses).
+        """
+        return dict(self.__stats)
+
+    def __file_version(self, filepath):
+        """:return: The (modification time, size) of the file, to detect outside writes."""
+        stat = filepath.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    def __read_message(self, filename, message_class, error_message):
+        """
+        Reads a proto from the storage, or from memory if the file has not changed since.
+        :param filename: The file of the proto.
+        :param message_class: The class of the proto.
+        :param error_message: The message of the IOError raised on failure.
+        :return: A copy of the read proto, that the caller may modify.
+        """
+        try:
+            filepath = self.__root_path.joinpath(filename)
+            version = self.__file_version(filepath)
+            cached = self.__messages_by_file.get(filename)
+            if cached is not None and cached[0] == version:
+                self.__stats['hits'] += 1
+            else:
+                cached_message = message_class()
+                cached_message.ParseFromString(filepath.read_bytes())
+                cached = (version, cached_message)
+                self.__messages_by_file[filename] = cached
+                self.__stats['parses'] += 1
+            message = message_class()
+            message.CopyFrom(cached[1])
+        except:
+            self.__messages_by_file.pop(filename, None)
+            raise IOError(error_message)
+        return message
+
+    def __write_message(self, filename, message, error_message):
+        """
+        Writes a proto to the storage and keeps a copy in memory. The file is replaced atomically,
+        so that reads from other threads see the previous or the new proto only.
+        :param filename: The file of the proto.
+        :param message: The proto to write.
+        :param error_message: The message of the IOError raised on failure.
+        """
+        try:
+            filepath = self.__root_path.joinpath(filename)
+            temporary_filepath = filepath.with_name(filepath.name + '.tmp')
+            temporary_filepath.write_bytes(message.SerializeToString())
+            os.replace(temporary_filepath, filepath)
+            cached_message = type(message)()
+            cached_message.CopyFrom(message)
+            self.__messages_by_file[filename] = (self.__file_version(filepath), cached_message)
+        except:
+            self.__messages_by_file.pop(filename, None)
+            raise IOError(error_message)
 
     def clear(self):
         """Clears all the contents inside self.__path."""
         try:
+            self.__messages_by_file.clear()
+            if self.__journal is not None:
+                self.__journal.forget()
             shutil.rmtree(self.__root_path)
             self.__root_path.mkdir(parents=True, exist_ok=True)
         except:
@@ -29,14 +125,9 @@ class Storage:
         Reads the API Bundle that is saved to the storage.
         :return: The read API Bundle.
         """
-        try:
-            filepath = self.__root_path.joinpath(API_BUNDLE_FILE)
-            data = filepath.read_bytes()
-            bundle = APIBundle()
-            bundle.ParseFromString(data)
-        except:
-            raise IOError("Impossible de lire l'API Bundle du stockage.")
-        return bundle
+        return self.__read_message(
+            API_BUNDLE_FILE, APIBundle, "Impossible de lire l'API Bundle du stockage."
+        )
 
     def write_api_bundle(self, api_bundle):
         """
@@ -45,26 +136,127 @@ class Storage:
         """
         if not isinstance(api_bundle, APIBundle):
             raise ValueError("L'API Bundle à écrire est invalide.")
+        self.__write_message(
+            API_BUNDLE_FILE, api_bundle, "Impossible d'écrire l'API Bundle dans le stockage."
+        )
+
+    def read_sync_state(self):
+        """
+        Reads the state of the last sync that is saved to the storage.
+        :return: The read sync state.
+        """
+        return self.__read_message(
+            SYNC_STATE_FILE, SyncState, "Impossible de lire l'état de synchronisation du stockage."
+        )
+
+    def write_sync_state(self, sync_state):
+        """
+        Writes the given sync state to the storage.
+        :param sync_state: The sync state to write.
+        """
+        if not isinstance(sync_state, SyncState):
+            raise ValueError("L'état de synchronisation à écrire est invalide.")
+        self.__write_message(
+            SYNC_STATE_FILE, sync_state,
+            "Impossible d'écrire l'état de synchronisation dans le stockage."
+        )
+
+    def read_sync_checkpoint(self):
+        """
+        Reads the checkpoint of the interrupted sync that is saved to the storage.
+        :return: The read sync checkpoint.
+        """
+        return self.__read_message(
+            SYNC_CHECKPOINT_FILE, SyncCheckpoint,
+            "Impossible de lire le point de reprise de synchronisation du stockage."
+        )
+
+    def write_sync_checkpoint(self, checkpoint):
+        """
+        Writes the given sync checkpoint to the storage.
+        :param checkpoint: The sync checkpoint to write.
+        """
+        if not isinstance(checkpoint, SyncCheckpoint):
+            raise ValueError("Le point de reprise de synchronisation à écrire est invalide.")
+        self.__write_message(
+            SYNC_CHECKPOINT_FILE, checkpoint,
+            "Impossible d'écrire le point de reprise de synchronisation dans le stockage."
+        )
+
+    def delete_sync_checkpoint(self):
+        """Deletes the sync checkpoint from the storage, if any."""
         try:
-            filepath = self.__root_path.joinpath(API_BUNDLE_FILE)
-            data = api_bundle.SerializeToString()
-            filepath.write_bytes(data)
+            self.__messages_by_file.pop(SYNC_CHECKPOINT_FILE, None)
+            self.__root_path.joinpath(SYNC_CHECKPOINT_FILE).unlink(missing_ok=True)
         except:
-            raise IOError("Impossible d'écrire l'API Bundle dans le stockage.")
+            raise IOError(
+                "Impossible d'effacer le point de reprise de synchronisation du stockage."
+            )
+
+    def read_player_lookups(self):
+        """
+        Reads the players looked up on demand that are saved to the storage.
+        :return: The read player lookups.
+        """
+        return self.__read_message(
+            PLAYER_LOOKUPS_FILE, PlayerLookups,
+            "Impossible de lire les joueurs recherchés du stockage."
+        )
+
+    def write_player_lookups(self, lookups):
+        """
+        Writes the given player lookups to the storage.
+        :param lookups: The player lookups to write.
+        """
+        if not isinstance(lookups, PlayerLookups):
+            raise ValueError("Les joueurs recherchés à écrire sont invalides.")
+        self.__write_message(
+            PLAYER_LOOKUPS_FILE, lookups,
+            "Impossible d'écrire les joueurs recherchés dans le stockage."
+        )
+
+    def read_clan_watchlist(self):
+        """
+        Reads the clan watchlist that is saved to the storage.
+        :return: The read clan watchlist.
+        """
+        return self.__read_message(
+            CLAN_WATCHLIST_FILE, ClanWatchlist, "Impossible de lire la liste des clans du stockage."
+        )
+
+    def write_clan_watchlist(self, clan_watchlist):
+        """
+        Writes the given clan watchlist to the storage.
+        :param clan_watchlist: The clan watchlist to write.
+        """
+        if not isinstance(clan_watchlist, ClanWatchlist):
+            raise ValueError("La liste des clans à écrire est invalide.")
+        self.__write_message(
+            CLAN_WATCHLIST_FILE, clan_watchlist,
+            "Impossible d'écrire la liste des clans dans le stockage."
+        )
+
+    def is_journaled(self):
+        """:return: Whether the schedule is journaled. See |append_activity_intent|."""
+        return self.__journal is not None
+
+    def journal_stats(self):
+        """:return: The stats of the schedule journal. See ScheduleJournal.stats. Empty if none."""
+        return self.__journal.stats() if self.__journal is not None else {}
 
     def read_schedule(self):
         """
         Reads the schedule that is saved to the storage.
         :return: The read schedule.
         """
-        try:
-            filepath = self.__root_path.joinpath(PLANNING_FILE)
-            data = filepath.read_bytes()
-            bundle = Schedule()
-            bundle.ParseFromString(data)
-        except:
-            raise IOError("Impossible de lire le planning du stockage.")
-        return bundle
+        if self.__journal is not None:
+            try:
+                return self.__journal.read_schedule()
+            except:
+                raise IOError("Impossible de lire le planning du stockage.")
+        return self.__read_message(
+            PLANNING_FILE, Schedule, "Impossible de lire le planning du stockage."
+        )
 
     def write_schedule(self, schedule):
         """
@@ -73,9 +265,27 @@ class Storage:
         """
         if not isinstance(schedule, Schedule):
             raise ValueError("Le planning à écrire est invalide.")
+        if self.__journal is not None:
+            try:
+                self.__journal.write_schedule(schedule)
+            except:
+                raise IOError("Impossible d'écrire le planning dans le stockage.")
+            return
+        self.__write_message(
+            PLANNING_FILE, schedule, "Impossible d'écrire le planning dans le stockage."
+        )
+
+    def append_activity_intent(self, activity_intent, schedule):
+        """
+        Appends an executed intent to the schedule journal, instead of rewriting the schedule.
+        :param activity_intent: The ActivityIntent that was applied to the schedule.
+        :param schedule: The schedule with the intent applied.
+        """
+        if self.__journal is None:
+            raise ValueError("Le planning de ce stockage n'est pas journalisé.")
+        if not isinstance(activity_intent, ActivityIntent) or not isinstance(schedule, Schedule):
+            raise ValueError("La commande à journaliser est invalide.")
         try:
-            filepath = self.__root_path.joinpath(PLANNING_FILE)
-            data = schedule.SerializeToString()
-            filepath.write_bytes(data)
+            self.__journal.append(activity_intent, schedule)
         except:
-            raise IOError("Impossible d'écrire le planning dans le stockage.")
+            raise IOError("Impossible de journaliser la commande dans le stockage.")
@@ -5,8 +5,12 @@ from components.storage import storage
 from protos.activity_pb2 import Activity
 from protos.activity_id_pb2 import ActivityID
 from protos.api_bundle_pb2 import APIBundle
+from protos.clan_watchlist_pb2 import ClanWatchlist
 from protos.schedule_pb2 import Schedule
 from protos.rated_player_pb2 import RatedPlayer
+from protos.sync_state_pb2 import PlayerLookups
+from protos.sync_state_pb2 import SyncCheckpoint
+from protos.sync_state_pb2 import SyncState
 
 
 class StorageTest(unittest.TestCase):
@@ -27,6 +31,8 @@ class StorageTest(unittest.TestCase):
         s = storage.Storage(Path('/'))
         self.assertRaises(IOError, s.write_schedule, Schedule())
         self.assertRaises(IOError, s.write_api_bundle, APIBundle())
+        self.assertRaises(IOError, s.write_sync_state, SyncState())
+        self.assertRaises(IOError, s.write_clan_watchlist, ClanWatchlist())
 
     def test_api_bundle_write_then_read(self):
         """Writes then reads an APIBundle to/from the storage."""
@@ -86,6 +92,67 @@ class StorageTest(unittest.TestCase):
         self.assertEqual(schedule, schedule2)
         self.assertRaises(IOError, self.sut.read_api_bundle)
 
+    def test_sync_state_write_then_read(self):
+        """Writes then reads a sync state to/from the storage."""
+        sync_state = SyncState()
+        character = sync_state.characters_by_id['2305843009260519343']
+        character.date_last_played = '2020-08-11T21:32:07Z'
+        stat = character.activity_stats.add()
+        stat.activity_type = ActivityID.Type.LAST_WISH
+        stat.completions = 12
+        self.assertRaises(IOError, self.sut.read_sync_state)
+        self.sut.write_sync_state(sync_state)
+        self.assertEqual(self.sut.read_sync_state(), sync_state)
+        self.assertRaises(ValueError, self.sut.write_sync_state, APIBundle())
+
+    def test_sync_checkpoint_write_then_read_then_delete(self):
+        """Writes, reads then deletes a sync checkpoint to/from the storage."""
+        checkpoint = SyncCheckpoint()
+        checkpoint.started_datetime = '2020-08-12T18:15:00+02:00'
+        checkpoint.sync_state.players_by_account_id['destiny:1'].gamer_tag = 'Walnut Waffle'
+        self.assertRaises(IOError, self.sut.read_sync_checkpoint)
+        self.sut.write_sync_checkpoint(checkpoint)
+        self.assertEqual(self.sut.read_sync_checkpoint(), checkpoint)
+        self.sut.delete_sync_checkpoint()
+        self.assertRaises(IOError, self.sut.read_sync_checkpoint)
+        self.sut.delete_sync_checkpoint()
+        self.assertRaises(ValueError, self.sut.write_sync_checkpoint, SyncState())
+
+    def test_player_lookups_write_then_read(self):
+        """Writes then reads player lookups to/from the storage."""
+        lookups = PlayerLookups()
+        lookups.api_bundle.stats_by_player['Walnut Waffle'].stale = False
+        lookups.sync_state.players_by_account_id['destiny:1'].gamer_tag = 'Walnut Waffle'
+        self.assertRaises(IOError, self.sut.read_player_lookups)
+        self.sut.write_player_lookups(lookups)
+        self.assertEqual(self.sut.read_player_lookups(), lookups)
+        self.assertRaises(ValueError, self.sut.write_player_lookups, SyncState())
+
+    def test_clan_watchlist_write_then_read(self):
+        """Writes then reads a clan watchlist to/from the storage."""
+        clan_watchlist = ClanWatchlist()
+        clan_watchlist.clan_ids.extend([696852, 4220683])
+        self.assertRaises(IOError, self.sut.read_clan_watchlist)
+        self.sut.write_clan_watchlist(clan_watchlist)
+        self.assertEqual(self.sut.read_clan_watchlist(), clan_watchlist)
+        self.assertRaises(ValueError, self.sut.write_clan_watchlist, [696852])
+
+
+    def test_cached_reads(self):
+        """Verifies unchanged files are read from memory, and files written elsewhere are not."""
+        schedule = Schedule()
+        schedule.activities.add().id.type = ActivityID.Type.LAST_WISH
+        self.sut.write_schedule(schedule)
+        read_schedule = self.sut.read_schedule()
+        read_schedule.activities.add()
+        self.assertEqual(self.sut.read_schedule(), schedule)
+        self.assertEqual(self.sut.stats(), {'hits': 2, 'parses': 0})
+        schedule.activities.add().id.type = ActivityID.Type.LEVIATHAN
+        storage.Storage(self.directory.name).write_schedule(schedule)
+        self.assertEqual(self.sut.read_schedule(), schedule)
+        self.assertEqual(self.sut.stats(), {'hits': 2, 'parses': 1})
+        self.sut.clear()
+        self.assertRaises(IOError, self.sut.read_schedule)
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,195 @@
+import asyncio
+from datetime import datetime
+import random
+from dateutil import tz
+from components.api_fetcher.api_fetcher import Fetcher
+from components.storage.clan_cache import ClanCache
+from protos.sync_state_pb2 import SyncState
+
+# Every synced clan is refreshed about once per period.
+SYNC_PERIOD_SECONDS = 6 * 3600
+# The delays between two clan syncs vary by up to that fraction, so that they do not line up
+# with other periodic loads.
+JITTER_RATIO = 0.2
+# How long to wait when a sync started by a command is running.
+BUSY_RETRY_SECONDS = 30
+TIMEZONE = tz.gettz('Europe/Paris')
+
+
+class SchedulerOptions:
+    """
+    Pacing of a SyncScheduler. Every option has a default, overridden by keyword, e.g
+    SchedulerOptions(period_seconds=3600).
+    - period_seconds: Every clan is refreshed about once per that many seconds.
+    - jitter_ratio: The delays between two clan syncs vary by up to that fraction.
+    - busy_retry_seconds: How long to wait when another sync is running.
+    - timezone: The timezone of the sync datetimes.
+    - seed: Optional seed of the jitter.
+    """
+    period_seconds = SYNC_PERIOD_SECONDS
+    jitter_ratio = JITTER_RATIO
+    busy_retry_seconds = BUSY_RETRY_SECONDS
+    timezone = TIMEZONE
+    seed = None
+
+    def __init__(self, **options):
+        """
+        :param options: The options that differ from their default.
+        :raises: ValueError if an option is unknown or invalid.
+        """
+        for name, value in options.items():
+            if name.startswith('_') or not hasattr(SchedulerOptions, name):
+                raise ValueError("Option des synchros en arrière-plan inconnue: " + name)
+            setattr(self, name, value)
+        if self.period_seconds <= 0:
+            raise ValueError("Période de synchronisation invalide")
+        if not 0 <= self.jitter_ratio < 1:
+            raise ValueError("Variation de la période de synchronisation invalide")
+
+
+class SyncScheduler:
+    """
+    Refreshes the clans of the clan cache in the background, so that commands read recent stats
+    without waiting for Bungie. Only the clans that a guild still watches are refreshed.
+    Clans are synced one at a time, the stalest first, with the period spread evenly between them.
+    Syncs started by commands come first: the scheduler waits while one is running.
+    The clan cache and the watchlists are read off the event loop.
+    """
+
+    def __init__(self, fetcher, clan_cache, options=None, watched_clans=None):
+        """
+        :param fetcher: The Fetcher of Bungie stats.
+        :param clan_cache: The process-wide ClanCache to keep up to date.
+        :param options: Optional SchedulerOptions. Defaults to SchedulerOptions().
+        :param watched_clans: Optional function that returns the clans on the watchlist of at
+        least one guild, e.g. GuildCache.watched_clan_ids. Defaults to every synced clan.
+        """
+        assert isinstance(fetcher, Fetcher), "Connexion API non configurée"
+        assert isinstance(clan_cache, ClanCache), "Cache des clans non configuré"
+        if options is None:
+            options = SchedulerOptions()
+        if not isinstance(options, SchedulerOptions):
+            raise ValueError("Options des synchros en arrière-plan invalides")
+        self.__fetcher = fetcher
+        self.__clan_cache = clan_cache
+        self.__options = options
+        self.__random = random.Random(options.seed)
+        self.__watched_clans = watched_clans
+        self.__task = None
+        self.__stats = {'syncs': 0, 'skipped': 0, 'postponed': 0, 'errors': 0}
+
+    def stats(self):
+        """
+        :return: A dict with the number of clan syncs (syncs), of turns where every clan was
+        recent enough (skipped), of turns postponed by another sync (postponed) and of failed
+        syncs (errors).
+        """
+        return dict(self.__stats)
+
+    def refreshed_clans(self):
+        """:return: The synced clans that a guild still watches, sorted."""
+        clan_ids = self.__clan_cache.synced_clans()
+        if self.__watched_clans is None:
+            return clan_ids
+        watched_clan_ids = set(self.__watched_clans())
+        return [clan_id for clan_id in clan_ids if clan_id in watched_clan_ids]
+
+    def delay(self):
+        """:return: The seconds to wait before the next clan sync."""
+        try:
+            clans = len(self.refreshed_clans())
+        except IOError:
+            clans = 1
+        gap = self.__options.period_seconds / max(clans, 1)
+        jitter_ratio = self.__options.jitter_ratio
+        return gap * (1 + self.__random.uniform(-jitter_ratio, jitter_ratio))
+
+    def stalest_clan(self, now):
+        """
+        :param now: Now as a datetime.
+        :return: The refreshed clan with the oldest sync, or None if every clan has been synced
+        within the last half period, e.g. by a command.
+        """
+        stalest_clan_id = None
+        stalest_sync = None
+        for clan_id in self.refreshed_clans():
+            bundle = self.__clan_cache.read_columnar_bundle(clan_id)
+            try:
+                last_sync = datetime.fromisoformat(bundle.last_sync_datetime())
+            except ValueError:
+                return clan_id
+            if stalest_sync is None or last_sync < stalest_sync:
+                stalest_clan_id = clan_id
+                stalest_sync = last_sync
+        if stalest_sync is None or \
+                (now - stalest_sync).total_seconds() < self.__options.period_seconds / 2:
+            return None
+        return stalest_clan_id
+
+    async def sync_clan(self, clan_id, now):
+        """
+        Syncs a clan incrementally and writes it to the clan cache. The clan cache is read and
+        written off the event loop.
+        :param clan_id: The clan identifier in the form of an integer.
+        :param now: Now as a datetime.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            sync_state = await loop.run_in_executor(
+                None, self.__clan_cache.read_sync_state, clan_id
+            )
+        except IOError:
+            sync_state = SyncState()
+        bundles_by_clan = await self.__fetcher.fetch_clans_async(now, {clan_id: sync_state})
+        await loop.run_in_executor(
+            None, self.__clan_cache.write_clan, clan_id, bundles_by_clan[clan_id], sync_state
+        )
+
+    async def run_once(self, now=None):
+        """
+        Syncs the stalest clan, unless another sync is running.
+        :param now: Now as a datetime. Defaults to the current time.
+        :return: Whether the turn is over. False if it was postponed.
+        """
+        if self.__fetcher.syncs_in_flight():
+            self.__stats['postponed'] += 1
+            return False
+        now = now or datetime.now(self.__options.timezone)
+        clan_id = await asyncio.get_running_loop().run_in_executor(None, self.stalest_clan, now)
+        if clan_id is None:
+            self.__stats['skipped'] += 1
+            return True
+        await self.sync_clan(clan_id, now)
+        self.__stats['syncs'] += 1
+        return True
+
+    def start(self):
+        """Runs |run| in the background on the running event loop, until |stop|."""
+        if self.__task is None:
+            self.__task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        """Cancels the background syncs started with |start|, if any."""
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+
+    async def run(self):
+        """Refreshes the clans until cancelled. Failed syncs are retried at the next turns."""
+        loop = asyncio.get_running_loop()
+        delay = await loop.run_in_executor(None, self.delay)
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                done = await self.run_once()
+            except asyncio.CancelledError:
+                print("Synchronisations en arrière-plan arrêtées.")
+                raise
+            except Exception as e:
+                self.__stats['errors'] += 1
+                print("Échec de la synchronisation en arrière-plan: " + str(e))
+                done = True
+            if done:
+                delay = await loop.run_in_executor(None, self.delay)
+            else:
+                delay = self.__options.busy_retry_seconds
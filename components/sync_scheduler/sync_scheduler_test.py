@@ -0,0 +1,124 @@
+import asyncio
+from datetime import datetime
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+from dateutil import tz
+from components.api_fetcher.api_fetcher import Fetcher
+from components.storage.clan_cache import ClanCache
+from components.sync_scheduler import sync_scheduler
+from protos.api_bundle_pb2 import APIBundle
+from protos.sync_state_pb2 import SyncState
+
+SUT_NOW = datetime(2020, 8, 12, 18, 15, 0, 0, tz.gettz('Europe/Paris'))
+
+
+def make_bundle(last_sync_datetime):
+    """:return: An API Bundle synced at |last_sync_datetime|."""
+    bundle = APIBundle()
+    bundle.last_sync_datetime = last_sync_datetime
+    return bundle
+
+
+class SyncSchedulerTest(unittest.TestCase):
+    """Test class for the background refresh of clans."""
+
+    def setUp(self):
+        """Sets up a clan cache with two clans and a sut."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.clan_cache = ClanCache(self.directory.name)
+        self.clan_cache.write_clan(1, make_bundle('2020-08-12T10:00:00+02:00'), SyncState())
+        self.clan_cache.write_clan(2, make_bundle('2020-08-12T08:00:00+02:00'), SyncState())
+        self.fetcher = Fetcher('key')
+        self.synced_clans = []
+
+        async def fetch_clans_async(now, sync_states_by_clan):
+            self.synced_clans.extend(sync_states_by_clan.keys())
+            return {
+                clan_id: make_bundle(now.isoformat()) for clan_id in sync_states_by_clan.keys()
+            }
+
+        self.fetcher.fetch_clans_async = MagicMock(side_effect=fetch_clans_async)
+        self.sut = sync_scheduler.SyncScheduler(
+            self.fetcher, self.clan_cache, sync_scheduler.SchedulerOptions(seed=1)
+        )
+
+    def tearDown(self):
+        """Performs some cleanups at the end of each test."""
+        self.fetcher.close()
+        self.directory.cleanup()
+
+    def test_stalest_clan_first(self):
+        """Verifies clans are synced stalest first, then skipped while recent."""
+        self.assertTrue(asyncio.run(self.sut.run_once(SUT_NOW)))
+        self.assertTrue(asyncio.run(self.sut.run_once(SUT_NOW)))
+        self.assertTrue(asyncio.run(self.sut.run_once(SUT_NOW)))
+        self.assertEqual(self.synced_clans, [2, 1])
+        self.assertEqual(self.clan_cache.read_clan_bundle(2).last_sync_datetime,
+                         SUT_NOW.isoformat())
+        self.assertEqual(self.sut.stats(), {'syncs': 2, 'skipped': 1, 'postponed': 0, 'errors': 0})
+
+    def test_unwatched_clans_are_not_refreshed(self):
+        """Verifies clans that no guild watches anymore are left out of the turns and delays."""
+        watched_clans = MagicMock(return_value={1, 3})
+        self.sut = sync_scheduler.SyncScheduler(
+            self.fetcher, self.clan_cache, sync_scheduler.SchedulerOptions(seed=1), watched_clans
+        )
+        self.assertTrue(asyncio.run(self.sut.run_once(SUT_NOW)))
+        self.assertTrue(asyncio.run(self.sut.run_once(SUT_NOW)))
+        self.assertEqual(self.synced_clans, [1])
+        self.assertGreaterEqual(self.sut.delay(), sync_scheduler.SYNC_PERIOD_SECONDS * 0.8)
+
+    def test_cancellation(self):
+        """Verifies the background loop stops when cancelled, even during a sync."""
+        sync_started = asyncio.Event()
+
+        async def endless_fetch(*_):
+            sync_started.set()
+            await asyncio.Event().wait()
+        self.fetcher.fetch_clans_async = MagicMock(side_effect=endless_fetch)
+        self.sut = sync_scheduler.SyncScheduler(
+            self.fetcher, self.clan_cache,
+            sync_scheduler.SchedulerOptions(period_seconds=0.01, seed=1)
+        )
+
+        async def run():
+            task = asyncio.ensure_future(self.sut.run())
+            await sync_started.wait()
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            sync_started.clear()
+            self.sut.start()
+            await sync_started.wait()
+            self.sut.stop()
+            await asyncio.sleep(0)
+        asyncio.run(run())
+        self.assertEqual(self.sut.stats()['errors'], 0)
+
+    def test_busy_fetcher(self):
+        """Verifies turns are postponed while another sync is running."""
+        self.fetcher.syncs_in_flight = MagicMock(return_value=1)
+        self.assertFalse(asyncio.run(self.sut.run_once(SUT_NOW)))
+        self.assertEqual(self.synced_clans, [])
+        self.assertEqual(self.sut.stats()['postponed'], 1)
+
+    def test_delay(self):
+        """Verifies the period is spread between clans, within the jitter."""
+        for _ in range(100):
+            delay = self.sut.delay()
+            self.assertGreaterEqual(delay, sync_scheduler.SYNC_PERIOD_SECONDS / 2 * 0.8)
+            self.assertLessEqual(delay, sync_scheduler.SYNC_PERIOD_SECONDS / 2 * 1.2)
+
+    def test_invalid_configuration(self):
+        """Verifies invalid configurations are rejected."""
+        self.assertRaises(ValueError, sync_scheduler.SchedulerOptions, period_seconds=0)
+        self.assertRaises(ValueError, sync_scheduler.SchedulerOptions, jitter_ratio=1)
+        self.assertRaises(ValueError, sync_scheduler.SchedulerOptions, period=60)
+        self.assertRaises(
+            ValueError, sync_scheduler.SyncScheduler, self.fetcher, self.clan_cache, 60
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()